@@ -3,9 +3,9 @@ API endpoints para Background Tasks
 Sistema de monitoramento e controle de tasks assíncronas
 """
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query, Body
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Body, Header, Request
 from fastapi.responses import StreamingResponse
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from datetime import datetime, timedelta, timezone
 import json
 import asyncio
@@ -21,9 +21,17 @@ from core.background_tasks import (
     TaskPriority,
     TaskType,
     submit_document_processing,
+    build_document_task,
+    document_needs_sharding,
     submit_webhook_delivery,
     submit_analytics_processing,
-    submit_n8n_sync
+    submit_n8n_sync,
+    TERMINAL_STATUSES,
+    TASK_STREAM_HEARTBEAT,
+    TASK_BULK_PIPELINE_SIZE,
+    TASK_BULK_PIPELINE_MAX_BYTES,
+    TASK_DLQ_REPLAY_BATCH,
+    TASK_DLQ_REPLAY_RATE
 )
 
 router = APIRouter(prefix="/api/background", tags=["Background Tasks"])
@@ -35,13 +43,16 @@ class TaskSubmissionRequest(BaseModel):
     priority: TaskPriority = TaskPriority.NORMAL
     payload: Dict[str, Any]
     scheduled_for: Optional[datetime] = None
+    dependencies: List[str] = Field(default_factory=list)
     tags: List[str] = Field(default_factory=list)
 
 class DocumentProcessingRequest(BaseModel):
     document_id: str
     content: str
     chunk_size: int = Field(default=1000, ge=100, le=5000)
+    chunk_overlap: int = Field(default=0, ge=0, le=500)  # em tokens
     priority: TaskPriority = TaskPriority.NORMAL
+    sharded: Optional[bool] = None  # None: automático pelo tamanho do documento
 
 class WebhookDeliveryRequest(BaseModel):
     webhook_url: str = Field(..., regex=r"^https?://")
@@ -67,6 +78,13 @@ class TaskFilter(BaseModel):
     date_to: Optional[datetime] = None
     tags: Optional[List[str]] = None
 
+class DeadLetterRequeueRequest(BaseModel):
+    task_type: Optional[TaskType] = None
+    task_ids: Optional[List[str]] = None
+    limit: int = Field(default=1000, ge=1, le=10000)
+    batch_size: int = Field(default=TASK_DLQ_REPLAY_BATCH, ge=1, le=1000)
+    rate: float = Field(default=TASK_DLQ_REPLAY_RATE, gt=0, le=5000)  # tasks/s
+
 class TaskSearchResponse(BaseModel):
     tasks: List[TaskResult]
     total: int
@@ -76,11 +94,44 @@ class TaskSearchResponse(BaseModel):
 
 class QueueStatsResponse(BaseModel):
     queues: Dict[str, Dict[str, int]]
+    pools: Dict[str, Dict[str, Any]] = {}
+    organizations: Dict[str, Dict[str, Any]] = {}
+    dead_letter: Dict[str, int] = {}
     total_pending: int
     total_running: int
     total_retrying: int
     worker_status: str
 
+async def read_bulk_items(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    """Itens do corpo em lote: array JSON ou NDJSON (um objeto por linha, lido em streaming)"""
+    content_type = request.headers.get("content-type", "")
+    
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = bytearray()
+        index = 0
+        async for chunk in request.stream():
+            buffer.extend(chunk)
+            if b"\n" not in chunk:
+                continue
+            *lines, rest = buffer.split(b"\n")
+            buffer = bytearray(rest)
+            for line in lines:
+                if line.strip():
+                    yield index, json.loads(line)
+                    index += 1
+        if buffer.strip():
+            yield index, json.loads(buffer)
+        return
+    
+    items = await request.json()
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or NDJSON (application/x-ndjson)"
+        )
+    for index, item in enumerate(items):
+        yield index, item
+
 # Endpoints principais
 
 @router.post("/tasks", response_model=Dict[str, str])
@@ -100,23 +151,107 @@ async def submit_task(
             organization_id=current_user.organization_id,
             user_id=current_user.id,
             scheduled_for=request.scheduled_for,
+            dependencies=request.dependencies,
             tags=request.tags
         )
         
         task_id = await task_manager.submit_task(task)
         
+        if request.dependencies:
+            return {
+                "task_id": task_id,
+                "status": "waiting",
+                "message": f"Task {request.name} waiting for {len(request.dependencies)} dependencies"
+            }
+        
+        scheduled_for = request.scheduled_for
+        if scheduled_for and scheduled_for.tzinfo is None:
+            scheduled_for = scheduled_for.replace(tzinfo=timezone.utc)
+        
+        if scheduled_for and scheduled_for > datetime.now(timezone.utc):
+            return {
+                "task_id": task_id,
+                "status": "scheduled",
+                "message": f"Task {request.name} scheduled for {request.scheduled_for.isoformat()}"
+            }
+        
         return {
             "task_id": task_id,
             "status": "submitted",
             "message": f"Task {request.name} submitted successfully"
         }
-        
+    
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to submit task: {str(e)}"
         )
 
+@router.post("/tasks/bulk")
+async def submit_bulk_tasks(
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Submete tasks em lote (array JSON ou NDJSON em streaming), enfileiradas em pipelines
+    """
+    task_ids = []
+    errors = []
+    batch: List[TaskDefinition] = []
+    
+    try:
+        async for index, item in read_bulk_items(request):
+            try:
+                entry = TaskSubmissionRequest.model_validate(item)
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+                continue
+            
+            batch.append(TaskDefinition(
+                name=entry.name,
+                task_type=entry.task_type,
+                priority=entry.priority,
+                payload=entry.payload,
+                organization_id=current_user.organization_id,
+                user_id=current_user.id,
+                scheduled_for=entry.scheduled_for,
+                dependencies=entry.dependencies,
+                tags=entry.tags
+            ))
+            
+            if len(batch) >= TASK_BULK_PIPELINE_SIZE:
+                task_ids.extend(await task_manager.submit_tasks_bulk(batch))
+                batch = []
+        
+        if batch:
+            task_ids.extend(await task_manager.submit_tasks_bulk(batch))
+    
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid bulk request after {len(task_ids)} tasks submitted: {str(e)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to submit tasks in bulk: {str(e)}"
+        )
+    
+    return {
+        "task_ids": task_ids,
+        "submitted": len(task_ids),
+        "errors": errors,
+        "status": "submitted",
+        "message": f"{len(task_ids)} tasks submitted"
+    }
+
 @router.post("/tasks/document-processing", response_model=Dict[str, str])
 async def submit_document_processing_task(
     request: DocumentProcessingRequest,
@@ -132,7 +267,9 @@ async def submit_document_processing_task(
             organization_id=current_user.organization_id,
             user_id=current_user.id,
             chunk_size=request.chunk_size,
-            priority=request.priority
+            priority=request.priority,
+            chunk_overlap=request.chunk_overlap,
+            sharded=request.sharded
         )
         
         return {
@@ -254,14 +391,16 @@ async def get_task_status(
 @router.get("/tasks/{task_id}/logs")
 async def get_task_logs(
     task_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Obtém logs detalhados de uma task
+    Obtém logs detalhados de uma task (paginados)
     """
-    task_result = await task_manager.get_task_status(task_id)
+    page = await task_manager.get_task_logs(task_id, offset=offset, limit=limit)
     
-    if not task_result:
+    if page is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Task {task_id} not found"
@@ -269,50 +408,88 @@ async def get_task_logs(
     
     return {
         "task_id": task_id,
-        "logs": task_result.logs,
-        "total_logs": len(task_result.logs)
+        "logs": page["logs"],
+        "total_logs": page["total"],
+        "offset": offset,
+        "limit": limit,
+        "has_more": offset + len(page["logs"]) < page["total"]
     }
 
 @router.get("/tasks/{task_id}/stream")
 async def stream_task_progress(
     task_id: str,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Stream de progresso em tempo real de uma task
+    Stream de progresso em tempo real de uma task (Server-Sent Events via pub/sub)
     """
+    try:
+        resume_from = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        resume_from = 0
+    
+    def format_event(event: Dict[str, Any]) -> str:
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    
     async def generate_progress():
-        last_progress = -1
+        # Assinar antes de ler o estado para não perder eventos entre as duas leituras
+        pubsub = task_manager.redis_client.pubsub()
+        await pubsub.subscribe(task_manager.task_events_channel(task_id))
         
-        while True:
-            task_result = await task_manager.get_task_status(task_id)
+        try:
+            yield "retry: 3000\n\n"
             
-            if not task_result:
-                yield f"data: {json.dumps({'error': 'Task not found'})}\n\n"
-                break
+            snapshot = await task_manager.get_task_snapshot(task_id)
+            if not snapshot:
+                yield f"event: error\ndata: {json.dumps({'error': 'Task not found'})}\n\n"
+                return
             
-            if task_result.progress != last_progress:
-                progress_data = {
-                    "task_id": task_id,
-                    "status": task_result.status,
-                    "progress": task_result.progress,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-                
-                yield f"data: {json.dumps(progress_data)}\n\n"
-                last_progress = task_result.progress
+            # Resume: reenviar eventos perdidos; sem histórico contínuo, enviar o estado atual
+            missed = await task_manager.get_task_events(task_id, after_id=resume_from) if resume_from else []
+            if missed and missed[0]["id"] == resume_from + 1:
+                for event in missed:
+                    yield format_event(event)
+                last_sent = missed[-1]["id"]
+            elif not resume_from or resume_from < snapshot["id"]:
+                yield format_event(snapshot)
+                last_sent = snapshot["id"]
+            else:
+                last_sent = resume_from
             
-            if task_result.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
-                break
+            if missed and missed[-1]["status"] in TERMINAL_STATUSES:
+                return
+            if snapshot["status"] in TERMINAL_STATUSES and last_sent >= snapshot["id"]:
+                return
             
-            await asyncio.sleep(1)
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=TASK_STREAM_HEARTBEAT
+                )
+                if message is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                
+                event = json.loads(message["data"])
+                if event["id"] <= last_sent:
+                    continue
+                
+                yield format_event(event)
+                last_sent = event["id"]
+                
+                if event["type"] == "status" and event["status"] in TERMINAL_STATUSES:
+                    break
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.reset()
     
     return StreamingResponse(
         generate_progress(),
-        media_type="text/plain",
+        media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
         }
     )
 
@@ -363,6 +540,9 @@ async def get_queue_stats(
     """
     try:
         stats = await task_manager.get_queue_stats()
+        pools = stats.pop("pools", {})
+        organizations = stats.pop("organizations", {})
+        dead_letter = stats.pop("dead_letter", {})
         
         total_pending = sum(q["pending"] for q in stats.values())
         total_running = sum(q["running"] for q in stats.values())
@@ -370,6 +550,9 @@ async def get_queue_stats(
         
         return QueueStatsResponse(
             queues=stats,
+            pools=pools,
+            organizations=organizations,
+            dead_letter=dead_letter,
             total_pending=total_pending,
             total_running=total_running,
             total_retrying=total_retrying,
@@ -382,16 +565,135 @@ async def get_queue_stats(
             detail=f"Failed to get queue stats: {str(e)}"
         )
 
+@router.get("/queue/organizations")
+async def get_organization_queue_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Backlog, tasks em andamento e limite por organização (apenas admin)
+    """
+    try:
+        return {
+            "fair_scheduling": task_manager.fair_scheduling,
+            "organizations": await task_manager.get_organization_stats()
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get organization stats: {str(e)}"
+        )
+
+@router.put("/queue/organizations/{organization_id}/limit")
+async def set_organization_task_limit(
+    organization_id: str,
+    limit: Optional[int] = Query(None, ge=0, description="Tasks em andamento (0 = sem limite; vazio volta ao padrão)"),
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Define o limite de concorrência de uma organização no escalonamento justo (apenas admin)
+    """
+    try:
+        await task_manager.set_organization_limit(organization_id, limit)
+        
+        return {
+            "status": "success",
+            "organization_id": organization_id,
+            "limit": limit,
+            "message": f"Task limit updated for organization {organization_id}"
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to set organization limit: {str(e)}"
+        )
+
+@router.get("/dead-letter")
+async def list_dead_letters(
+    task_type: Optional[TaskType] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Lista tasks que falharam permanentemente, mais recentes primeiro (apenas admin)
+    """
+    try:
+        result = await task_manager.list_dead_letters(task_type, offset=offset, limit=limit)
+        
+        return {
+            "entries": result["entries"],
+            "total": result["total"],
+            "offset": offset,
+            "limit": limit,
+            "has_next": offset + limit < result["total"]
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to list dead letters: {str(e)}"
+        )
+
+@router.post("/dead-letter/requeue")
+async def requeue_dead_letters(
+    request: DeadLetterRequeueRequest,
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Reenfileira tasks do dead-letter em lotes, limitado a `rate` tasks/s (apenas admin)
+    """
+    try:
+        result = await task_manager.requeue_dead_letters(
+            task_type=request.task_type,
+            task_ids=request.task_ids,
+            limit=request.limit,
+            batch_size=request.batch_size,
+            rate=request.rate
+        )
+        
+        return {
+            "status": "success",
+            **result,
+            "message": f"Requeued {result['requeued']} dead-lettered tasks"
+        }
+    
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to requeue dead letters: {str(e)}"
+        )
+
+@router.get("/dead-letter/{task_id}")
+async def get_dead_letter(
+    task_id: str,
+    current_user: User = Depends(get_admin_user)
+):
+    """
+    Detalhes de uma task do dead-letter: motivo, último erro, tentativas, definição e logs (apenas admin)
+    """
+    entry = await task_manager.get_dead_letter(task_id)
+    
+    if not entry:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Task {task_id} not found in dead letter queue"
+        )
+    
+    return entry
+
 @router.post("/queue/cleanup")
 async def cleanup_old_tasks(
     max_age_days: int = Query(7, ge=1, le=30),
+    scan_unindexed: bool = Query(False, description="Indexar via SCAN tasks anteriores ao índice de conclusão"),
     current_user: User = Depends(get_admin_user)
 ):
     """
     Limpa tasks antigas (apenas admin)
     """
     try:
-        cleaned_count = await task_manager.cleanup_old_tasks(max_age_days)
+        cleaned_count = await task_manager.cleanup_old_tasks(max_age_days, scan_unindexed=scan_unindexed)
         
         return {
             "status": "success",
@@ -425,6 +727,7 @@ async def background_tasks_health():
             "status": "healthy" if redis_status == "healthy" else "degraded",
             "redis": redis_status,
             "queues": stats,
+            "embedding_cache": task_manager.embedding_cache.get_stats(),
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         
@@ -476,18 +779,25 @@ async def trigger_n8n_workflow(
 
 @router.post("/integrations/knowledge/process-bulk")
 async def process_bulk_documents(
-    documents: List[Dict[str, Any]] = Body(...),
+    request: Request,
     chunk_size: int = Query(1000, ge=100, le=5000),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Processa múltiplos documentos em paralelo
+    Processa múltiplos documentos em paralelo (array JSON ou NDJSON em streaming)
     """
     try:
         task_ids = []
-        
-        for doc in documents:
-            task_id = await submit_document_processing(
+        errors = []
+        batch: List[TaskDefinition] = []
+        batch_bytes = 0
+        
+        async for index, doc in read_bulk_items(request):
+            if not isinstance(doc, dict):
+                errors.append({"index": index, "error": "Document must be a JSON object"})
+                continue
+            
+            task = build_document_task(
                 document_id=doc.get("id", str(uuid.uuid4())),
                 content=doc.get("content", ""),
                 organization_id=current_user.organization_id,
@@ -495,15 +805,41 @@ async def process_bulk_documents(
                 chunk_size=chunk_size,
                 priority=TaskPriority.NORMAL
             )
-            task_ids.append(task_id)
+            task_ids.append(task.id)
+            
+            # Documentos grandes viram shards; os demais vão para o pipeline em lote
+            if document_needs_sharding(task.payload["content"], chunk_size):
+                await task_manager.submit_sharded_document(task)
+                continue
+            
+            # Conteúdo grande vai para o blob store já na leitura; o lote guarda só a referência
+            await task_manager.offload_payload(task)
+            content = task.payload["content"]
+            batch_bytes += len(content) if isinstance(content, str) else 0
+            
+            batch.append(task)
+            if len(batch) >= TASK_BULK_PIPELINE_SIZE or batch_bytes >= TASK_BULK_PIPELINE_MAX_BYTES:
+                await task_manager.submit_tasks_bulk(batch)
+                batch, batch_bytes = [], 0
+        
+        if batch:
+            await task_manager.submit_tasks_bulk(batch)
         
         return {
             "task_ids": task_ids,
-            "documents_submitted": len(documents),
+            "documents_submitted": len(task_ids),
+            "errors": errors,
             "status": "submitted",
-            "message": f"Bulk processing submitted for {len(documents)} documents"
+            "message": f"Bulk processing submitted for {len(task_ids)} documents"
         }
-        
+    
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid bulk request: {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -515,27 +851,32 @@ async def schedule_daily_analytics(
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Agenda processamento diário de analytics
+    Agenda processamento diário de analytics (todo dia à meia-noite UTC)
     """
     try:
-        # Agendar para próxima meia-noite
-        tomorrow = datetime.now(timezone.utc).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        ) + timedelta(days=1)
-        
-        task_id = await submit_analytics_processing(
+        # Sem date_range: cada execução processa as 24h anteriores ao seu horário
+        template = TaskDefinition(
+            name=f"Daily analytics for {current_user.organization_id}",
+            task_type=TaskType.ANALYTICS_PROCESSING,
+            priority=TaskPriority.LOW,
+            payload={},
             organization_id=current_user.organization_id,
-            date_range={
-                "start": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat(),
-                "end": datetime.now(timezone.utc).isoformat()
-            },
             user_id=current_user.id,
-            priority=TaskPriority.LOW
+            tags=["analytics", "metrics", "scheduled"]
+        )
+        
+        schedule = await task_manager.register_schedule(
+            name=f"daily-analytics:{current_user.organization_id}",
+            cron="0 0 * * *",
+            task=template,
+            submit_next_run=True
         )
         
         return {
-            "task_id": task_id,
-            "scheduled_for": tomorrow.isoformat(),
+            "task_id": schedule["next_task_id"],
+            "schedule": schedule["name"],
+            "cron": schedule["cron"],
+            "scheduled_for": schedule["next_run_at"],
             "status": "scheduled",
             "message": "Daily analytics processing scheduled"
         }
@@ -546,6 +887,40 @@ async def schedule_daily_analytics(
             detail=f"Failed to schedule daily analytics: {str(e)}"
         )
 
+@router.get("/schedules")
+async def list_schedules(
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Lista schedules recorrentes da organização
+    """
+    schedules = await task_manager.list_schedules(current_user.organization_id)
+    return {
+        "schedules": schedules,
+        "total": len(schedules)
+    }
+
+@router.delete("/schedules/{name}")
+async def delete_schedule(
+    name: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Remove uma schedule recorrente da organização
+    """
+    schedules = await task_manager.list_schedules(current_user.organization_id)
+    if not any(schedule["name"] == name for schedule in schedules):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Schedule {name} not found"
+        )
+    
+    await task_manager.remove_schedule(name)
+    return {
+        "schedule": name,
+        "status": "removed"
+    }
+
 # Webhook receiver para notificações de tasks
 @router.post("/webhook/task-completed")
 async def task_completed_webhook(
@@ -10,6 +10,7 @@ import logging
 from ..core.webhooks import (
     webhook_manager, 
     WebhookEventType, 
+    WEBHOOK_DELIVERY_RETRY_KEY,
     trigger_webhook,
     trigger_user_registered,
     trigger_payment_confirmed,
@@ -159,6 +160,9 @@ async def create_webhook_endpoint(
         db.add(db_endpoint)
         db.commit()
         db.refresh(db_endpoint)
+        
+        # Atualizar o índice de assinaturas de todas as réplicas
+        await webhook_manager.publish_endpoint_change(str(db_endpoint.id))
         return db_endpoint
     except Exception as e:
         print(f"Erro ao criar endpoint: {str(e)}")
@@ -190,6 +194,8 @@ async def delete_webhook_endpoint(
         db.delete(endpoint)
         db.commit()
         
+        await webhook_manager.publish_endpoint_change(str(endpoint_id), action="delete")
+        
         return {"message": "Endpoint removido com sucesso"}
     except HTTPException:
         raise
@@ -468,18 +474,20 @@ async def get_webhook_stats():
         if webhook_manager.redis_client:
             high_queue_size = await webhook_manager.redis_client.llen("webhook_queue:high")
             normal_queue_size = await webhook_manager.redis_client.llen("webhook_queue:normal")
-            retry_queue_size = await webhook_manager.redis_client.zcard("webhook_retry_queue")
+            delivery_retry_size = await webhook_manager.redis_client.zcard(WEBHOOK_DELIVERY_RETRY_KEY)
         else:
-            high_queue_size = normal_queue_size = retry_queue_size = 0
+            high_queue_size = normal_queue_size = delivery_retry_size = 0
         
         return {
             "status": "active",
             "queues": {
                 "high_priority": high_queue_size,
                 "normal_priority": normal_queue_size,
-                "retry": retry_queue_size
+                "delivery_retry": delivery_retry_size
             },
             "processing_tasks": len(webhook_manager.processing_tasks),
+            "endpoint_index": webhook_manager.get_endpoint_index_stats(),
+            "circuit_breakers": await webhook_manager.circuit_breaker.get_states(),
             "supported_events": [e.value for e in WebhookEventType],
             "n8n_integration": "active" if webhook_manager.n8n_client else "inactive"
         }
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark de geração de embeddings
+Compara o fluxo antigo (1 requisição por chunk) com o pipeline em lotes
+usando um servidor de embeddings local (stub)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Adicionar diretório do backend ao Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from core.embeddings import EmbeddingClient, EMBEDDING_DIMENSIONS
+
+# Configuração do benchmark
+NUM_CHUNKS = int(os.getenv("BENCH_NUM_CHUNKS", "500"))
+CHUNK_WORDS = int(os.getenv("BENCH_CHUNK_WORDS", "150"))
+REQUEST_LATENCY = float(os.getenv("BENCH_REQUEST_LATENCY", "0.02"))  # RTT simulado por requisição
+PER_INPUT_LATENCY = float(os.getenv("BENCH_PER_INPUT_LATENCY", "0.0005"))  # custo simulado por input
+
+class StubEmbeddingsHandler(BaseHTTPRequestHandler):
+    """Servidor stub compatível com /embeddings"""
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length))
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        
+        time.sleep(REQUEST_LATENCY + PER_INPUT_LATENCY * len(inputs))
+        
+        response = json.dumps({
+            "data": [
+                {"index": i, "embedding": [0.01] * EMBEDDING_DIMENSIONS}
+                for i in range(len(inputs))
+            ]
+        }).encode()
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server() -> ThreadingHTTPServer:
+    """Inicia servidor stub em thread separada"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmbeddingsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+async def legacy_embed(url: str, chunks):
+    """Fluxo antigo: um AsyncClient novo e uma requisição por chunk, em série"""
+    embeddings = []
+    for chunk in chunks:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, json={"model": "text-embedding-3-small", "input": chunk})
+            embeddings.append(response.json()["data"][0]["embedding"])
+    return embeddings
+
+async def batched_embed(url: str, chunks):
+    """Pipeline novo: lotes por orçamento de tokens com concorrência limitada"""
+    client = EmbeddingClient(api_url=url)
+    try:
+        return await client.embed_many(chunks)
+    finally:
+        await client.close()
+
+async def run_benchmark():
+    server = start_stub_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/embeddings"
+    chunks = [" ".join(f"palavra{i}_{w}" for w in range(CHUNK_WORDS)) for i in range(NUM_CHUNKS)]
+    
+    print(f"🚀 Benchmark de embeddings: {NUM_CHUNKS} chunks, latência stub {REQUEST_LATENCY * 1000:.0f}ms/req")
+    print("=" * 60)
+    
+    results = {}
+    for name, func in [("antes (por chunk)", legacy_embed), ("depois (em lotes)", batched_embed)]:
+        start = time.perf_counter()
+        embeddings = await func(url, chunks)
+        elapsed = time.perf_counter() - start
+        
+        assert len(embeddings) == len(chunks)
+        results[name] = len(chunks) / elapsed
+        print(f"📊 {name}: {elapsed:.2f}s - {results[name]:.1f} chunks/s")
+    
+    server.shutdown()
+    
+    before, after = results.values()
+    print(f"\n📈 Speedup: {after / before:.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialização das filas
+Compara JSON (pydantic), orjson e msgpack, com e sem compressão, em payloads
+realistas de tasks e webhooks (encode + decode com validação)
+"""
+
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Adicionar diretório do backend ao Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.background_tasks import TaskDefinition, TaskType, TaskPriority
+from core.webhooks import WebhookPayload, WebhookEventType
+from core.serialization import Serializer, orjson, msgpack, zstandard
+
+# Configuração do benchmark
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "5000"))
+DOCUMENT_CHARS = int(os.getenv("BENCH_DOCUMENT_CHARS", "20000"))
+
+def build_payloads():
+    """Payloads típicos: webhook pequeno, task de webhook e task de documento"""
+    now = datetime.now(timezone.utc)
+    
+    webhook_event = WebhookPayload(
+        event_type=WebhookEventType.MESSAGE_ADDED,
+        event_id=str(uuid.uuid4()),
+        timestamp=now,
+        data={
+            "conversation_id": str(uuid.uuid4()),
+            "agent_id": str(uuid.uuid4()),
+            "message": {"role": "user", "content": "Olá, gostaria de saber o status do meu pedido #12345", "tokens": 18},
+            "channel": "whatsapp",
+            "metadata": {"phone": "+5511999999999", "locale": "pt-BR"}
+        },
+        user_id=str(uuid.uuid4()),
+        organization_id=str(uuid.uuid4())
+    )
+    
+    webhook_task = TaskDefinition(
+        name="Webhook to https://hooks.example.com/events",
+        task_type=TaskType.WEBHOOK_DELIVERY,
+        priority=TaskPriority.HIGH,
+        payload={
+            "webhook_url": "https://hooks.example.com/events",
+            "data": webhook_event.model_dump(mode="json"),
+            "headers": {"X-Source": "agentes"},
+            "sign_payload": True
+        },
+        organization_id=str(uuid.uuid4()),
+        tags=["webhook", "delivery"]
+    )
+    
+    paragraph = "O cliente pode acompanhar o pedido pelo painel, com atualizações em tempo real. "
+    document_task = TaskDefinition(
+        name="Process Document doc_123",
+        task_type=TaskType.DOCUMENT_PROCESSING,
+        payload={
+            "document_id": "doc_123",
+            "content": (paragraph * (DOCUMENT_CHARS // len(paragraph) + 1))[:DOCUMENT_CHARS],
+            "chunk_size": 1000,
+            "chunk_overlap": 0
+        },
+        organization_id=str(uuid.uuid4()),
+        user_id=str(uuid.uuid4()),
+        tags=["document", "embedding"]
+    )
+    
+    return [
+        ("webhook_event", webhook_event),
+        ("webhook_task", webhook_task),
+        ("document_task", document_task)
+    ]
+
+def available_serializers():
+    """Combinações formato/compressão com as bibliotecas instaladas"""
+    formats = ["json"] + [name for name, module in (("orjson", orjson), ("msgpack", msgpack)) if module]
+    compressions = ["none", "zlib"] + (["zstd"] if zstandard else [])
+    return [(f"{fmt}+{comp}", Serializer(fmt, comp, compress_min_size=0)) for fmt in formats for comp in compressions]
+
+def bench(serializer: Serializer, model) -> tuple:
+    """(µs por encode, µs por decode, bytes)"""
+    model_cls = type(model)
+    data = serializer.dumps_model(model)
+    
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        serializer.dumps_model(model)
+    encode_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+    
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        serializer.loads_model(model_cls, data)
+    decode_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+    
+    return encode_us, decode_us, len(data)
+
+def run_benchmark():
+    serializers = available_serializers()
+    missing = [name for name, module in (("orjson", orjson), ("msgpack", msgpack), ("zstandard", zstandard)) if not module]
+    
+    print(f"🔬 Benchmark de serialização ({ITERATIONS} iterações por caso)")
+    if missing:
+        print(f"   Não instalados (ignorados): {', '.join(missing)}")
+    
+    for payload_name, model in build_payloads():
+        print(f"\n📦 {payload_name}")
+        print(f"   {'formato':<16}{'encode µs':>12}{'decode µs':>12}{'total µs':>12}{'bytes':>10}")
+        
+        baseline = None
+        for name, serializer in serializers:
+            encode_us, decode_us, size = bench(serializer, model)
+            total = encode_us + decode_us
+            baseline = baseline or total
+            print(f"   {name:<16}{encode_us:>12.1f}{decode_us:>12.1f}{total:>12.1f}{size:>10}  ({baseline / total:.2f}x)")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -8,8 +8,12 @@ import json
 import uuid
 import hashlib
 import logging
+import socket
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Any, Optional, List, Callable, Union
+from typing import Dict, Any, Optional, List, Callable, Union, Iterable, AsyncIterable, AsyncIterator, Iterator, Tuple
+from collections import deque
+from itertools import islice
 from enum import Enum
 from dataclasses import dataclass, asdict
 from functools import wraps
@@ -20,12 +24,604 @@ from pydantic import BaseModel, Field
 from supabase import create_client, Client
 import os
 
+from .embeddings import DocumentChunker, EmbeddingCache, EmbeddingClient, EmbeddingWriter
+from .scheduler import CronExpression
+from .blob_store import BlobStore, create_blob_store
+from .serialization import create_serializer
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, is_failure_status
+
 # Configuração
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL", "https://primary-em-atividade.up.railway.app")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "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")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+QUEUE_BLOCK_TIMEOUT = int(os.getenv("TASK_QUEUE_BLOCK_TIMEOUT", "5"))  # seconds
+TASK_QUEUE_MODE = os.getenv("TASK_QUEUE_MODE", "simple")  # simple | reliable | streams
+TASK_LEASE_TIMEOUT = int(os.getenv("TASK_LEASE_TIMEOUT", "60"))  # seconds
+TASK_STREAM_GROUP = os.getenv("TASK_STREAM_GROUP", "task_workers")
+TASK_STREAM_MAXLEN = int(os.getenv("TASK_STREAM_MAXLEN", "100000"))
+WORKER_MAX_CONCURRENT = int(os.getenv("WORKER_MAX_CONCURRENT", "10"))
+TASK_POOL_DEFAULT_LIMIT = int(os.getenv("TASK_POOL_DEFAULT_LIMIT", "5"))
+# Limites por tipo de task: "document_processing=2,webhook_delivery=20"
+TASK_POOL_LIMITS = os.getenv("TASK_POOL_LIMITS", "document_processing=2,webhook_delivery=20,email_notification=10")
+SATURATED_BLOCK_TIMEOUT = 1  # seconds - reavaliar pools cheios com mais frequência
+TASK_LOG_MAX_ENTRIES = int(os.getenv("TASK_LOG_MAX_ENTRIES", "50"))  # logs mantidos por task
+TASK_EVENT_HISTORY = int(os.getenv("TASK_EVENT_HISTORY", "100"))  # eventos mantidos para resume (Last-Event-ID)
+TASK_STREAM_HEARTBEAT = int(os.getenv("TASK_STREAM_HEARTBEAT", "15"))  # seconds
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+TASKS_COMPLETED_INDEX = "tasks_completed"  # ZSET task_id -> completed_at (timestamp)
+TASK_CLEANUP_BATCH_SIZE = 500
+# Documentos com mais chunks que isso são divididos em shards processados em paralelo (map/reduce)
+DOCUMENT_SHARD_CHUNKS = int(os.getenv("DOCUMENT_SHARD_CHUNKS", "200"))
+TASK_BULK_PIPELINE_SIZE = int(os.getenv("TASK_BULK_PIPELINE_SIZE", "1000"))  # tasks por pipeline no submit em lote
+TASK_BULK_PIPELINE_MAX_BYTES = int(os.getenv("TASK_BULK_PIPELINE_MAX_BYTES", str(8 * 1024 * 1024)))  # conteúdo em memória por lote
+# Campos do payload acima deste tamanho (bytes) vão para o blob store; 0 desativa
+TASK_PAYLOAD_OFFLOAD_THRESHOLD = int(os.getenv("TASK_PAYLOAD_OFFLOAD_THRESHOLD", str(256 * 1024)))
+BLOB_REF_KEY = "$blob"  # marcador de campo do payload armazenado no blob store
+
+# Escalonamento justo por organização (sub-filas + round-robin)
+TASK_FAIR_SCHEDULING = os.getenv("TASK_FAIR_SCHEDULING", "false").lower() == "true"
+TASK_FAIR_QUEUE_WINDOW = int(os.getenv("TASK_FAIR_QUEUE_WINDOW", "100"))  # tasks despachadas e não finalizadas por fila
+TASK_FAIR_ORG_LIMIT = int(os.getenv("TASK_FAIR_ORG_LIMIT", "0"))  # tasks em andamento por organização (0 = sem limite)
+FAIR_DISPATCH_BATCH = 500
+FAIR_DISPATCH_PASSES = 3  # releituras do anel quando uma organização entra durante o despacho
+FAIR_DEFAULT_ORG = "_default"  # tasks sem organization_id
+FAIR_DISPATCHED_KEY = "fair_dispatched"  # HASH fila -> tasks despachadas e não finalizadas
+FAIR_IN_FLIGHT_KEY = "fair_in_flight"  # HASH organização -> tasks despachadas e não finalizadas
+FAIR_SLOTS_KEY = "fair_slots"  # HASH task_id -> organização da vaga ocupada pela task despachada
+FAIR_ORG_LIMITS_KEY = "fair_org_limits"  # HASH organização -> limite de concorrência
+
+# Dead-letter: tasks que falharam permanentemente, por tipo (ZSET task_id -> falha em timestamp)
+DEAD_LETTER_KEY_PREFIX = "dead_letter"
+DEAD_LETTER_UNKNOWN_TYPE = "unknown"  # definição ilegível
+TASK_DLQ_REPLAY_BATCH = int(os.getenv("TASK_DLQ_REPLAY_BATCH", "100"))  # tasks por pipeline no replay
+TASK_DLQ_REPLAY_RATE = float(os.getenv("TASK_DLQ_REPLAY_RATE", "50"))  # tasks/s no replay
+WEBHOOK_TASK_TIMEOUT = 30.0  # seconds - timeout da política; o circuit breaker pode reduzir (adaptativo)
+
+# Agendamento: tasks atrasadas (scheduled_for) e schedules recorrentes (cron)
+TASK_SCHEDULER_ENABLED = os.getenv("TASK_SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_INTERVAL = float(os.getenv("TASK_SCHEDULER_INTERVAL", "1"))  # seconds
+SCHEDULER_LEADER_TTL = int(os.getenv("TASK_SCHEDULER_LEADER_TTL", "10"))  # seconds
+DELAYED_TASKS_KEY = "delayed_tasks"  # ZSET task_id -> scheduled_for (timestamp)
+DELAYED_PROMOTE_BATCH = 500
+SCHEDULES_KEY = "schedules"  # HASH nome -> definição da schedule (JSON)
+SCHEDULE_NEXT_RUN_KEY = "schedule_next_run"  # ZSET nome -> próxima execução (timestamp)
+SCHEDULER_LEADER_KEY = "scheduler:leader"
+SCHEDULE_FIRED_TTL = 2 * 86400  # seconds - trava de disparo único por execução
+
+# Reliable queue: leases de tasks em processamento e sinal para acordar workers
+QUEUE_MODE_RELIABLE = "reliable"
+TASK_LEASES_KEY = "task_leases"
+TASK_CLAIMS_KEY = "task_claims"  # HASH task_id -> "<worker_id>|<fila de origem>" das tasks com lease
+QUEUE_SIGNAL_KEY = "queue_signal"
+QUEUE_SIGNAL_MAX = 1000
+LEASE_RELEASE_ALL = 10 ** 12  # deadline "infinito" para devolver uma task independente do lease
+
+# Redis Streams: stream:<prioridade> consumido por um consumer group compartilhado
+QUEUE_MODE_STREAMS = "streams"
+LEASED_QUEUE_MODES = (QUEUE_MODE_RELIABLE, QUEUE_MODE_STREAMS)
+
+# Move atomicamente a próxima task (ordem das filas) para a lista de processamento do worker
+# KEYS: processing do worker, leases, claims, filas...
+# ARGV: deadline do lease, worker_id
+CLAIM_TASK_SCRIPT = """
+for i = 4, #KEYS do
+    local task_id = redis.call('LMOVE', KEYS[i], KEYS[1], 'RIGHT', 'LEFT')
+    if task_id then
+        redis.call('ZADD', KEYS[2], ARGV[1], task_id)
+        redis.call('HSET', KEYS[3], task_id, ARGV[2] .. '|' .. KEYS[i])
+        return task_id
+    end
+end
+return false
+"""
+
+# Lê (XREADGROUP, sem bloquear) uma única entrada: a primeira das streams na ordem de prioridade
+READ_FIRST_STREAM_ENTRY_SCRIPT = """
+for i = 1, #KEYS do
+    local response = redis.call('XREADGROUP', 'GROUP', ARGV[1], ARGV[2], 'COUNT', 1, 'STREAMS', KEYS[i], '>')
+    if response and response[1] and #response[1][2] > 0 then
+        local entry = response[1][2][1]
+        return {KEYS[i], entry[1], entry[2]}
+    end
+end
+return false
+"""
+
+# Devolve à fila as tasks cujo lease expirou antes de ARGV[1]
+# KEYS: leases, queue_signal, claims, (task, processing do worker, fila de origem) por task
+# ARGV: deadline, (task_id, claim lido antes do script) por task
+REQUEUE_TASKS_SCRIPT = """
+local requeued = 0
+local base = 4
+for i = 2, #ARGV, 2 do
+    local task_id = ARGV[i]
+    local task_key = KEYS[base]
+    local deadline = redis.call('ZSCORE', KEYS[1], task_id)
+    -- Claim diferente do lido: a task foi finalizada ou reclamada nesse meio tempo
+    if deadline and tonumber(deadline) <= tonumber(ARGV[1])
+        and (redis.call('HGET', KEYS[3], task_id) or '') == ARGV[i + 1] then
+        redis.call('LREM', KEYS[base + 1], 0, task_id)
+        redis.call('ZREM', KEYS[1], task_id)
+        redis.call('HDEL', KEYS[3], task_id)
+        if redis.call('HGET', task_key, 'status') == 'running' then
+            redis.call('HSET', task_key, 'status', 'pending')
+        end
+        redis.call('HINCRBY', task_key, 'lease_expirations', 1)
+        redis.call('RPUSH', KEYS[base + 2], task_id)
+        redis.call('LPUSH', KEYS[2], '1')
+        requeued = requeued + 1
+    end
+    base = base + 3
+end
+redis.call('LTRIM', KEYS[2], 0, 999)
+return requeued
+"""
+
+# Transições de estado das tasks (atômicas, um round trip cada)
+# Marca como running e devolve a definição; ignora tasks canceladas/concluídas/inexistentes
+START_TASK_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status or status == 'cancelled' or status == 'completed' then
+    return false
+end
+redis.call('HSET', KEYS[1], 'status', 'running', 'started_at', ARGV[1])
+return redis.call('HGET', KEYS[1], 'definition')
+"""
+
+# Finalização comum: índice de conclusão (ZSET por completed_at) e TTL a partir do result_ttl da task
+FINALIZE_TASK_LUA = """
+local function finalize(task_key, index_key, related_keys, task_id, completed_ts, default_ttl)
+    redis.call('ZADD', index_key, completed_ts, task_id)
+    local ttl = tonumber(redis.call('HGET', task_key, 'result_ttl') or default_ttl)
+    if ttl and ttl > 0 then
+        redis.call('EXPIRE', task_key, ttl)
+        for _, key in ipairs(related_keys) do
+            redis.call('EXPIRE', key, ttl)
+        end
+    end
+end
+"""
+
+# Escalonamento justo: libera a vaga (janela da fila e limite da organização) de uma task despachada
+# keys: task, vagas (task -> organização), em andamento por organização, despachadas por fila
+FAIR_RELEASE_LUA = """
+local function release_fair_slot(task_id, keys)
+    local org = redis.call('HGET', keys[2], task_id)
+    if not org then
+        return
+    end
+    redis.call('HDEL', keys[2], task_id)
+    if redis.call('HINCRBY', keys[3], org, -1) <= 0 then
+        redis.call('HDEL', keys[3], org)
+    end
+    local queue = redis.call('HGET', keys[1], 'queue') or 'queue:normal'
+    if redis.call('HINCRBY', keys[4], queue, -1) <= 0 then
+        redis.call('HDEL', keys[4], queue)
+    end
+end
+"""
+
+# Dependências (DAG): enfileiramento de dependentes liberados e propagação de falhas
+# Conjunto task_dependents:{id} guarda as tasks que aguardam a conclusão de {id};
+# o campo deps_remaining de cada dependente é o contador de dependências pendentes
+# As keys de cada task envolvida chegam em grupos consecutivos de KEYS, lidos pelo cliente antes do script;
+# dependentes registrados depois dessa leitura ficam no conjunto para uma nova passada
+DEPENDENCIES_LUA = """
+local function key_groups(first_key, width, count_arg)
+    local groups = {}
+    for i = 1, tonumber(ARGV[count_arg]) do
+        groups[ARGV[count_arg + i]] = first_key + (i - 1) * width
+    end
+    return groups
+end
+
+local function group_keys(base, width)
+    local keys = {}
+    for i = 0, width - 1 do
+        table.insert(keys, KEYS[base + i])
+    end
+    return keys
+end
+
+-- keys: task, fila (lista ou stream), sub-fila da organização, anel da fila; globals: delayed_tasks, queue_signal
+local function enqueue_ready(task_id, keys, globals, now_ts, mode, maxlen, fair)
+    local scheduled_ts = tonumber(redis.call('HGET', keys[1], 'scheduled_ts') or '0')
+    if scheduled_ts > tonumber(now_ts) then
+        redis.call('HSET', keys[1], 'status', 'scheduled')
+        redis.call('ZADD', globals[1], scheduled_ts, task_id)
+        return
+    end
+    redis.call('HSET', keys[1], 'status', 'pending')
+    if fair == '1' then
+        local org = redis.call('HGET', keys[1], 'organization_id') or '_default'
+        redis.call('LPUSH', keys[3], task_id)
+        redis.call('ZADD', keys[4], 'NX', 0, org)
+    elseif mode == 'streams' then
+        redis.call('XADD', keys[2], 'MAXLEN', '~', maxlen, '*', 'task_id', task_id)
+    else
+        redis.call('LPUSH', keys[2], task_id)
+        if mode == 'reliable' then
+            redis.call('LPUSH', globals[2], '1')
+            redis.call('LTRIM', globals[2], 0, 999)
+        end
+    end
+end
+
+-- groups: dependente -> grupo de enqueue_ready; retorna false se algum dependente ficou para a próxima passada
+local function release_dependents(dependents_key, groups, globals, now_ts, mode, maxlen, fair)
+    local complete = true
+    for _, dependent in ipairs(redis.call('SMEMBERS', dependents_key)) do
+        local base = groups[dependent]
+        if base then
+            local keys = group_keys(base, 4)
+            if redis.call('EXISTS', keys[1]) == 1 then
+                local remaining = redis.call('HINCRBY', keys[1], 'deps_remaining', -1)
+                if remaining <= 0 and redis.call('HGET', keys[1], 'status') == 'waiting' then
+                    enqueue_ready(dependent, keys, globals, now_ts, mode, maxlen, fair)
+                end
+            end
+            redis.call('SREM', dependents_key, dependent)
+        else
+            complete = false
+        end
+    end
+    return complete
+end
+
+-- groups: task -> grupo (task, task_dependents, logs, eventos) das raízes e de seus dependentes transitivos
+local function cascade_dependents(roots, groups, status, error_json, now_iso, now_ts, index_key, default_ttl)
+    local affected = {}
+    local complete = true
+    local stack = {}
+    for _, root in ipairs(roots) do
+        table.insert(stack, root)
+    end
+    while #stack > 0 do
+        local current = table.remove(stack)
+        local dependents_key = KEYS[groups[current] + 1]
+        for _, dependent in ipairs(redis.call('SMEMBERS', dependents_key)) do
+            local base = groups[dependent]
+            if base then
+                local dependent_key = KEYS[base]
+                if redis.call('HGET', dependent_key, 'status') == 'waiting' then
+                    redis.call('HSET', dependent_key, 'status', status, 'error', error_json, 'completed_at', now_iso)
+                    finalize(dependent_key, index_key, {KEYS[base + 2], KEYS[base + 3]}, dependent, now_ts, default_ttl)
+                    table.insert(affected, dependent)
+                    table.insert(stack, dependent)
+                end
+                redis.call('SREM', dependents_key, dependent)
+            else
+                complete = false
+            end
+        end
+    end
+    return affected, complete
+end
+"""
+
+# Registra uma task nas dependências ainda não concluídas (contador atômico)
+# KEYS: task, índice de conclusão, tasks das dependências..., task_dependents das dependências...
+# ARGV: task_id, dependências...
+# Retorna {dependências pendentes, ''} ou {-1, dependência inexistente} / {-2, dependência falha/cancelada} /
+#         {-3, dependência finalizada que já expirou (resultado desconhecido)}
+REGISTER_DEPENDENCIES_SCRIPT = """
+local count = #ARGV - 1
+for i = 1, count do
+    local status = redis.call('HGET', KEYS[2 + i], 'status')
+    if not status then
+        if redis.call('ZSCORE', KEYS[2], ARGV[1 + i]) then
+            return {-3, ARGV[1 + i]}
+        end
+        return {-1, ARGV[1 + i]}
+    end
+    if status == 'failed' or status == 'cancelled' then
+        return {-2, ARGV[1 + i]}
+    end
+end
+local remaining = 0
+for i = 1, count do
+    if redis.call('HGET', KEYS[2 + i], 'status') ~= 'completed' then
+        redis.call('SADD', KEYS[2 + count + i], ARGV[1])
+        remaining = remaining + 1
+    end
+end
+redis.call('HSET', KEYS[1], 'deps_remaining', remaining)
+return {remaining, ''}
+"""
+
+# Vaga de uma task que não vai mais finalizar por este worker (ex.: shutdown sem lease)
+# KEYS: task, vagas, em andamento por organização, despachadas por fila; ARGV: task_id
+RELEASE_FAIR_SLOT_SCRIPT = FAIR_RELEASE_LUA + """
+release_fair_slot(ARGV[1], KEYS)
+return 1
+"""
+
+# KEYS: task, índice, logs, eventos, vagas, em andamento por organização, despachadas por fila,
+#       task_dependents, delayed_tasks, queue_signal, (task, fila, sub-fila, anel) por dependente
+# ARGV: result, completed_at, execution_time, task_id, completed_ts, default_ttl, queue_mode, stream_maxlen,
+#       escalonamento justo (1/0), número de dependentes, dependentes...
+# Retorna 0 (cancelada), 1 (concluída) ou 2 (concluída, com dependentes registrados depois da leitura)
+COMPLETE_TASK_SCRIPT = FINALIZE_TASK_LUA + FAIR_RELEASE_LUA + DEPENDENCIES_LUA + """
+if redis.call('HGET', KEYS[1], 'status') == 'cancelled' then
+    return 0
+end
+redis.call('HSET', KEYS[1],
+    'status', 'completed', 'result', ARGV[1], 'completed_at', ARGV[2],
+    'execution_time', ARGV[3], 'progress', '1.0')
+release_fair_slot(ARGV[4], {KEYS[1], KEYS[5], KEYS[6], KEYS[7]})
+finalize(KEYS[1], KEYS[2], {KEYS[3], KEYS[4]}, ARGV[4], ARGV[5], ARGV[6])
+if release_dependents(KEYS[8], key_groups(11, 4, 10), {KEYS[9], KEYS[10]}, ARGV[5], ARGV[7], ARGV[8], ARGV[9]) then
+    return 1
+end
+return 2
+"""
+
+# Libera dependentes que se registraram depois da leitura feita para COMPLETE_TASK_SCRIPT
+# KEYS: task_dependents, delayed_tasks, queue_signal, (task, fila, sub-fila, anel) por dependente
+# ARGV: agora (timestamp), queue_mode, stream_maxlen, escalonamento justo (1/0), número de dependentes, dependentes...
+RELEASE_DEPENDENTS_SCRIPT = FINALIZE_TASK_LUA + DEPENDENCIES_LUA + """
+if release_dependents(KEYS[1], key_groups(4, 4, 5), {KEYS[2], KEYS[3]}, ARGV[1], ARGV[2], ARGV[3], ARGV[4]) then
+    return 1
+end
+return 0
+"""
+
+# KEYS: task, retry_queue, índice, logs, eventos, dead-letter do tipo, vagas, em andamento por organização,
+#       despachadas por fila, (task, task_dependents, logs, eventos) da task e de seus dependentes transitivos
+# ARGV: retryable, max_retries, error_retry, error_final, now_iso, task_id, now_ts, default_ttl,
+#       error_dependency, número de tasks do grafo, tasks do grafo..., (delay, retry_ts, retry_iso) por tentativa
+# Retorna {tentativas, delay do retry ou -1 para falha permanente, cascata completa (1/0), dependentes falhos...}
+FAIL_TASK_SCRIPT = FINALIZE_TASK_LUA + FAIR_RELEASE_LUA + DEPENDENCIES_LUA + """
+if redis.call('HGET', KEYS[1], 'status') == 'cancelled' then
+    return {0, -1, 1}
+end
+local graph_size = tonumber(ARGV[10])
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if ARGV[1] == '1' and attempts <= tonumber(ARGV[2]) then
+    local base = 11 + graph_size + (attempts - 1) * 3
+    redis.call('HSET', KEYS[1],
+        'status', 'retrying', 'retry_count', attempts,
+        'next_retry_at', ARGV[base + 2], 'error', ARGV[3])
+    redis.call('ZADD', KEYS[2], ARGV[base + 1], ARGV[6])
+    -- Durante o backoff a vaga fica livre; o retry volta pela sub-fila da organização
+    release_fair_slot(ARGV[6], {KEYS[1], KEYS[7], KEYS[8], KEYS[9]})
+    return {attempts, tonumber(ARGV[base]), 1}
+end
+local reason = 'non_retryable'
+if ARGV[1] == '1' then
+    reason = 'retries_exhausted'
+end
+redis.call('HSET', KEYS[1], 'status', 'failed', 'error', ARGV[4], 'completed_at', ARGV[5], 'dead_letter_reason', reason)
+release_fair_slot(ARGV[6], {KEYS[1], KEYS[7], KEYS[8], KEYS[9]})
+finalize(KEYS[1], KEYS[3], {KEYS[4], KEYS[5]}, ARGV[6], ARGV[7], ARGV[8])
+-- Dead-letter: a task (e seus logs) não expira até o replay ou a limpeza por idade
+redis.call('ZADD', KEYS[6], ARGV[7], ARGV[6])
+redis.call('PERSIST', KEYS[1])
+redis.call('PERSIST', KEYS[4])
+redis.call('PERSIST', KEYS[5])
+local affected, complete = cascade_dependents(
+    {ARGV[6]}, key_groups(10, 4, 10), 'failed', ARGV[9], ARGV[5], ARGV[7], KEYS[3], ARGV[8])
+local result = {attempts, -1, complete and 1 or 0}
+for _, dependent in ipairs(affected) do
+    table.insert(result, dependent)
+end
+return result
+"""
+
+# KEYS: task, leases, índice, logs, eventos, vagas, em andamento por organização, despachadas por fila, claims,
+#       processing do worker do claim, sub-fila da organização, filas (listas)..., retry queues (zsets)...,
+#       (task, task_dependents, logs, eventos) da task e de seus dependentes transitivos
+# ARGV: task_id, completed_at, número de filas (listas), completed_ts, default_ttl, error_dependency,
+#       claim lido antes do script, número de retry queues (zsets), número de tasks do grafo, tasks do grafo...
+# Retorna {-1} se o claim mudou depois da leitura, senão {cascata completa (1/0), dependentes cancelados...}
+CANCEL_TASK_SCRIPT = FINALIZE_TASK_LUA + FAIR_RELEASE_LUA + DEPENDENCIES_LUA + """
+local task_id = ARGV[1]
+if (redis.call('HGET', KEYS[9], task_id) or '') ~= ARGV[7] then
+    return {-1}
+end
+local lists = tonumber(ARGV[3])
+local sets = tonumber(ARGV[8])
+for i = 12, 11 + lists + sets do
+    if i < 12 + lists then
+        redis.call('LREM', KEYS[i], 0, task_id)
+    else
+        redis.call('ZREM', KEYS[i], task_id)
+    end
+end
+redis.call('LREM', KEYS[10], 0, task_id)
+redis.call('HDEL', KEYS[9], task_id)
+redis.call('ZREM', KEYS[2], task_id)
+redis.call('LREM', KEYS[11], 0, task_id)
+release_fair_slot(task_id, {KEYS[1], KEYS[6], KEYS[7], KEYS[8]})
+redis.call('HSET', KEYS[1], 'status', 'cancelled', 'completed_at', ARGV[2])
+finalize(KEYS[1], KEYS[3], {KEYS[4], KEYS[5]}, task_id, ARGV[4], ARGV[5])
+local affected, complete = cascade_dependents(
+    {task_id}, key_groups(12 + lists + sets, 4, 9), 'cancelled', ARGV[6], ARGV[2], ARGV[4], KEYS[3], ARGV[5])
+local result = {complete and 1 or 0}
+for _, dependent in ipairs(affected) do
+    table.insert(result, dependent)
+end
+return result
+"""
+
+# Propaga a falha/cancelamento a dependentes registrados depois da leitura feita para a transição
+# KEYS: índice, (task, task_dependents, logs, eventos) das raízes e de seus dependentes transitivos
+# ARGV: status, error_json, now_iso, now_ts, default_ttl, número de raízes, número de tasks do grafo, tasks do grafo...
+# As raízes são as primeiras tasks do grafo; retorna {cascata completa (1/0), dependentes afetados...}
+CASCADE_DEPENDENTS_SCRIPT = FINALIZE_TASK_LUA + DEPENDENCIES_LUA + """
+local roots = {}
+for i = 1, tonumber(ARGV[6]) do
+    table.insert(roots, ARGV[7 + i])
+end
+local affected, complete = cascade_dependents(
+    roots, key_groups(2, 4, 7), ARGV[1], ARGV[2], ARGV[3], ARGV[4], KEYS[1], ARGV[5])
+local result = {complete and 1 or 0}
+for _, dependent in ipairs(affected) do
+    table.insert(result, dependent)
+end
+return result
+"""
+
+# Devolve tasks do dead-letter à fila (ou à sub-fila da organização) com as tentativas zeradas
+# KEYS: dead-letter, índice de conclusão, delayed_tasks, queue_signal, (task, fila, sub-fila, anel) por task
+# ARGV: queue mode, maxlen das streams, escalonamento justo (1/0), agora (timestamp), número de tasks, task_ids...
+# Retorna a fila de cada task ('' para as que não estavam no dead-letter)
+REQUEUE_DEAD_LETTER_SCRIPT = FINALIZE_TASK_LUA + DEPENDENCIES_LUA + """
+local queues = {}
+local groups = key_groups(5, 4, 5)
+for i = 1, tonumber(ARGV[5]) do
+    local task_id = ARGV[5 + i]
+    local keys = group_keys(groups[task_id], 4)
+    local queue = ''
+    if redis.call('ZREM', KEYS[1], task_id) == 1 and redis.call('HGET', keys[1], 'status') == 'failed' then
+        redis.call('ZREM', KEYS[2], task_id)
+        redis.call('HDEL', keys[1], 'error', 'completed_at', 'next_retry_at', 'retry_count',
+            'dead_letter_reason', 'result', 'execution_time', 'started_at', 'worker_id')
+        redis.call('HSET', keys[1], 'attempts', 0, 'progress', '0')
+        redis.call('HINCRBY', keys[1], 'replays', 1)
+        queue = redis.call('HGET', keys[1], 'queue') or 'queue:normal'
+        enqueue_ready(task_id, keys, {KEYS[3], KEYS[4]}, ARGV[4], ARGV[1], ARGV[2], ARGV[3])
+    end
+    table.insert(queues, queue)
+end
+return queues
+"""
+
+# Move tasks vencidas de um ZSET (delayed_tasks ou retry_queue) para suas filas (lista ou stream, conforme o queue mode)
+# KEYS: ZSET de origem, delayed_tasks, queue_signal, (task, fila, sub-fila, anel) por task
+# ARGV: agora, queue mode, maxlen das streams, escalonamento justo (1/0), status esperado, número de tasks, task_ids...
+# Só promove as tasks que o próprio script remove do ZSET (outra réplica pode ter lido o mesmo lote)
+PROMOTE_DUE_TASKS_SCRIPT = FINALIZE_TASK_LUA + DEPENDENCIES_LUA + """
+local promoted = 0
+local groups = key_groups(4, 4, 6)
+for i = 1, tonumber(ARGV[6]) do
+    local task_id = ARGV[6 + i]
+    local score = redis.call('ZSCORE', KEYS[1], task_id)
+    if score and tonumber(score) <= tonumber(ARGV[1]) then
+        redis.call('ZREM', KEYS[1], task_id)
+        local keys = group_keys(groups[task_id], 4)
+        if redis.call('HGET', keys[1], 'status') == ARGV[5] then
+            enqueue_ready(task_id, keys, {KEYS[2], KEYS[3]}, ARGV[1], ARGV[2], ARGV[3], ARGV[4])
+            promoted = promoted + 1
+        end
+    end
+end
+return promoted
+"""
+
+# Escalonamento justo: move tasks das sub-filas por organização (fair:<fila>:<org>) para a fila
+# Anel: ZSET organização -> sequência do último despacho (menor score = próxima da vez, round-robin)
+# Janela: no máximo ARGV[2] tasks despachadas e não finalizadas na fila; organização no limite é pulada
+# KEYS: anel, despachadas por fila, em andamento por organização, limites por organização, queue_signal,
+#       vagas (task -> organização), fila (lista ou stream), sub-filas das organizações lidas do anel...
+# ARGV: fila, janela, limite padrão por organização (0 = sem limite), queue mode, maxlen das streams, lote,
+#       número de organizações, organizações...
+# Retorna {tasks despachadas, 1 se parou numa organização que entrou no anel depois da leitura}
+FAIR_DISPATCH_SCRIPT = """
+local queue = ARGV[1]
+local window = tonumber(ARGV[2])
+local batch = tonumber(ARGV[6])
+local org_queues = {}
+for i = 1, tonumber(ARGV[7]) do
+    org_queues[ARGV[7 + i]] = KEYS[7 + i]
+end
+local dispatched = tonumber(redis.call('HGET', KEYS[2], queue) or '0')
+local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+local seq = tonumber(last[2] or '0')
+local skipped = 0
+local moved = 0
+local stalled = 0
+while dispatched < window and moved < batch do
+    local entry = redis.call('ZRANGE', KEYS[1], skipped, skipped)
+    local org = entry[1]
+    if not org then
+        break
+    end
+    local org_queue = org_queues[org]
+    if not org_queue then
+        stalled = 1
+        break
+    end
+    local limit = tonumber(redis.call('HGET', KEYS[4], org) or ARGV[3])
+    if limit > 0 and tonumber(redis.call('HGET', KEYS[3], org) or '0') >= limit then
+        -- Mantém o score: volta a ser a primeira da vez quando liberar vaga
+        skipped = skipped + 1
+    else
+        local task_id = redis.call('RPOP', org_queue)
+        if task_id then
+            redis.call('HSET', KEYS[6], task_id, org)
+            redis.call('HINCRBY', KEYS[3], org, 1)
+            redis.call('HINCRBY', KEYS[2], queue, 1)
+            if ARGV[4] == 'streams' then
+                redis.call('XADD', KEYS[7], 'MAXLEN', '~', ARGV[5], '*', 'task_id', task_id)
+            else
+                redis.call('LPUSH', KEYS[7], task_id)
+                if ARGV[4] == 'reliable' then
+                    redis.call('LPUSH', KEYS[5], '1')
+                end
+            end
+            dispatched = dispatched + 1
+            moved = moved + 1
+        end
+        if redis.call('LLEN', org_queue) == 0 then
+            redis.call('ZREM', KEYS[1], org)
+        else
+            seq = seq + 1
+            redis.call('ZADD', KEYS[1], seq, org)
+        end
+    end
+end
+if ARGV[4] == 'reliable' and moved > 0 then
+    redis.call('LTRIM', KEYS[5], 0, 999)
+end
+return {moved, stalled}
+"""
+
+# Eleição de líder do scheduler: adquire ou renova a key com o id do worker
+SCHEDULER_LEADER_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not current then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Publica evento de progresso/status com id sequencial por task (histórico limitado + pub/sub)
+# KEYS: task, histórico, canal; ARGV: evento JSON (sem id), tamanho do histórico, incluir status do hash (1/0)
+PUBLISH_TASK_EVENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local seq = redis.call('HINCRBY', KEYS[1], 'event_seq', 1)
+local fields = string.sub(ARGV[1], 2)
+if ARGV[3] == '1' then
+    fields = '"status": "' .. (redis.call('HGET', KEYS[1], 'status') or '') .. '", ' .. fields
+end
+local event = '{"id": ' .. seq .. ', ' .. fields
+redis.call('RPUSH', KEYS[2], event)
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+-- Task finalizada já tem TTL: o histórico expira junto
+local ttl = redis.call('TTL', KEYS[1])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[2], ttl)
+end
+redis.call('PUBLISH', KEYS[3], event)
+return seq
+"""
 
 # Logger
 logger = logging.getLogger(__name__)
@@ -33,6 +629,8 @@ logger = logging.getLogger(__name__)
 # Enums
 class TaskStatus(str, Enum):
     PENDING = "pending"
+    SCHEDULED = "scheduled"
+    WAITING = "waiting"
     RUNNING = "running" 
     COMPLETED = "completed"
     FAILED = "failed"
@@ -45,6 +643,9 @@ class TaskPriority(str, Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+# Ordem estrita de consumo das filas (maior prioridade primeiro)
+PRIORITY_ORDER = [TaskPriority.CRITICAL, TaskPriority.HIGH, TaskPriority.NORMAL, TaskPriority.LOW]
+
 class TaskType(str, Enum):
     DOCUMENT_PROCESSING = "document_processing"
     WEBHOOK_DELIVERY = "webhook_delivery"
@@ -96,7 +697,7 @@ class TaskResult(BaseModel):
     task_id: str
     status: TaskStatus
     result: Optional[Dict[str, Any]] = None
-    error: Optional[Dict[str, str]] = None
+    error: Optional[Dict[str, Any]] = None
     attempts: int = 0
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
@@ -106,9 +707,16 @@ class TaskResult(BaseModel):
     progress: float = 0.0
     logs: List[Dict[str, Any]] = Field(default_factory=list)
 
+def is_blob_ref(value: Any) -> bool:
+    """Se o valor do payload é uma referência ao blob store"""
+    return isinstance(value, dict) and BLOB_REF_KEY in value
+
 class TaskHandler:
     """Classe base para handlers de tasks"""
     
+    # Campos de texto do payload que o handler lê em streaming do blob store (os demais chegam resolvidos)
+    streamed_payload_fields: Tuple[str, ...] = ()
+    
     def __init__(self, task_manager: 'BackgroundTaskManager'):
         self.task_manager = task_manager
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
@@ -128,111 +736,147 @@ class TaskHandler:
 class DocumentProcessingHandler(TaskHandler):
     """Handler para processamento de documentos"""
     
+    streamed_payload_fields = ("content",)
+    
     async def execute(self, task: TaskDefinition) -> Dict[str, Any]:
+        mode = task.payload.get("mode")
+        if mode == "shard":
+            return await self._execute_shard(task)
+        if mode == "aggregate":
+            return await self._aggregate_shards(task)
+        
         payload = task.payload
         document_id = payload.get("document_id")
-        document_content = payload.get("content", "")
-        chunk_size = payload.get("chunk_size", 1000)
+        content_ref = payload.get("content", "")
+        content_size = content_ref["size"] if is_blob_ref(content_ref) else len(content_ref)
+        # chunk_size legado é em caracteres; chunk_tokens tem precedência
+        chunk_tokens = payload.get("chunk_tokens") or max(1, payload.get("chunk_size", 1000) // 4)
+        chunk_overlap = min(payload.get("chunk_overlap", 0), chunk_tokens // 2)
         
         await self.update_progress(task.id, 0.1, "Iniciando processamento de documento")
         
-        # Chunking do documento
-        chunks = await self._chunk_document(document_content, chunk_size)
-        await self.update_progress(task.id, 0.3, f"Documento dividido em {len(chunks)} chunks")
-        
-        # Gerar embeddings
-        embeddings = []
-        total_chunks = len(chunks)
-        
-        for i, chunk in enumerate(chunks):
-            embedding = await self._generate_embedding(chunk)
-            embeddings.append({
-                "chunk_id": f"{document_id}_chunk_{i}",
-                "content": chunk,
-                "embedding": embedding,
-                "position": i
-            })
-            
-            progress = 0.3 + (0.6 * (i + 1) / total_chunks)
-            await self.update_progress(task.id, progress, f"Processado chunk {i+1}/{total_chunks}")
+        # Chunking em streaming alimentando diretamente a geração de embeddings
+        chunker = DocumentChunker(chunk_tokens=chunk_tokens, overlap_tokens=chunk_overlap)
+        # Conteúdo no blob store é lido aos blocos, sem carregar o documento inteiro;
+        # leitura e tokenização rodam em thread para não bloquear o event loop
+        document_content = await self.task_manager.open_payload_text(content_ref)
+        try:
+            chunks_processed, cache_hits = await self._embed_chunks(
+                task, document_id,
+                self._chunk_document(document_content, chunker),
+                chunker.estimate_chunk_count(content_size)
+            )
+        finally:
+            if hasattr(document_content, "close"):
+                document_content.close()
         
-        # Salvar no banco
-        await self._save_embeddings(document_id, embeddings, task.organization_id)
         await self.update_progress(task.id, 1.0, "Processamento concluído")
         
         return {
             "document_id": document_id,
-            "chunks_processed": len(chunks),
-            "embeddings_generated": len(embeddings),
+            "chunks_processed": chunks_processed,
+            "embeddings_generated": chunks_processed - cache_hits,
+            "embeddings_from_cache": cache_hits,
             "status": "completed"
         }
     
-    async def _chunk_document(self, content: str, chunk_size: int) -> List[str]:
-        """Divide documento em chunks"""
-        words = content.split()
-        chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for word in words:
-            if current_size + len(word) > chunk_size and current_chunk:
-                chunks.append(" ".join(current_chunk))
-                current_chunk = [word]
-                current_size = len(word)
-            else:
-                current_chunk.append(word)
-                current_size += len(word) + 1
+    async def _embed_chunks(self, task: TaskDefinition, document_id: str,
+                            chunks: Union[Iterable[str], AsyncIterable[str]],
+                            estimated_chunks: int, position_offset: int = 0) -> Tuple[int, int]:
+        """Gera e salva embeddings dos chunks; retorna (chunks processados, hits de cache)"""
+        writer = self.task_manager.embedding_writer
+        
+        pending_rows: List[Dict[str, Any]] = []
+        chunks_processed = 0
+        cache_hits = 0
+        
+        # Chunks já presentes no cache (mesmo modelo + conteúdo) não vão para o provedor
+        async for batch in self.task_manager.embedding_client.embed_stream(
+            chunks,
+            cache=self.task_manager.embedding_cache
+        ):
+            pending_rows.extend(
+                {
+                    "chunk_id": f"{document_id}_chunk_{position_offset + position}",
+                    "content": chunk,
+                    "embedding": vector,
+                    "position": position_offset + position,
+                    "cached": from_cache
+                }
+                for position, chunk, vector, from_cache in batch
+            )
+            chunks_processed += len(batch)
+            cache_hits += sum(1 for *_, from_cache in batch if from_cache)
+            
+            # Salvar no banco em lotes, sem acumular o documento inteiro
+            if len(pending_rows) >= writer.batch_size:
+                await self._save_embeddings(document_id, pending_rows, task.organization_id)
+                pending_rows = []
+            
+            progress = 0.1 + 0.85 * min(1.0, chunks_processed / estimated_chunks)
+            await self.update_progress(task.id, progress, f"Processados {chunks_processed} chunks")
         
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
+        if pending_rows:
+            await self._save_embeddings(document_id, pending_rows, task.organization_id)
         
-        return chunks
+        return chunks_processed, cache_hits
     
-    async def _generate_embedding(self, text: str) -> List[float]:
-        """Gera embedding usando OpenRouter"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://openrouter.ai/api/v1/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "https://agentesdeconversao.com.br"
-                    },
-                    json={
-                        "model": "text-embedding-3-small",
-                        "input": text
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return data["data"][0]["embedding"]
-                else:
-                    # Fallback: retorna embedding mock
-                    return [0.1] * 1536
-                    
-        except Exception as e:
-            logger.error(f"Erro ao gerar embedding: {e}")
-            return [0.1] * 1536
+    async def _execute_shard(self, task: TaskDefinition) -> Dict[str, Any]:
+        """Map: embeddings de um intervalo de chunks do documento"""
+        payload = task.payload
+        chunks = payload.get("chunks", [])
+        
+        await self.update_progress(task.id, 0.1, f"Shard {payload.get('shard_index')}: {len(chunks)} chunks")
+        
+        chunks_processed, cache_hits = await self._embed_chunks(
+            task, payload.get("document_id"), chunks, max(1, len(chunks)),
+            position_offset=payload.get("position_offset", 0)
+        )
+        
+        # Progresso do documento (task pai) pelo número de shards concluídos
+        await self.task_manager.record_shard_completion(
+            payload["parent_task_id"], task.id, payload.get("shard_count", 1)
+        )
+        
+        return {
+            "shard_index": payload.get("shard_index"),
+            "chunks_processed": chunks_processed,
+            "embeddings_generated": chunks_processed - cache_hits,
+            "embeddings_from_cache": cache_hits
+        }
+    
+    async def _aggregate_shards(self, task: TaskDefinition) -> Dict[str, Any]:
+        """Reduce: consolida os resultados dos shards do documento"""
+        shard_results = [
+            result for result in (await self.task_manager.get_dependency_results(task)).values() if result
+        ]
+        chunks_processed = sum(r.get("chunks_processed", 0) for r in shard_results)
+        cache_hits = sum(r.get("embeddings_from_cache", 0) for r in shard_results)
+        
+        await self.update_progress(task.id, 1.0, "Processamento concluído")
+        
+        return {
+            "document_id": task.payload.get("document_id"),
+            "chunks_processed": chunks_processed,
+            "embeddings_generated": chunks_processed - cache_hits,
+            "embeddings_from_cache": cache_hits,
+            "shards": len(shard_results),
+            "status": "completed"
+        }
+    
+    def _chunk_document(self, content, chunker: DocumentChunker) -> AsyncIterator[str]:
+        """Divide documento em chunks (leitura e tokenização em thread, fora do event loop)"""
+        return chunker.achunks(content)
     
     async def _save_embeddings(self, document_id: str, embeddings: List[Dict], organization_id: str):
-        """Salva embeddings no Supabase"""
+        """Salva embeddings em lotes (upsert idempotente por chunk_id) e popula o cache"""
         try:
-            supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-            
-            for embedding in embeddings:
-                supabase.table("document_embeddings").insert({
-                    "id": str(uuid.uuid4()),
-                    "document_id": document_id,
-                    "organization_id": organization_id,
-                    "chunk_id": embedding["chunk_id"],
-                    "content": embedding["content"],
-                    "embedding": embedding["embedding"],
-                    "position": embedding["position"],
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }).execute()
-                
+            await self.task_manager.embedding_writer.upsert(document_id, organization_id, embeddings)
+            
+            await self.task_manager.embedding_cache.set_many(
+                self.task_manager.embedding_client.model,
+                [(e["content"], e["embedding"]) for e in embeddings if not e.get("cached")]
+            )
         except Exception as e:
             logger.error(f"Erro ao salvar embeddings: {e}")
             raise
@@ -252,32 +896,49 @@ class WebhookDeliveryHandler(TaskHandler):
         if payload.get("sign_payload", False):
             webhook_data = await self._sign_webhook_payload(webhook_data)
         
+        # Circuito aberto para o host: falha sem requisição, direto para o retry da task
+        breaker = self.task_manager.circuit_breaker
+        try:
+            probe = await breaker.check(webhook_url)
+        except CircuitOpenError as e:
+            await self.add_log(task.id, "warning", f"Webhook não enviado: {str(e)}")
+            raise
+        timeout = WEBHOOK_TASK_TIMEOUT if probe else await breaker.timeout_for(webhook_url, WEBHOOK_TASK_TIMEOUT)
+        
         await self.update_progress(task.id, 0.3, "Enviando webhook")
         
         # Enviar webhook
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(
-                    webhook_url,
-                    json=webhook_data,
-                    headers=headers
-                )
-                
-                await self.update_progress(task.id, 0.8, f"Webhook enviado - Status: {response.status_code}")
+        start_time = time.monotonic()
+        success, latency_ms = False, None
+        try:
+            response = await self.task_manager.http_client.post(
+                webhook_url,
+                json=webhook_data,
+                headers=headers,
+                timeout=timeout
+            )
+            success = not is_failure_status(response.status_code)
+            latency_ms = int((time.monotonic() - start_time) * 1000)
+            
+            await self.update_progress(task.id, 0.8, f"Webhook enviado - Status: {response.status_code}")
+            
+            if response.status_code < 400:
+                await self.update_progress(task.id, 1.0, "Webhook entregue com sucesso")
+                return {
+                    "status": "delivered",
+                    "status_code": response.status_code,
+                    "response": response.text[:1000]  # Primeiros 1000 chars
+                }
+            else:
+                raise Exception(f"HTTP {response.status_code}: {response.text}")
                 
-                if response.status_code < 400:
-                    await self.update_progress(task.id, 1.0, "Webhook entregue com sucesso")
-                    return {
-                        "status": "delivered",
-                        "status_code": response.status_code,
-                        "response": response.text[:1000]  # Primeiros 1000 chars
-                    }
-                else:
-                    raise Exception(f"HTTP {response.status_code}: {response.text}")
-                    
-            except Exception as e:
-                await self.add_log(task.id, "error", f"Erro no webhook: {str(e)}")
-                raise
+        except Exception as e:
+            if isinstance(e, httpx.TimeoutException):
+                latency_ms = int((time.monotonic() - start_time) * 1000)
+            await self.add_log(task.id, "error", f"Erro no webhook: {str(e)}")
+            raise
+        finally:
+            await breaker.record(webhook_url, success, latency_ms)
     
     async def _sign_webhook_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """Assina payload do webhook"""
@@ -301,9 +962,17 @@ class AnalyticsProcessingHandler(TaskHandler):
     
     async def execute(self, task: TaskDefinition) -> Dict[str, Any]:
         payload = task.payload
-        date_range = payload.get("date_range", {})
+        date_range = payload.get("date_range")
         organization_id = task.organization_id
         
+        # Execuções agendadas sem período: últimas 24h até o horário da execução
+        if not date_range:
+            end = task.scheduled_for or task.created_at
+            date_range = {
+                "start": (end - timedelta(days=1)).isoformat(),
+                "end": end.isoformat()
+            }
+        
         await self.update_progress(task.id, 0.1, "Coletando dados de analytics")
         
         # Coletar dados
@@ -401,12 +1070,59 @@ class ExternalSyncHandler(TaskHandler):
         """Sincroniza com N8N"""
         webhook_url = f"{N8N_WEBHOOK_URL}/webhook/{sync_type}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(webhook_url, json=payload)
-            return {
-                "status": "synced" if response.status_code < 400 else "failed",
-                "response_code": response.status_code
-            }
+        response = await self.task_manager.http_client.post(webhook_url, json=payload)
+        return {
+            "status": "synced" if response.status_code < 400 else "failed",
+            "response_code": response.status_code
+        }
+
+# Concurrency Pools
+class TaskConcurrencyPool:
+    """Pool de concorrência (semáforo) de um tipo de task"""
+    
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.semaphore = asyncio.Semaphore(self.limit)
+        self.active = 0
+        self.waiting = 0
+    
+    def has_capacity(self) -> bool:
+        return self.active < self.limit
+    
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+    
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "saturated": not self.has_capacity(),
+            "utilization": round(self.active / self.limit, 2)
+        }
+
+def parse_pool_limits(value: str) -> Dict[TaskType, int]:
+    """Converte "tipo=limite,tipo=limite" em limites por TaskType"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, limit = item.split("=", 1)
+        try:
+            limits[TaskType(name.strip())] = int(limit)
+        except ValueError:
+            logger.warning(f"Limite de pool inválido ignorado: {item}")
+    return limits
 
 class BackgroundTaskManager:
     """Gerenciador principal de background tasks"""
@@ -415,11 +1131,99 @@ class BackgroundTaskManager:
         self.redis_client: Optional[redis.Redis] = None
         self.task_handlers: Dict[TaskType, TaskHandler] = {}
         self.running_tasks: Dict[str, asyncio.Task] = {}
+        self.embedding_client = EmbeddingClient()
+        self.embedding_writer = EmbeddingWriter()
+        self.embedding_cache = EmbeddingCache()
+        self.queue_mode = TASK_QUEUE_MODE
+        self.lease_timeout = TASK_LEASE_TIMEOUT
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._claim_script = None
+        self._read_stream_script = None
+        self._requeue_script = None
+        self._start_script = None
+        self._complete_script = None
+        self._fail_script = None
+        self._cancel_script = None
+        self._dependencies_script = None
+        self._release_dependents_script = None
+        self._cascade_script = None
+        self._event_script = None
+        self._promote_script = None
+        self._leader_script = None
+        self._release_leader_script = None
+        self._fair_dispatch_script = None
+        self._release_fair_script = None
+        self._requeue_dead_letter_script = None
+        self.fair_scheduling = TASK_FAIR_SCHEDULING
+        self._lease_task: Optional[asyncio.Task] = None
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self.is_scheduler_leader = False
+        self._cancelled_task_ids: set = set()
+        self.stream_group = TASK_STREAM_GROUP
+        self._stream_groups_ready: set = set()
+        self._stream_buffer: deque = deque()
+        self._stream_entries: Dict[str, Tuple[str, str]] = {}
+        self.global_pool = TaskConcurrencyPool("global", WORKER_MAX_CONCURRENT)
+        self.task_pools: Dict[TaskType, TaskConcurrencyPool] = {}
+        self._capacity_event = asyncio.Event()
+        self.blob_store: Optional[BlobStore] = None
+        self.serializer = create_serializer()
+        self.circuit_breaker = CircuitBreaker()
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self.configure_pools()
         self.logger = logging.getLogger(__name__)
+    
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """Cliente HTTP compartilhado pelos handlers (criado sob demanda); reaproveita conexões entre tasks"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                timeout=WEBHOOK_TASK_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=WORKER_MAX_CONCURRENT * 2,
+                    max_keepalive_connections=WORKER_MAX_CONCURRENT
+                )
+            )
+        return self._http_client
         
     async def initialize(self):
         """Inicializa o gerenciador"""
         self.redis_client = redis.from_url(REDIS_URL)
+        self.embedding_cache.redis_client = self.redis_client
+        self.circuit_breaker.redis_client = self.redis_client
+        self.blob_store = create_blob_store()
+        self._claim_script = self.redis_client.register_script(CLAIM_TASK_SCRIPT)
+        self._read_stream_script = self.redis_client.register_script(READ_FIRST_STREAM_ENTRY_SCRIPT)
+        self._requeue_script = self.redis_client.register_script(REQUEUE_TASKS_SCRIPT)
+        self._start_script = self.redis_client.register_script(START_TASK_SCRIPT)
+        self._complete_script = self.redis_client.register_script(COMPLETE_TASK_SCRIPT)
+        self._fail_script = self.redis_client.register_script(FAIL_TASK_SCRIPT)
+        self._cancel_script = self.redis_client.register_script(CANCEL_TASK_SCRIPT)
+        self._dependencies_script = self.redis_client.register_script(REGISTER_DEPENDENCIES_SCRIPT)
+        self._release_dependents_script = self.redis_client.register_script(RELEASE_DEPENDENTS_SCRIPT)
+        self._cascade_script = self.redis_client.register_script(CASCADE_DEPENDENTS_SCRIPT)
+        self._event_script = self.redis_client.register_script(PUBLISH_TASK_EVENT_SCRIPT)
+        self._promote_script = self.redis_client.register_script(PROMOTE_DUE_TASKS_SCRIPT)
+        self._leader_script = self.redis_client.register_script(SCHEDULER_LEADER_SCRIPT)
+        self._release_leader_script = self.redis_client.register_script(RELEASE_LEADER_SCRIPT)
+        self._fair_dispatch_script = self.redis_client.register_script(FAIR_DISPATCH_SCRIPT)
+        self._release_fair_script = self.redis_client.register_script(RELEASE_FAIR_SLOT_SCRIPT)
+        self._requeue_dead_letter_script = self.redis_client.register_script(REQUEUE_DEAD_LETTER_SCRIPT)
+        
+        # Sem lease, a vaga de uma task perdida num crash nunca seria liberada
+        if self.fair_scheduling and self.queue_mode not in LEASED_QUEUE_MODES:
+            self.logger.warning(
+                f"TASK_FAIR_SCHEDULING=true requer leases: TASK_QUEUE_MODE={self.queue_mode} "
+                f"substituído por {QUEUE_MODE_RELIABLE}"
+            )
+            self.queue_mode = QUEUE_MODE_RELIABLE
+        
+        # Usar pool asyncpg do database layer para escrita em lote, se disponível
+        try:
+            from .database import db
+            self.embedding_writer.pool = await db.get_pool()
+        except Exception as e:
+            self.logger.warning(f"Pool Postgres indisponível, usando Supabase para embeddings: {e}")
         
         # Registrar handlers
         self.task_handlers[TaskType.DOCUMENT_PROCESSING] = DocumentProcessingHandler(self)
@@ -432,28 +1236,490 @@ class BackgroundTaskManager:
     
     async def submit_task(self, task: TaskDefinition) -> str:
         """Submete uma nova task"""
-        # Salvar task no Redis
-        task_data = task.model_dump_json()
-        await self.redis_client.hset(f"task:{task.id}", mapping={
-            "definition": task_data,
+        await self.offload_payload(task)
+        queue_name, task_fields, scheduled_for = self._task_fields(task)
+        
+        # Dependências: a task aguarda (waiting) até todas concluírem
+        if task.dependencies:
+            return await self._submit_with_dependencies(task, task_fields, scheduled_for)
+        
+        # Salvar task e adicionar à fila baseada na prioridade e no tipo (um round trip)
+        pipe = self.redis_client.pipeline(transaction=True)
+        scheduled = self._add_submit_commands(pipe, task, queue_name, task_fields, scheduled_for)
+        await pipe.execute()
+        
+        if not scheduled and self.fair_scheduling:
+            await self.dispatch_fair_queues([queue_name])
+        
+        if scheduled:
+            self.logger.info(f"Task {task.id} agendada para {scheduled_for.isoformat()}")
+        else:
+            self.logger.info(f"Task {task.id} submetida para fila {queue_name}")
+        return task.id
+    
+    def _task_fields(self, task: TaskDefinition) -> Tuple[str, Dict[str, Any], Optional[datetime]]:
+        """Fila, campos do hash e horário agendado (UTC) de uma task"""
+        queue_name = self._task_queue(task.priority, task.task_type)
+        task_fields = {
+            "definition": self.serializer.dumps_model(task),
+            "task_type": task.task_type.value,
+            "result_ttl": task.config.result_ttl,
+            "queue": queue_name,
             "status": TaskStatus.PENDING,
             "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        }
+        
+        if task.organization_id:
+            task_fields["organization_id"] = task.organization_id
+        
+        blob_keys = [value[BLOB_REF_KEY] for value in task.payload.values() if is_blob_ref(value)]
+        if blob_keys:
+            task_fields["blobs"] = json.dumps(blob_keys)
+        
+        scheduled_for = task.scheduled_for
+        if scheduled_for and scheduled_for.tzinfo is None:
+            scheduled_for = scheduled_for.replace(tzinfo=timezone.utc)
+        
+        return queue_name, task_fields, scheduled_for
+    
+    def _add_submit_commands(self, pipe, task: TaskDefinition, queue_name: str, task_fields: Dict[str, Any],
+                             scheduled_for: Optional[datetime]) -> bool:
+        """Adiciona ao pipeline a gravação da task e o enqueue; retorna True se ficou agendada"""
+        # Execução futura: fica no ZSET de tasks atrasadas até o promoter movê-la para a fila
+        if scheduled_for and scheduled_for > datetime.now(timezone.utc):
+            task_fields["status"] = TaskStatus.SCHEDULED
+            task_fields["scheduled_for"] = scheduled_for.isoformat()
+            pipe.hset(f"task:{task.id}", mapping=task_fields)
+            pipe.zadd(DELAYED_TASKS_KEY, {task.id: scheduled_for.timestamp()})
+            return True
+        
+        if self.fair_scheduling:
+            pipe.hset(f"task:{task.id}", mapping=task_fields)
+            self._add_fair_enqueue_commands(pipe, {(queue_name, self._fair_org(task)): [task.id]})
+            return False
+        
+        pipe.hset(f"task:{task.id}", mapping=task_fields)
+        self._add_enqueue_commands(pipe, {queue_name: [task.id]})
+        return False
+    
+    async def submit_tasks_bulk(self, tasks: List[TaskDefinition]) -> List[str]:
+        """Submete várias tasks em pipelines de até TASK_BULK_PIPELINE_SIZE; retorna os ids na ordem recebida"""
+        task_ids = [task.id for task in tasks]
+        if len(set(task_ids)) != len(task_ids):
+            raise ValueError("IDs de task duplicados no lote")
+        
+        # Tasks com dependências passam pelo registro no DAG depois das independentes
+        independent = [task for task in tasks if not task.dependencies]
+        dependent = [task for task in tasks if task.dependencies]
+        
+        for start in range(0, len(independent), TASK_BULK_PIPELINE_SIZE):
+            batch = independent[start:start + TASK_BULK_PIPELINE_SIZE]
+            await asyncio.gather(*(self.offload_payload(task) for task in batch))
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            queued: Dict[str, List[str]] = {}
+            fair_queued: Dict[Tuple[str, str], List[str]] = {}
+            
+            for task in batch:
+                queue_name, task_fields, scheduled_for = self._task_fields(task)
+                if scheduled_for and scheduled_for > datetime.now(timezone.utc):
+                    self._add_submit_commands(pipe, task, queue_name, task_fields, scheduled_for)
+                elif self.fair_scheduling:
+                    pipe.hset(f"task:{task.id}", mapping=task_fields)
+                    fair_queued.setdefault((queue_name, self._fair_org(task)), []).append(task.id)
+                else:
+                    pipe.hset(f"task:{task.id}", mapping=task_fields)
+                    queued.setdefault(queue_name, []).append(task.id)
+            
+            # Um LPUSH (ou XADDs) por fila (ou sub-fila da organização), depois de todos os hashes
+            self._add_enqueue_commands(pipe, queued)
+            self._add_fair_enqueue_commands(pipe, fair_queued)
+            await pipe.execute()
+            
+            if fair_queued:
+                await self.dispatch_fair_queues({queue_name for queue_name, _ in fair_queued})
+        
+        if dependent:
+            await self.submit_dag(dependent)
+        
+        self.logger.info(f"{len(task_ids)} tasks submetidas em lote")
+        return task_ids
+    
+    async def _submit_with_dependencies(self, task: TaskDefinition, task_fields: Dict[str, Any],
+                                        scheduled_for: Optional[datetime]) -> str:
+        """Salva a task como waiting e a registra nas dependências ainda não concluídas"""
+        dependencies = list(dict.fromkeys(task.dependencies))
+        if task.id in dependencies:
+            raise ValueError(f"Task {task.id} não pode depender de si mesma")
+        
+        task_fields["status"] = TaskStatus.WAITING
+        task_fields["dependencies"] = json.dumps(dependencies)
+        if scheduled_for:
+            task_fields["scheduled_for"] = scheduled_for.isoformat()
+            task_fields["scheduled_ts"] = scheduled_for.timestamp()
+        
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(f"task:{task.id}", mapping=task_fields)
+        await self._dependencies_script(
+            keys=[
+                f"task:{task.id}", TASKS_COMPLETED_INDEX,
+                *(f"task:{dependency}" for dependency in dependencies),
+                *(self._dependents_key(dependency) for dependency in dependencies)
+            ],
+            args=[task.id, *dependencies],
+            client=pipe
+        )
+        _, (remaining, dependency) = await pipe.execute()
+        
+        if remaining < 0:
+            dependency = dependency.decode() if isinstance(dependency, bytes) else dependency
+            reason = {
+                -1: "não encontrada",
+                -2: "falhou ou foi cancelada",
+                -3: "já finalizou e expirou após o result_ttl; submeta a task sem essa dependência"
+            }[remaining]
+            await self.redis_client.delete(f"task:{task.id}")
+            raise ValueError(f"Dependência {dependency} {reason}")
         
-        # Adicionar à fila baseada na prioridade
-        queue_name = f"queue:{task.priority.value}"
-        await self.redis_client.lpush(queue_name, task.id)
+        if remaining > 0:
+            self.logger.info(f"Task {task.id} aguardando {remaining} dependências")
+            return task.id
         
-        self.logger.info(f"Task {task.id} submetida para fila {queue_name}")
+        # Todas as dependências já concluídas
+        pipe = self.redis_client.pipeline(transaction=True)
+        scheduled = bool(scheduled_for and scheduled_for > datetime.now(timezone.utc))
+        if scheduled:
+            pipe.hset(f"task:{task.id}", "status", TaskStatus.SCHEDULED)
+            pipe.zadd(DELAYED_TASKS_KEY, {task.id: scheduled_for.timestamp()})
+        elif self.fair_scheduling:
+            pipe.hset(f"task:{task.id}", "status", TaskStatus.PENDING)
+            self._add_fair_enqueue_commands(pipe, {(task_fields["queue"], self._fair_org(task)): [task.id]})
+        else:
+            pipe.hset(f"task:{task.id}", "status", TaskStatus.PENDING)
+            self._add_enqueue_commands(pipe, {task_fields["queue"]: [task.id]})
+        await pipe.execute()
+        
+        if not scheduled and self.fair_scheduling:
+            await self.dispatch_fair_queues([task_fields["queue"]])
+        
+        self.logger.info(f"Task {task.id} submetida para fila {task_fields['queue']}")
         return task.id
     
-    async def get_task_status(self, task_id: str) -> Optional[TaskResult]:
+    async def submit_dag(self, tasks: List[TaskDefinition]) -> List[str]:
+        """Submete um grafo de tasks (fan-out/fan-in) em ordem topológica"""
+        by_id = {task.id: task for task in tasks}
+        if len(by_id) != len(tasks):
+            raise ValueError("IDs de task duplicados no grafo")
+        
+        # Kahn com adjacência reversa (O(V + E)): dependências externas ao grafo precisam já existir no Redis
+        pending_count: Dict[str, int] = {}
+        dependents: Dict[str, List[str]] = {task.id: [] for task in tasks}
+        for task in tasks:
+            internal = {dep for dep in task.dependencies if dep in by_id}
+            pending_count[task.id] = len(internal)
+            for dep in internal:
+                dependents[dep].append(task.id)
+        
+        ordered = []
+        ready = deque(task.id for task in tasks if not pending_count[task.id])
+        while ready:
+            task_id = ready.popleft()
+            ordered.append(task_id)
+            for other_id in dependents[task_id]:
+                pending_count[other_id] -= 1
+                if not pending_count[other_id]:
+                    ready.append(other_id)
+        
+        if len(ordered) != len(tasks):
+            raise ValueError("Grafo de tasks contém ciclo")
+        
+        for task_id in ordered:
+            await self.submit_task(by_id[task_id])
+        
+        return ordered
+    
+    async def submit_sharded_document(self, task: TaskDefinition,
+                                      shard_chunks: Optional[int] = None) -> str:
+        """Divide o documento em shards (map) e cria a task de agregação (reduce) como pai"""
+        shard_chunks = shard_chunks or DOCUMENT_SHARD_CHUNKS
+        payload = task.payload
+        chunk_tokens = payload.get("chunk_tokens") or max(1, payload.get("chunk_size", 1000) // 4)
+        chunk_overlap = min(payload.get("chunk_overlap", 0), chunk_tokens // 2)
+        chunker = DocumentChunker(chunk_tokens=chunk_tokens, overlap_tokens=chunk_overlap)
+        
+        # Um shard por vez: chunking fora do event loop e texto dos chunks no blob store,
+        # sem materializar o documento inteiro em chunks nem copiá-lo de novo para o Redis
+        offload = TASK_PAYLOAD_OFFLOAD_THRESHOLD > 0 and self.blob_store is not None
+        source = await self.open_payload_text(payload.get("content", ""))
+        chunk_iter = chunker.chunks(source)
+        shards: List[TaskDefinition] = []
+        total_chunks = 0
+        try:
+            while True:
+                group = await asyncio.to_thread(lambda: list(islice(chunk_iter, shard_chunks)))
+                if not group and shards:
+                    break
+                
+                shard = TaskDefinition(
+                    name=task.name,
+                    task_type=task.task_type,
+                    priority=task.priority,
+                    payload={
+                        "mode": "shard",
+                        "document_id": payload.get("document_id"),
+                        "chunks": group,
+                        "position_offset": total_chunks,
+                        "shard_index": len(shards),
+                        "parent_task_id": task.id
+                    },
+                    config=task.config,
+                    organization_id=task.organization_id,
+                    user_id=task.user_id,
+                    tags=[*task.tags, "shard"]
+                )
+                if offload:
+                    await self._offload_payload_field(shard, "chunks", group)
+                
+                shards.append(shard)
+                total_chunks += len(group)
+                if len(group) < shard_chunks:
+                    break
+        finally:
+            if hasattr(source, "close"):
+                source.close()
+        
+        for shard in shards:
+            shard.name = f"{task.name} [shard {shard.payload['shard_index'] + 1}/{len(shards)}]"
+            shard.payload["shard_count"] = len(shards)
+        
+        parent = task.model_copy(update={
+            "payload": {
+                "mode": "aggregate",
+                "document_id": payload.get("document_id"),
+                "total_chunks": total_chunks,
+                "shard_count": len(shards)
+            },
+            "dependencies": [shard.id for shard in shards]
+        })
+        
+        await self.submit_dag([*shards, parent])
+        
+        self.logger.info(f"Documento {payload.get('document_id')} dividido em {len(shards)} shards ({total_chunks} chunks)")
+        return parent.id
+    
+    # =========================================
+    # DEPENDÊNCIAS (DAG)
+    # =========================================
+    
+    def _dependents_key(self, task_id: str) -> str:
+        """Conjunto das tasks que aguardam a conclusão de task_id"""
+        return f"task_dependents:{task_id}"
+    
+    async def _task_dependents(self, task_id: str) -> List[str]:
+        """Dependentes diretos registrados na task"""
+        members = await self.redis_client.smembers(self._dependents_key(task_id))
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+    
+    async def _dependency_graph(self, roots: List[str]) -> List[str]:
+        """Raízes seguidas de seus dependentes transitivos (busca em largura, sem repetição)"""
+        graph = list(dict.fromkeys(roots))
+        seen = set(graph)
+        frontier = graph
+        while frontier:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for task_id in frontier:
+                pipe.smembers(self._dependents_key(task_id))
+            
+            frontier = []
+            for members in await pipe.execute():
+                for member in members:
+                    member = member.decode() if isinstance(member, bytes) else member
+                    if member not in seen:
+                        seen.add(member)
+                        frontier.append(member)
+            graph.extend(frontier)
+        
+        return graph
+    
+    def _graph_key_groups(self, graph: List[str]) -> List[str]:
+        """Keys (task, task_dependents, logs, eventos) de cada task do grafo, na ordem do grafo"""
+        return [
+            key for task_id in graph
+            for key in (f"task:{task_id}", self._dependents_key(task_id), *self._task_related_keys(task_id))
+        ]
+    
+    async def _enqueue_key_groups(self, task_ids: List[str]) -> List[str]:
+        """Keys de enfileiramento (task, fila, sub-fila da organização, anel) de cada task, lidas do hash"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hmget(f"task:{task_id}", "queue", "organization_id")
+        rows = await pipe.execute()
+        
+        keys = []
+        for task_id, (queue_name, org) in zip(task_ids, rows):
+            queue_name = queue_name.decode() if isinstance(queue_name, bytes) else queue_name or "queue:normal"
+            org = org.decode() if isinstance(org, bytes) else org or FAIR_DEFAULT_ORG
+            keys.extend([
+                f"task:{task_id}", self._enqueue_key(queue_name),
+                self._fair_queue_key(queue_name, org), self._fair_ring_key(queue_name)
+            ])
+        return keys
+    
+    async def _release_late_dependents(self, task_id: str):
+        """Libera os dependentes que se registraram enquanto a task concluía"""
+        while True:
+            dependents = await self._task_dependents(task_id)
+            if not dependents:
+                return
+            
+            released_all = await self._release_dependents_script(
+                keys=[
+                    self._dependents_key(task_id), DELAYED_TASKS_KEY, QUEUE_SIGNAL_KEY,
+                    *await self._enqueue_key_groups(dependents)
+                ],
+                args=[
+                    datetime.now(timezone.utc).timestamp(), self.queue_mode, TASK_STREAM_MAXLEN,
+                    "1" if self.fair_scheduling else "0", len(dependents), *dependents
+                ]
+            )
+            if released_all:
+                return
+    
+    async def _cascade_late_dependents(self, roots: List[str], status: TaskStatus, error: Dict[str, Any],
+                                       default_ttl: int) -> List[str]:
+        """Propaga falha/cancelamento aos dependentes que se registraram depois da leitura do grafo"""
+        affected: List[str] = []
+        while True:
+            graph = await self._dependency_graph(roots)
+            now = datetime.now(timezone.utc)
+            complete, *cascaded = await self._cascade_script(
+                keys=[TASKS_COMPLETED_INDEX, *self._graph_key_groups(graph)],
+                args=[
+                    status.value, json.dumps(error), now.isoformat(), now.timestamp(), default_ttl,
+                    len(roots), len(graph), *graph
+                ]
+            )
+            cascaded = [task_id.decode() if isinstance(task_id, bytes) else task_id for task_id in cascaded]
+            affected.extend(cascaded)
+            if complete:
+                return affected
+            roots = [*roots, *cascaded]
+    
+    # =========================================
+    # PAYLOADS GRANDES (BLOB STORE)
+    # =========================================
+    
+    async def offload_payload(self, task: TaskDefinition) -> List[str]:
+        """Move para o blob store os campos do payload acima de TASK_PAYLOAD_OFFLOAD_THRESHOLD"""
+        if TASK_PAYLOAD_OFFLOAD_THRESHOLD <= 0 or self.blob_store is None:
+            return []
+        
+        blob_keys = []
+        for field, value in list(task.payload.items()):
+            if is_blob_ref(value):
+                continue
+            
+            is_text = isinstance(value, str)
+            data = value.encode("utf-8") if is_text else json.dumps(value).encode("utf-8")
+            if len(data) < TASK_PAYLOAD_OFFLOAD_THRESHOLD:
+                continue
+            
+            blob_keys.append(await self._offload_payload_field(task, field, value, data))
+        
+        if blob_keys:
+            self.logger.info(f"Task {task.id}: {len(blob_keys)} campos do payload movidos para o blob store")
+        return blob_keys
+    
+    async def _offload_payload_field(self, task: TaskDefinition, field: str, value: Any,
+                                     data: Optional[bytes] = None) -> str:
+        """Grava um campo do payload no blob store e o substitui pela referência"""
+        is_text = isinstance(value, str)
+        if data is None:
+            data = value.encode("utf-8") if is_text else json.dumps(value).encode("utf-8")
+        
+        key = f"tasks/{task.id}/{field}"
+        stored_size = await self.blob_store.put(key, data)
+        task.payload[field] = {
+            BLOB_REF_KEY: key,
+            "type": "text" if is_text else "json",
+            "size": len(value) if is_text else len(data),
+            "stored_size": stored_size
+        }
+        return key
+    
+    async def load_payload_value(self, value: Any) -> Any:
+        """Valor completo de um campo do payload (lê do blob store se for referência)"""
+        if not is_blob_ref(value):
+            return value
+        
+        data = await self.blob_store.get(value[BLOB_REF_KEY])
+        if value.get("type") == "text":
+            return data.decode("utf-8")
+        return json.loads(data)
+    
+    async def open_payload_text(self, value: Any):
+        """Texto de um campo do payload: a própria string ou um arquivo lido sob demanda do blob store"""
+        if is_blob_ref(value) and value.get("type") == "text":
+            return await self.blob_store.open_text(value[BLOB_REF_KEY])
+        return await self.load_payload_value(value)
+    
+    async def resolve_payload(self, task: TaskDefinition, streamed_fields: Tuple[str, ...] = ()) -> TaskDefinition:
+        """Cópia da task com as referências do payload carregadas (exceto campos lidos em streaming)"""
+        refs = [
+            field for field, value in task.payload.items()
+            if is_blob_ref(value) and field not in streamed_fields
+        ]
+        if not refs:
+            return task
+        
+        values = await asyncio.gather(*(self.load_payload_value(task.payload[field]) for field in refs))
+        return task.model_copy(update={"payload": {**task.payload, **dict(zip(refs, values))}})
+    
+    async def record_shard_completion(self, parent_task_id: str, shard_task_id: str, shard_count: int):
+        """Registra shard concluído (idempotente) e atualiza o progresso da task pai"""
+        done_key = f"task_shards_done:{parent_task_id}"
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.sadd(done_key, shard_task_id)
+        pipe.scard(done_key)
+        pipe.expire(done_key, TaskConfig().result_ttl)
+        _, completed, _ = await pipe.execute()
+        
+        await self.update_task_progress(
+            parent_task_id,
+            0.95 * min(1.0, completed / max(1, shard_count)),
+            f"Shards concluídos: {completed}/{shard_count}"
+        )
+    
+    async def get_dependency_results(self, task: TaskDefinition) -> Dict[str, Any]:
+        """Resultados das dependências de uma task (fan-in)"""
+        if not task.dependencies:
+            return {}
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for dependency in task.dependencies:
+            pipe.hget(f"task:{dependency}", "result")
+        raw_results = await pipe.execute()
+        
+        return {
+            dependency: json.loads(raw) if raw else None
+            for dependency, raw in zip(task.dependencies, raw_results)
+        }
+    
+    async def get_task_status(self, task_id: str, log_limit: int = TASK_LOG_MAX_ENTRIES) -> Optional[TaskResult]:
         """Obtém status de uma task"""
-        task_data = await self.redis_client.hgetall(f"task:{task_id}")
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(f"task:{task_id}")
+        pipe.lrange(self._task_logs_key(task_id), -log_limit, -1)
+        task_data, raw_logs = await pipe.execute()
         
         if not task_data:
             return None
         
+        task_data = {
+            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+            for k, v in task_data.items()
+        }
+        
         # Construir TaskResult dos dados do Redis
         result_data = {
             "task_id": task_id,
@@ -482,15 +1748,83 @@ class BackgroundTaskManager:
         if "execution_time" in task_data:
             result_data["execution_time"] = float(task_data["execution_time"])
         
+        # Logs da lista (tasks antigas ainda podem ter o campo JSON "logs")
+        if raw_logs:
+            result_data["logs"] = self._decode_json_entries(raw_logs)
+        
         return TaskResult(**result_data)
     
     async def update_task_progress(self, task_id: str, progress: float, message: str = ""):
         """Atualiza progresso de uma task"""
-        await self.redis_client.hset(f"task:{task_id}", mapping={
+        now = datetime.now(timezone.utc).isoformat()
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(f"task:{task_id}", mapping={
             "progress": progress,
             "last_message": message,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": now
         })
+        # Status lido do hash no script: uma task pai aguardando shards continua waiting
+        await self._queue_task_event(pipe, task_id, "progress", {
+            "progress": progress,
+            "message": message
+        }, now, current_status=True)
+        await pipe.execute()
+    
+    # =========================================
+    # EVENTOS DE PROGRESSO (PUB/SUB)
+    # =========================================
+    
+    def task_events_channel(self, task_id: str) -> str:
+        """Canal pub/sub com os eventos de progresso/status da task"""
+        return f"task_events:{task_id}"
+    
+    def _task_event_history_key(self, task_id: str) -> str:
+        return f"task_event_log:{task_id}"
+    
+    async def _queue_task_event(self, client, task_id: str, event_type: str, data: Dict[str, Any],
+                                timestamp: str = None, current_status: bool = False):
+        """Enfileira a publicação do evento no client/pipeline informado (com o status atual do hash, se pedido)"""
+        event = {
+            "type": event_type,
+            "task_id": task_id,
+            **data,
+            "timestamp": timestamp or datetime.now(timezone.utc).isoformat()
+        }
+        return await self._event_script(
+            keys=[f"task:{task_id}", self._task_event_history_key(task_id), self.task_events_channel(task_id)],
+            args=[json.dumps(event), TASK_EVENT_HISTORY, "1" if current_status else "0"],
+            client=client
+        )
+    
+    async def publish_task_event(self, task_id: str, status: str, **data):
+        """Publica mudança de status da task para os streams SSE"""
+        try:
+            await self._queue_task_event(self.redis_client, task_id, "status", {"status": status, **data})
+        except Exception as e:
+            self.logger.warning(f"Falha ao publicar evento da task {task_id}: {e}")
+    
+    async def get_task_events(self, task_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        """Eventos do histórico com id maior que after_id (resume via Last-Event-ID)"""
+        raw_events = await self.redis_client.lrange(self._task_event_history_key(task_id), 0, -1)
+        return [event for event in self._decode_json_entries(raw_events) if event.get("id", 0) > after_id]
+    
+    async def get_task_snapshot(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Estado atual resumido da task (HMGET, sem carregar result/logs)"""
+        status, progress, message, seq = await self.redis_client.hmget(
+            f"task:{task_id}", ["status", "progress", "last_message", "event_seq"]
+        )
+        if status is None:
+            return None
+        
+        return {
+            "id": int(seq or 0),
+            "type": "snapshot",
+            "task_id": task_id,
+            "status": status.decode() if isinstance(status, bytes) else status,
+            "progress": float(progress or 0.0),
+            "message": (message.decode() if isinstance(message, bytes) else message) or "",
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
     
     async def add_task_log(self, task_id: str, level: str, message: str, extra: Dict[str, Any] = None):
         """Adiciona log a uma task"""
@@ -501,144 +1835,1184 @@ class BackgroundTaskManager:
             "extra": extra or {}
         }
         
-        # Buscar logs existentes
-        existing_logs = await self.redis_client.hget(f"task:{task_id}", "logs")
-        logs = json.loads(existing_logs) if existing_logs else []
+        # Append + truncar aos últimos N logs num único round trip
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(self._task_logs_key(task_id), json.dumps(log_entry))
+        pipe.ltrim(self._task_logs_key(task_id), -TASK_LOG_MAX_ENTRIES, -1)
+        await pipe.execute()
+    
+    def _task_related_keys(self, task_id: str) -> List[str]:
+        """Keys auxiliares da task (logs e histórico de eventos), expiradas/removidas junto com ela"""
+        return [self._task_logs_key(task_id), self._task_event_history_key(task_id)]
+    
+    def _task_logs_key(self, task_id: str) -> str:
+        """Lista append-only (limitada) de logs da task"""
+        return f"task_logs:{task_id}"
+    
+    def _decode_json_entries(self, raw_logs: List) -> List[Dict[str, Any]]:
+        logs = []
+        for raw in raw_logs:
+            try:
+                logs.append(json.loads(raw))
+            except (json.JSONDecodeError, TypeError):
+                pass
+        return logs
+    
+    async def get_task_logs(self, task_id: str, offset: int = 0, limit: int = 50) -> Optional[Dict[str, Any]]:
+        """Obtém logs de uma task paginados (do mais antigo para o mais recente)"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.exists(f"task:{task_id}")
+        pipe.llen(self._task_logs_key(task_id))
+        pipe.lrange(self._task_logs_key(task_id), offset, offset + limit - 1)
+        exists, total, raw_logs = await pipe.execute()
         
-        logs.append(log_entry)
+        if not exists:
+            return None
         
-        # Manter apenas os últimos 50 logs
-        if len(logs) > 50:
-            logs = logs[-50:]
+        if not total:
+            # Tasks antigas: logs no campo JSON do hash
+            legacy = await self.redis_client.hget(f"task:{task_id}", "logs")
+            legacy_logs = json.loads(legacy) if legacy else []
+            return {"logs": legacy_logs[offset:offset + limit], "total": len(legacy_logs)}
         
-        await self.redis_client.hset(f"task:{task_id}", "logs", json.dumps(logs))
+        return {"logs": self._decode_json_entries(raw_logs), "total": total}
     
     async def execute_task(self, task_id: str):
         """Executa uma task"""
+        task = None
         try:
-            # Marcar como running
-            await self.redis_client.hset(f"task:{task_id}", mapping={
-                "status": TaskStatus.RUNNING,
-                "started_at": datetime.now(timezone.utc).isoformat()
-            })
+            # Marcar como running e carregar definição (um round trip)
+            task_data = await self._start_script(
+                keys=[f"task:{task_id}"],
+                args=[datetime.now(timezone.utc).isoformat()]
+            )
+            if task_data is None:
+                self.logger.info(f"Task {task_id} cancelada ou já finalizada, ignorando")
+                await self.ack_task(task_id)
+                return
             
-            # Carregar definição da task
-            task_data = await self.redis_client.hget(f"task:{task_id}", "definition")
-            task = TaskDefinition.model_validate_json(task_data)
+            await self.publish_task_event(task_id, TaskStatus.RUNNING.value)
+            
+            task = self.serializer.loads_model(TaskDefinition, task_data)
             
             # Obter handler
             handler = self.task_handlers.get(task.task_type)
             if not handler:
                 raise Exception(f"No handler for task type: {task.task_type}")
             
+            # Campos no blob store: carregados aqui, exceto os que o handler lê em streaming
+            handler_task = await self.resolve_payload(task, getattr(handler, "streamed_payload_fields", ()))
+            
             # Executar com timeout
             start_time = datetime.now(timezone.utc)
             
             result = await asyncio.wait_for(
-                handler.execute(task),
+                handler.execute(handler_task),
                 timeout=task.config.timeout
             )
             
             end_time = datetime.now(timezone.utc)
             execution_time = (end_time - start_time).total_seconds()
             
-            # Marcar como concluída
-            await self.redis_client.hset(f"task:{task_id}", mapping={
-                "status": TaskStatus.COMPLETED,
-                "result": json.dumps(result),
-                "completed_at": end_time.isoformat(),
-                "execution_time": execution_time,
-                "progress": 1.0
-            })
+            # Marcar como concluída + ack da fila (transação única)
+            dependents = await self._task_dependents(task_id)
+            completed = await self._run_transition(
+                self._complete_script, task_id,
+                keys=[
+                    f"task:{task_id}", TASKS_COMPLETED_INDEX, *self._task_related_keys(task_id),
+                    *self._fair_slot_keys(task_id)[1:], self._dependents_key(task_id),
+                    DELAYED_TASKS_KEY, QUEUE_SIGNAL_KEY, *await self._enqueue_key_groups(dependents)
+                ],
+                args=[
+                    json.dumps(result), end_time.isoformat(), execution_time,
+                    task_id, end_time.timestamp(), task.config.result_ttl,
+                    self.queue_mode, TASK_STREAM_MAXLEN, "1" if self.fair_scheduling else "0",
+                    len(dependents), *dependents
+                ]
+            )
+            if completed == 2:
+                await self._release_late_dependents(task_id)
             
-            self.logger.info(f"Task {task_id} concluída em {execution_time:.2f}s")
+            if completed:
+                await self.publish_task_event(
+                    task_id, TaskStatus.COMPLETED.value, progress=1.0, execution_time=execution_time
+                )
+                self.logger.info(f"Task {task_id} concluída em {execution_time:.2f}s")
+            else:
+                self.logger.info(f"Task {task_id} cancelada durante a execução, resultado descartado")
             
+            await self._refill_fair_queue(task, all_queues=bool(dependents))
+        
         except asyncio.TimeoutError:
-            await self._handle_task_failure(task_id, "Task timeout", is_retryable=True)
+            await self._handle_task_failure(task_id, "Task timeout", is_retryable=True, task=task)
+        except CircuitOpenError as e:
+            # Retry antes do próximo probe falharia de novo sem requisição
+            await self._handle_task_failure(task_id, str(e), is_retryable=True, task=task, min_delay=e.retry_after)
+        except asyncio.CancelledError:
+            # Shutdown do worker: devolver a task à fila em vez de perdê-la
+            if task_id not in self._cancelled_task_ids:
+                if self.queue_mode in (QUEUE_MODE_RELIABLE, QUEUE_MODE_STREAMS):
+                    await self.release_task(task_id)
+                elif self.fair_scheduling:
+                    # Sem lease a task não volta à fila: a vaga não pode ficar presa
+                    await self._release_fair_script(keys=self._fair_slot_keys(task_id), args=[task_id])
+                    await self._refill_fair_queue(task)
+            self._cancelled_task_ids.discard(task_id)
+            raise
         except Exception as e:
-            await self._handle_task_failure(task_id, str(e), is_retryable=True)
+            await self._handle_task_failure(task_id, str(e), is_retryable=True, task=task)
+    
+    async def _run_transition(self, script, task_id: str, keys: List[str], args: List[Any]):
+        """Executa o script de transição e o ack da fila numa única transação (MULTI/EXEC)"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        await script(keys=keys, args=args, client=pipe)
+        self._add_ack_commands(pipe, task_id)
+        results = await pipe.execute()
+        return results[0]
     
-    async def _handle_task_failure(self, task_id: str, error_message: str, is_retryable: bool = True):
-        """Lida com falha de task"""
-        # Incrementar contador de tentativas
-        current_attempts = await self.redis_client.hincrby(f"task:{task_id}", "attempts", 1)
+    async def _handle_task_failure(self, task_id: str, error_message: str, is_retryable: bool = True,
+                                   task: Optional[TaskDefinition] = None, min_delay: float = 0):
+        """Lida com falha de task; min_delay é o atraso mínimo do retry (ex.: circuito aberto do destino)"""
+        # Definição já carregada em execute_task; só buscar se a falha ocorreu antes disso
+        if task is None:
+            try:
+                task_data = await self.redis_client.hget(f"task:{task_id}", "definition")
+                task = self.serializer.loads_model(TaskDefinition, task_data)
+            except Exception:
+                task = None
         
-        # Carregar definição para verificar retry policy
-        task_data = await self.redis_client.hget(f"task:{task_id}", "definition")
-        task = TaskDefinition.model_validate_json(task_data)
-        
-        if is_retryable and current_attempts <= task.config.retry_policy.max_retries:
-            # Agendar retry
-            retry_delay = task.config.retry_policy.get_delay(current_attempts - 1)
-            next_retry = datetime.now(timezone.utc) + timedelta(seconds=retry_delay)
-            
-            await self.redis_client.hset(f"task:{task_id}", mapping={
-                "status": TaskStatus.RETRYING,
-                "retry_count": current_attempts,
-                "next_retry_at": next_retry.isoformat(),
-                "error": json.dumps({"message": error_message, "retryable": True})
-            })
+        policy = task.config.retry_policy if task else TaskRetryPolicy(max_retries=0)
+        priority = task.priority if task else TaskPriority.NORMAL
+        task_type = task.task_type if task else await self._get_task_type(task_id)
+        
+        # Delays pré-calculados (com jitter) para cada tentativa possível
+        now = datetime.now(timezone.utc)
+        retry_args = []
+        for attempt in range(policy.max_retries):
+            delay = max(policy.get_delay(attempt), min_delay)
+            next_retry = now + timedelta(seconds=delay)
+            retry_args.extend([delay, next_retry.timestamp(), next_retry.isoformat()])
+        
+        # Grafo de dependentes lido antes: a falha permanente propaga em cascata no mesmo script
+        graph = await self._dependency_graph([task_id])
+        result_ttl = task.config.result_ttl if task else TaskConfig().result_ttl
+        dependency_error = {"message": f"Dependency {task_id} failed", "retryable": False}
+        attempts, retry_delay, cascade_complete, *failed_dependents = await self._run_transition(
+            self._fail_script, task_id,
+            keys=[
+                f"task:{task_id}", f"retry_queue:{priority.value}",
+                TASKS_COMPLETED_INDEX, *self._task_related_keys(task_id),
+                self._dead_letter_key(task_type), *self._fair_slot_keys(task_id)[1:],
+                *self._graph_key_groups(graph)
+            ],
+            args=[
+                "1" if is_retryable else "0",
+                policy.max_retries,
+                json.dumps({"message": error_message, "retryable": True}),
+                json.dumps({"message": error_message, "retryable": False}),
+                now.isoformat(),
+                task_id,
+                now.timestamp(),
+                result_ttl,
+                json.dumps(dependency_error),
+                len(graph), *graph,
+                *retry_args
+            ]
+        )
+        
+        failed_dependents = [
+            dependent_id.decode() if isinstance(dependent_id, bytes) else dependent_id
+            for dependent_id in failed_dependents
+        ]
+        if not cascade_complete:
+            failed_dependents.extend(await self._cascade_late_dependents(
+                [task_id, *failed_dependents], TaskStatus.FAILED, dependency_error, result_ttl
+            ))
+        
+        if attempts == 0:
+            self.logger.info(f"Task {task_id} cancelada, falha ignorada")
+        elif retry_delay >= 0:
+            await self.publish_task_event(
+                task_id, TaskStatus.RETRYING.value, error=error_message, attempts=attempts, retry_in=retry_delay
+            )
+            self.logger.warning(f"Task {task_id} agendada para retry em {retry_delay}s")
+            await self._refill_fair_queue(task)
+        else:
+            await self.publish_task_event(
+                task_id, TaskStatus.FAILED.value, error=error_message, attempts=attempts
+            )
+            self.logger.error(f"Task {task_id} falhou permanentemente: {error_message}")
+            await self._refill_fair_queue(task)
             
-            # Re-adicionar à fila com delay
-            await self.redis_client.zadd(f"retry_queue:{task.priority.value}", {task_id: next_retry.timestamp()})
+            # Dependentes (diretos e transitivos) falham em cascata
+            for dependent_id in failed_dependents:
+                await self.publish_task_event(
+                    dependent_id, TaskStatus.FAILED.value, error=f"Dependency {task_id} failed"
+                )
+    
+    async def _enqueue(self, queue_name: str, task_ids: List[str]):
+        """Adiciona tasks à fila (lista ou stream, conforme o queue mode)"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        self._add_enqueue_commands(pipe, {queue_name: task_ids})
+        await pipe.execute()
+    
+    def _add_enqueue_commands(self, pipe, queued: Dict[str, List[str]]):
+        """Adiciona ao pipeline o enqueue das tasks por fila (e o sinal do modo reliable)"""
+        total = 0
+        for queue_name, task_ids in queued.items():
+            if not task_ids:
+                continue
+            total += len(task_ids)
+            if self.queue_mode == QUEUE_MODE_STREAMS:
+                for task_id in task_ids:
+                    pipe.xadd(
+                        self._stream_key(queue_name), {"task_id": task_id},
+                        maxlen=TASK_STREAM_MAXLEN, approximate=True
+                    )
+            else:
+                pipe.lpush(queue_name, *task_ids)
+        
+        if total and self.queue_mode == QUEUE_MODE_RELIABLE:
+            pipe.lpush(QUEUE_SIGNAL_KEY, *(["1"] * min(total, QUEUE_SIGNAL_MAX)))
+            pipe.ltrim(QUEUE_SIGNAL_KEY, 0, QUEUE_SIGNAL_MAX - 1)
+    
+    def _enqueue_key(self, queue_name: str) -> str:
+        """Key onde as tasks da fila são enfileiradas: a lista ou sua stream, conforme o queue mode"""
+        return self._stream_key(queue_name) if self.queue_mode == QUEUE_MODE_STREAMS else queue_name
+    
+    async def dequeue_task(self, queues: List[str], timeout: int = QUEUE_BLOCK_TIMEOUT) -> Optional[str]:
+        """Aguarda a próxima task das filas, na ordem em que são passadas"""
+        if self.queue_mode == QUEUE_MODE_STREAMS:
+            return await self._read_stream_task(queues, timeout)
+        
+        if self.queue_mode == QUEUE_MODE_RELIABLE:
+            return await self._claim_task(queues, timeout)
+        
+        item = await self.redis_client.brpop(queues, timeout=timeout)
+        if not item:
+            return None
+        
+        _, task_id = item
+        return task_id.decode() if isinstance(task_id, bytes) else task_id
+    
+    # =========================================
+    # RELIABLE QUEUE (LEASES)
+    # =========================================
+    
+    def _processing_key(self, worker_id: str = None) -> str:
+        """Lista de tasks em processamento de um worker"""
+        return f"processing:{worker_id or self.worker_id}"
+    
+    async def _claim_task(self, queues: List[str], timeout: int) -> Optional[str]:
+        """Move a próxima task para processing:{worker_id} com lease (LMOVE atômico via Lua)"""
+        for attempt in range(2):
+            deadline = datetime.now(timezone.utc).timestamp() + self.lease_timeout
+            task_id = await self._claim_script(
+                keys=[self._processing_key(), TASK_LEASES_KEY, TASK_CLAIMS_KEY, *queues],
+                args=[deadline, self.worker_id]
+            )
+            if task_id:
+                return task_id.decode() if isinstance(task_id, bytes) else task_id
             
-            self.logger.warning(f"Task {task_id} agendada para retry em {retry_delay}s")
+            if attempt == 0:
+                # Filas vazias: bloquear no sinal em vez de fazer polling
+                if not await self.redis_client.brpop([QUEUE_SIGNAL_KEY], timeout=timeout):
+                    return None
+        
+        return None
+    
+    def _add_ack_commands(self, pipe, task_id: str):
+        """Adiciona ao pipeline os comandos de ack da task conforme o queue mode"""
+        if self.queue_mode == QUEUE_MODE_STREAMS:
+            entry = self._stream_entries.pop(task_id, None)
+            if entry:
+                pipe.xack(entry[0], self.stream_group, entry[1])
+        elif self.queue_mode == QUEUE_MODE_RELIABLE:
+            pipe.lrem(self._processing_key(), 0, task_id)
+            pipe.zrem(TASK_LEASES_KEY, task_id)
+            pipe.hdel(TASK_CLAIMS_KEY, task_id)
+    
+    async def ack_task(self, task_id: str):
+        """Confirma o processamento, removendo a task da lista de processamento e do lease"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        self._add_ack_commands(pipe, task_id)
+        if len(pipe):
+            await pipe.execute()
+    
+    async def release_task(self, task_id: str):
+        """Devolve imediatamente uma task em processamento para sua fila de origem"""
+        if self.queue_mode != QUEUE_MODE_RELIABLE or not self._requeue_script:
+            return
+        
+        await self._requeue_leased_tasks([task_id], LEASE_RELEASE_ALL)
+        self.logger.info(f"Task {task_id} devolvida à fila")
+    
+    def _parse_claim(self, claim: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """Worker e fila de origem de um claim ("<worker_id>|<fila>")"""
+        if not claim:
+            return None, None
+        worker_id, _, queue_name = claim.rpartition("|")
+        return worker_id, queue_name
+    
+    async def _read_claims(self, task_ids: List[str]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """Claim atual de cada task com o worker e a fila de origem (fila da task se não houver claim)"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hget(TASK_CLAIMS_KEY, task_id)
+            pipe.hget(f"task:{task_id}", "queue")
+        results = await pipe.execute()
+        
+        claims = []
+        for claim, queue_name in zip(results[0::2], results[1::2]):
+            claim = claim.decode() if isinstance(claim, bytes) else claim or ""
+            worker_id, source_queue = self._parse_claim(claim)
+            if not source_queue:
+                source_queue = queue_name.decode() if isinstance(queue_name, bytes) else queue_name
+            claims.append((claim, worker_id, source_queue))
+        return claims
+    
+    async def _requeue_leased_tasks(self, task_ids: List[str], deadline: float) -> int:
+        """Devolve à fila de origem as tasks com lease vencido antes de deadline"""
+        keys = [TASK_LEASES_KEY, QUEUE_SIGNAL_KEY, TASK_CLAIMS_KEY]
+        args: List[Any] = [deadline]
+        for task_id, (claim, worker_id, source_queue) in zip(task_ids, await self._read_claims(task_ids)):
+            keys.extend([f"task:{task_id}", self._processing_key(worker_id), source_queue or "queue:normal"])
+            args.extend([task_id, claim])
+        return await self._requeue_script(keys=keys, args=args)
+    
+    async def requeue_expired_leases(self, limit: int = 100) -> int:
+        """Devolve à fila tasks cujo worker parou de renovar o lease"""
+        if self.queue_mode == QUEUE_MODE_STREAMS:
+            return await self._autoclaim_stream_entries(limit)
+        
+        now = datetime.now(timezone.utc).timestamp()
+        expired = await self.redis_client.zrangebyscore(
+            TASK_LEASES_KEY, min=0, max=now, start=0, num=limit
+        )
+        if not expired:
+            return 0
+        
+        requeued = await self._requeue_leased_tasks(
+            [task_id.decode() if isinstance(task_id, bytes) else task_id for task_id in expired], now
+        )
+        if requeued:
+            self.logger.warning(f"{requeued} tasks com lease expirado devolvidas à fila")
+        return requeued
+    
+    async def renew_leases(self):
+        """Renova (heartbeat) os leases das tasks em execução neste worker"""
+        task_ids = [task_id for task_id, task in self.running_tasks.items() if not task.done()]
+        
+        if self.queue_mode == QUEUE_MODE_STREAMS:
+            await self._touch_stream_entries(task_ids)
+            return
+        
+        if not task_ids:
+            return
+        
+        deadline = datetime.now(timezone.utc).timestamp() + self.lease_timeout
+        await self.redis_client.zadd(
+            TASK_LEASES_KEY, {task_id: deadline for task_id in task_ids}, xx=True
+        )
+    
+    async def _lease_maintenance_loop(self):
+        """Heartbeat dos leases locais e recuperação de leases expirados"""
+        interval = max(1, self.lease_timeout // 3)
+        
+        while True:
+            try:
+                await self.renew_leases()
+                await self.requeue_expired_leases()
+            except Exception as e:
+                self.logger.error(f"Erro na manutenção de leases: {e}")
+            
+            await asyncio.sleep(interval)
+    
+    def start_lease_maintenance(self):
+        """Inicia heartbeat/reaper de leases (modos reliable e streams)"""
+        if self.queue_mode not in LEASED_QUEUE_MODES:
+            return
+        
+        if self._lease_task is None or self._lease_task.done():
+            self._lease_task = asyncio.create_task(self._lease_maintenance_loop())
+    
+    # =========================================
+    # REDIS STREAMS (CONSUMER GROUPS)
+    # =========================================
+    
+    def _stream_key(self, queue_name: str) -> str:
+        """Stream equivalente a uma fila (queue:high -> stream:high)"""
+        return "stream:" + queue_name.split(":", 1)[-1]
+    
+    async def _ensure_stream_groups(self, streams: List[str]):
+        """Cria o consumer group em cada stream (idempotente)"""
+        for stream in streams:
+            if stream in self._stream_groups_ready:
+                continue
+            
+            try:
+                await self.redis_client.xgroup_create(stream, self.stream_group, id="0", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            self._stream_groups_ready.add(stream)
+    
+    def _stream_task_id(self, fields) -> Optional[str]:
+        """task_id de uma entrada (dict do XREADGROUP ou lista [campo, valor, ...] do Lua)"""
+        if isinstance(fields, list):
+            fields = dict(zip(fields[::2], fields[1::2]))
+        task_id = fields.get(b"task_id", fields.get("task_id"))
+        return task_id.decode() if isinstance(task_id, bytes) else task_id
+    
+    async def _buffer_stream_entries(self, stream, entries) -> int:
+        """Guarda entradas lidas/reclamadas no buffer local do worker"""
+        if isinstance(stream, bytes):
+            stream = stream.decode()
+        
+        buffered = 0
+        for entry_id, fields in entries:
+            if not fields:
+                # Entrada removida pelo trimming enquanto estava pendente
+                await self.redis_client.xack(stream, self.stream_group, entry_id)
+                continue
+            
+            entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+            self._stream_buffer.append((stream, entry_id, self._stream_task_id(fields)))
+            buffered += 1
+        
+        return buffered
+    
+    def _pop_buffered_entry(self, streams: List[str]) -> Optional[Tuple[str, str, str]]:
+        """Entrada em buffer de maior prioridade entre as streams consumíveis agora (pool com vaga)"""
+        order = {stream: i for i, stream in enumerate(streams)}
+        candidates = [entry for entry in self._stream_buffer if entry[0] in order]
+        if not candidates:
+            return None
+        
+        entry = min(candidates, key=lambda item: order[item[0]])
+        self._stream_buffer.remove(entry)
+        return entry
+    
+    async def _read_first_stream_entry(self, streams: List[str]) -> Optional[Tuple[str, str, str]]:
+        """Lê sem bloquear uma única entrada nova, da primeira stream com dados (ordem de prioridade)"""
+        result = await self._read_stream_script(keys=streams, args=[self.stream_group, self.worker_id])
+        if not result:
+            return None
+        
+        stream, entry_id, fields = result
+        stream = stream.decode() if isinstance(stream, bytes) else stream
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        return stream, entry_id, self._stream_task_id(fields)
+    
+    async def _read_stream_task(self, queues: List[str], timeout: int) -> Optional[str]:
+        """Lê uma task por vez das streams consumíveis, na ordem de prioridade, sem pré-carregar entradas"""
+        streams = [self._stream_key(q) for q in queues]
+        await self._ensure_stream_groups(streams)
+        blocked = False
+        
+        while True:
+            # Buffer: reclamadas de consumers mortos ou lidas juntas ao acordar do bloqueio
+            entry = self._pop_buffered_entry(streams)
+            if entry is None:
+                entry = await self._read_first_stream_entry(streams)
+            
+            if entry is None:
+                if blocked:
+                    return None
+                
+                # Nada pronto: bloqueia até chegar uma entrada (normalmente de uma só stream)
+                blocked = True
+                response = await self.redis_client.xreadgroup(
+                    self.stream_group, self.worker_id,
+                    {stream: ">" for stream in streams},
+                    count=1,
+                    block=timeout * 1000
+                )
+                for stream, entries in response or []:
+                    await self._buffer_stream_entries(stream, entries)
+                continue
+            
+            stream, entry_id, task_id = entry
+            
+            # Tasks canceladas ou já finalizadas enquanto estavam na stream
+            status = await self.redis_client.hget(f"task:{task_id}", "status")
+            status = status.decode() if isinstance(status, bytes) else status
+            if status in (None, TaskStatus.CANCELLED.value, TaskStatus.COMPLETED.value):
+                await self.redis_client.xack(stream, self.stream_group, entry_id)
+                continue
+            
+            self._stream_entries[task_id] = (stream, entry_id)
+            await self.redis_client.hset(f"task:{task_id}", "worker_id", self.worker_id)
+            return task_id
+    
+    async def _touch_stream_entries(self, task_ids: List[str]):
+        """Heartbeat: XCLAIM JUSTID zera o idle time das entradas em execução e em buffer"""
+        by_stream: Dict[str, List[str]] = {}
+        for task_id in task_ids:
+            if task_id in self._stream_entries:
+                stream, entry_id = self._stream_entries[task_id]
+                by_stream.setdefault(stream, []).append(entry_id)
+        
+        for stream, entry_id, _ in self._stream_buffer:
+            by_stream.setdefault(stream, []).append(entry_id)
+        
+        for stream, entry_ids in by_stream.items():
+            await self.redis_client.xclaim(
+                stream, self.stream_group, self.worker_id,
+                min_idle_time=0, message_ids=entry_ids, justid=True
+            )
+    
+    async def _autoclaim_stream_entries(self, limit: int = 100) -> int:
+        """Reclama (XAUTOCLAIM) entradas paradas há mais que o lease em consumers mortos"""
+        claimed = 0
+        
+        # Só o que este worker consegue executar agora; o resto fica para outros consumers
+        limit = min(limit, self.global_pool.limit - self.global_pool.active - len(self._stream_buffer))
+        
+        for stream in list(self._stream_groups_ready):
+            if claimed >= limit:
+                break
+            response = await self.redis_client.xautoclaim(
+                stream, self.stream_group, self.worker_id,
+                min_idle_time=self.lease_timeout * 1000, start_id="0-0", count=limit - claimed
+            )
+            entries = response[1] if response else []
+            
+            # Entradas já em execução neste worker apenas tiveram o heartbeat atrasado
+            running = {entry for entry in self._stream_entries.values()}
+            entries = [(entry_id, fields) for entry_id, fields in entries
+                       if (stream, entry_id.decode() if isinstance(entry_id, bytes) else entry_id) not in running]
+            
+            claimed += await self._buffer_stream_entries(stream, entries)
+        
+        if claimed:
+            self.logger.warning(f"{claimed} tasks paradas reclamadas de outros consumers")
+        return claimed
+    
+    # =========================================
+    # POOLS DE CONCORRÊNCIA POR TIPO
+    # =========================================
+    
+    def configure_pools(self, max_concurrent_tasks: int = None, limits: Dict[TaskType, int] = None):
+        """Configura o limite global e os pools por tipo de task"""
+        if max_concurrent_tasks is not None:
+            self.global_pool = TaskConcurrencyPool("global", max_concurrent_tasks)
+        
+        pool_limits = parse_pool_limits(TASK_POOL_LIMITS)
+        pool_limits.update(limits or {})
+        self.task_pools = {
+            task_type: TaskConcurrencyPool(task_type.value, pool_limits.get(task_type, TASK_POOL_DEFAULT_LIMIT))
+            for task_type in TaskType
+        }
+    
+    def _task_queue(self, priority: TaskPriority, task_type: TaskType) -> str:
+        """Fila de uma prioridade para um tipo de task (queue:<prioridade>:<tipo>)"""
+        return f"queue:{priority.value}:{task_type.value}"
+    
+    def _priority_queues(self, priority: TaskPriority) -> List[str]:
+        """Todas as filas de uma prioridade (por tipo + fila legada sem tipo)"""
+        return [self._task_queue(priority, t) for t in TaskType] + [f"queue:{priority.value}"]
+    
+    def available_queues(self, queues: List[str]) -> List[str]:
+        """Expande as filas de prioridade nas filas por tipo cujo pool tem capacidade"""
+        if not self.global_pool.has_capacity():
+            return []
+        
+        available = []
+        for queue_name in queues:
+            for task_type, pool in self.task_pools.items():
+                if pool.has_capacity():
+                    available.append(f"{queue_name}:{task_type.value}")
+            # Fila legada (tasks enfileiradas antes da separação por tipo)
+            available.append(queue_name)
+        
+        return available
+    
+    async def wait_for_capacity(self, queues: List[str]) -> List[str]:
+        """Aguarda (sem polling) até que algum pool libere vaga e retorna as filas consumíveis"""
+        while True:
+            available = self.available_queues(queues)
+            if available:
+                return available
+            
+            self._capacity_event.clear()
+            await self._capacity_event.wait()
+    
+    def pool_block_timeout(self, block_timeout: int) -> int:
+        """Com algum pool saturado, bloqueia menos para voltar a consumir suas filas logo que liberar"""
+        if any(not pool.has_capacity() for pool in self.task_pools.values()):
+            return min(block_timeout, SATURATED_BLOCK_TIMEOUT)
+        return block_timeout
+    
+    async def _get_task_type(self, task_id: str) -> Optional[TaskType]:
+        """Tipo da task (campo task_type ou definição)"""
+        task_type = await self.redis_client.hget(f"task:{task_id}", "task_type")
+        if task_type is None:
+            task_data = await self.redis_client.hget(f"task:{task_id}", "definition")
+            if not task_data:
+                return None
+            return self.serializer.loads_model(TaskDefinition, task_data).task_type
+        
+        try:
+            return TaskType(task_type.decode() if isinstance(task_type, bytes) else task_type)
+        except ValueError:
+            return None
+    
+    async def dispatch_task(self, task_id: str) -> asyncio.Task:
+        """Reserva vaga no pool global e no pool do tipo e executa a task em background"""
+        task_type = await self._get_task_type(task_id)
+        pool = self.task_pools.get(task_type)
+        
+        # Pool cheio (task de fila legada, sem tipo no nome): não reserva vaga global enquanto espera
+        reserved = pool is None or pool.has_capacity()
+        if reserved:
+            await self.global_pool.acquire()
+            if pool:
+                await pool.acquire()
+        
+        task = asyncio.create_task(self._execute_in_pool(task_id, pool, reserved))
+        self.running_tasks[task_id] = task
+        return task
+    
+    async def _execute_in_pool(self, task_id: str, pool: Optional[TaskConcurrencyPool], reserved: bool):
+        """Executa a task liberando as vagas dos pools ao final"""
+        pool_acquired = global_acquired = reserved
+        try:
+            if not reserved:
+                # Aguarda a vez no pool do tipo e só então ocupa vaga global
+                await pool.acquire()
+                pool_acquired = True
+                await self.global_pool.acquire()
+                global_acquired = True
+            await self.execute_task(task_id)
+        finally:
+            if pool and pool_acquired:
+                pool.release()
+            if global_acquired:
+                self.global_pool.release()
+            self._capacity_event.set()
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Saturação dos pools de concorrência deste worker"""
+        stats = {"global": self.global_pool.get_stats()}
+        for task_type, pool in self.task_pools.items():
+            stats[task_type.value] = pool.get_stats()
+        return stats
+    
+    # =========================================
+    # ESCALONAMENTO JUSTO POR ORGANIZAÇÃO
+    # =========================================
+    
+    def _fair_org(self, task: TaskDefinition) -> str:
+        """Organização da task nas sub-filas (tasks sem organização compartilham uma)"""
+        return task.organization_id or FAIR_DEFAULT_ORG
+    
+    def _fair_ring_key(self, queue_name: str) -> str:
+        """Anel de organizações com backlog numa fila (ZSET org -> último despacho)"""
+        return f"fair_orgs:{queue_name}"
+    
+    def _fair_queue_key(self, queue_name: str, org: str) -> str:
+        """Sub-fila de uma organização numa fila"""
+        return f"fair:{queue_name}:{org}"
+    
+    def _fair_slot_keys(self, task_id: str) -> List[str]:
+        """Keys lidas ao liberar a vaga da task: task, vagas, em andamento por organização, despachadas por fila"""
+        return [f"task:{task_id}", FAIR_SLOTS_KEY, FAIR_IN_FLIGHT_KEY, FAIR_DISPATCHED_KEY]
+    
+    def _fair_queues(self) -> List[str]:
+        return [self._task_queue(priority, task_type) for priority in PRIORITY_ORDER for task_type in TaskType]
+    
+    def _add_fair_enqueue_commands(self, pipe, queued: Dict[Tuple[str, str], List[str]]):
+        """Adiciona ao pipeline o enqueue nas sub-filas por (fila, organização)"""
+        for (queue_name, org), task_ids in queued.items():
+            if not task_ids:
+                continue
+            pipe.lpush(self._fair_queue_key(queue_name, org), *task_ids)
+            # Score 0: organização que volta a ter backlog entra no início da rotação
+            pipe.zadd(self._fair_ring_key(queue_name), {org: 0}, nx=True)
+    
+    async def dispatch_fair_queues(self, queues: Optional[Iterable[str]] = None) -> int:
+        """Despacha tasks das sub-filas para as filas em round-robin entre organizações (todas as filas por padrão)"""
+        queues = list(queues) if queues is not None else self._fair_queues()
+        if not queues:
+            return 0
+        
+        moved = 0
+        for _ in range(FAIR_DISPATCH_PASSES):
+            # Organizações da vez em cada anel: o script recebe as sub-filas delas em KEYS
+            pipe = self.redis_client.pipeline(transaction=False)
+            for queue_name in queues:
+                pipe.zrange(self._fair_ring_key(queue_name), 0, FAIR_DISPATCH_BATCH - 1)
+            rings = await pipe.execute()
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            for queue_name, ring in zip(queues, rings):
+                orgs = [org.decode() if isinstance(org, bytes) else org for org in ring]
+                await self._fair_dispatch_script(
+                    keys=[
+                        self._fair_ring_key(queue_name), FAIR_DISPATCHED_KEY, FAIR_IN_FLIGHT_KEY,
+                        FAIR_ORG_LIMITS_KEY, QUEUE_SIGNAL_KEY, FAIR_SLOTS_KEY, self._enqueue_key(queue_name),
+                        *(self._fair_queue_key(queue_name, org) for org in orgs)
+                    ],
+                    args=[
+                        queue_name, TASK_FAIR_QUEUE_WINDOW, TASK_FAIR_ORG_LIMIT,
+                        self.queue_mode, TASK_STREAM_MAXLEN, FAIR_DISPATCH_BATCH, len(orgs), *orgs
+                    ],
+                    client=pipe
+                )
+            results = await pipe.execute()
+            
+            moved += sum(queue_moved for queue_moved, _ in results)
+            # Organizações que entraram no anel depois da leitura: nova passada só nessas filas
+            queues = [queue_name for queue_name, (_, stalled) in zip(queues, results) if stalled]
+            if not queues:
+                break
+        
+        return moved
+    
+    async def _refill_fair_queue(self, task: Optional[TaskDefinition], all_queues: bool = False):
+        """Task finalizada liberou vaga: despacha a próxima da sua fila (de todas, se liberou dependentes)"""
+        if not self.fair_scheduling or task is None:
+            return
+        try:
+            await self.dispatch_fair_queues(None if all_queues else [self._task_queue(task.priority, task.task_type)])
+        except Exception as e:
+            # O loop do scheduler despacha de novo no próximo ciclo
+            self.logger.warning(f"Erro ao despachar sub-filas após task {task.id}: {e}")
+    
+    async def set_organization_limit(self, organization_id: str, limit: Optional[int]):
+        """Define o limite de tasks em andamento da organização (None volta ao padrão)"""
+        if limit is None:
+            await self.redis_client.hdel(FAIR_ORG_LIMITS_KEY, organization_id)
         else:
-            # Marcar como falha permanente
-            await self.redis_client.hset(f"task:{task_id}", mapping={
-                "status": TaskStatus.FAILED,
-                "error": json.dumps({"message": error_message, "retryable": False}),
-                "completed_at": datetime.now(timezone.utc).isoformat()
+            await self.redis_client.hset(FAIR_ORG_LIMITS_KEY, organization_id, limit)
+        
+        if self.fair_scheduling:
+            await self.dispatch_fair_queues()
+    
+    async def get_organization_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Backlog nas sub-filas, tasks em andamento e limite de cada organização"""
+        queues = self._fair_queues()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for queue_name in queues:
+            pipe.zrange(self._fair_ring_key(queue_name), 0, -1)
+        rings = await pipe.execute()
+        
+        members = [
+            (queue_name, org.decode() if isinstance(org, bytes) else org)
+            for queue_name, ring in zip(queues, rings)
+            for org in ring
+        ]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for queue_name, org in members:
+            pipe.llen(self._fair_queue_key(queue_name, org))
+        pipe.hgetall(FAIR_IN_FLIGHT_KEY)
+        pipe.hgetall(FAIR_ORG_LIMITS_KEY)
+        *backlogs, in_flight, limits = await pipe.execute()
+        
+        in_flight = {
+            (org.decode() if isinstance(org, bytes) else org): int(count) for org, count in in_flight.items()
+        }
+        limits = {
+            (org.decode() if isinstance(org, bytes) else org): int(limit) for org, limit in limits.items()
+        }
+        
+        stats: Dict[str, Dict[str, Any]] = {}
+        for org in {*(org for _, org in members), *in_flight, *limits}:
+            stats[org] = {
+                "pending": 0,
+                "in_flight": in_flight.get(org, 0),
+                "limit": limits.get(org, TASK_FAIR_ORG_LIMIT),
+                "queues": {}
+            }
+        for (queue_name, org), backlog in zip(members, backlogs):
+            if backlog:
+                stats[org]["pending"] += backlog
+                stats[org]["queues"][queue_name] = backlog
+        
+        return stats
+    
+    # =========================================
+    # DEAD-LETTER QUEUE
+    # =========================================
+    
+    def _dead_letter_key(self, task_type: Optional[TaskType]) -> str:
+        """Dead-letter de um tipo de task (dead_letter:<tipo>)"""
+        return f"{DEAD_LETTER_KEY_PREFIX}:{task_type.value if task_type else DEAD_LETTER_UNKNOWN_TYPE}"
+    
+    def _dead_letter_keys(self) -> List[str]:
+        return [self._dead_letter_key(task_type) for task_type in TaskType] + [self._dead_letter_key(None)]
+    
+    async def _dead_letter_entries(self, members: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+        """Motivo, último erro e tentativas das entradas (task_id, falha em timestamp)"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for task_id, _ in members:
+            pipe.hmget(
+                f"task:{task_id}",
+                "definition", "task_type", "dead_letter_reason", "error", "attempts", "replays"
+            )
+        rows = await pipe.execute()
+        
+        entries = []
+        for (task_id, failed_ts), (task_data, *fields) in zip(members, rows):
+            task_type, reason, error, attempts, replays = [
+                value.decode() if isinstance(value, bytes) else value for value in fields
+            ]
+            try:
+                task = self.serializer.loads_model(TaskDefinition, task_data) if task_data else None
+            except Exception:
+                task = None
+            
+            entries.append({
+                "task_id": task_id,
+                "task_type": task_type,
+                "name": task.name if task else None,
+                "organization_id": task.organization_id if task else None,
+                "reason": reason,
+                "error": json.loads(error).get("message") if error else None,
+                "attempts": int(attempts or 0),
+                "replays": int(replays or 0),
+                "failed_at": datetime.fromtimestamp(failed_ts, timezone.utc).isoformat()
             })
+        return entries
+    
+    async def list_dead_letters(self, task_type: Optional[TaskType] = None, offset: int = 0,
+                                limit: int = 50) -> Dict[str, Any]:
+        """Entradas do dead-letter (mais recentes primeiro), de um tipo ou de todos"""
+        keys = [self._dead_letter_key(task_type)] if task_type else self._dead_letter_keys()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zcard(key)
+            pipe.zrevrange(key, 0, offset + limit - 1, withscores=True)
+        results = await pipe.execute()
+        
+        members = sorted(
+            (
+                (task_id.decode() if isinstance(task_id, bytes) else task_id, failed_ts)
+                for ranked in results[1::2] for task_id, failed_ts in ranked
+            ),
+            key=lambda member: member[1], reverse=True
+        )[offset:offset + limit]
+        
+        return {"entries": await self._dead_letter_entries(members), "total": sum(results[0::2])}
+    
+    async def get_dead_letter(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Entrada do dead-letter com a definição e os logs da task (None se não estiver no dead-letter)"""
+        task_type = await self._get_task_type(task_id)
+        failed_ts = await self.redis_client.zscore(self._dead_letter_key(task_type), task_id)
+        if failed_ts is None:
+            return None
+        
+        entry, = await self._dead_letter_entries([(task_id, failed_ts)])
+        task_data = await self.redis_client.hget(f"task:{task_id}", "definition")
+        entry["definition"] = (
+            self.serializer.loads_model(TaskDefinition, task_data).model_dump(mode="json") if task_data else None
+        )
+        logs = await self.get_task_logs(task_id, limit=TASK_LOG_MAX_ENTRIES)
+        entry["logs"] = logs["logs"] if logs else []
+        return entry
+    
+    async def get_dead_letter_stats(self) -> Dict[str, int]:
+        """Tamanho do dead-letter por tipo de task"""
+        keys = self._dead_letter_keys()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zcard(key)
+        sizes = await pipe.execute()
+        return {key.split(":", 1)[1]: size for key, size in zip(keys, sizes)}
+    
+    async def requeue_dead_letters(
+        self,
+        task_type: Optional[TaskType] = None,
+        task_ids: Optional[List[str]] = None,
+        limit: int = 1000,
+        batch_size: int = TASK_DLQ_REPLAY_BATCH,
+        rate: float = TASK_DLQ_REPLAY_RATE
+    ) -> Dict[str, int]:
+        """Reenfileira entradas do dead-letter (mais antigas primeiro) em lotes, no máximo `rate` tasks/s"""
+        if task_ids:
+            # Dead-letter de cada task pelo tipo
+            task_types = await asyncio.gather(*(self._get_task_type(task_id) for task_id in task_ids))
+            selected = [
+                (self._dead_letter_key(current_type), task_id)
+                for task_id, current_type in zip(task_ids, task_types)
+                if task_type is None or current_type == task_type
+            ][:limit]
+        else:
+            keys = [self._dead_letter_key(task_type)] if task_type else self._dead_letter_keys()
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.zrange(key, 0, limit - 1, withscores=True)
+            results = await pipe.execute()
             
-            self.logger.error(f"Task {task_id} falhou permanentemente: {error_message}")
+            ranked = sorted(
+                (failed_ts, key, task_id.decode() if isinstance(task_id, bytes) else task_id)
+                for key, members in zip(keys, results) for task_id, failed_ts in members
+            )
+            selected = [(key, task_id) for _, key, task_id in ranked[:limit]]
+        
+        requeued = 0
+        fair = "1" if self.fair_scheduling else "0"
+        for start in range(0, len(selected), batch_size):
+            batch = selected[start:start + batch_size]
+            batch_started = time.monotonic()
+            
+            by_key: Dict[str, List[str]] = {}
+            for key, task_id in batch:
+                by_key.setdefault(key, []).append(task_id)
+            
+            # Um script por dead-letter, todos no mesmo pipeline
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, key_task_ids in by_key.items():
+                await self._requeue_dead_letter_script(
+                    keys=[
+                        key, TASKS_COMPLETED_INDEX, DELAYED_TASKS_KEY, QUEUE_SIGNAL_KEY,
+                        *await self._enqueue_key_groups(key_task_ids)
+                    ],
+                    args=[
+                        self.queue_mode, TASK_STREAM_MAXLEN, fair,
+                        datetime.now(timezone.utc).timestamp(), len(key_task_ids), *key_task_ids
+                    ],
+                    client=pipe
+                )
+            results = await pipe.execute()
+            
+            queues = {
+                queue.decode() if isinstance(queue, bytes) else queue
+                for key_queues in results for queue in key_queues if queue
+            }
+            requeued += sum(1 for key_queues in results for queue in key_queues if queue)
+            
+            if self.fair_scheduling and queues:
+                await self.dispatch_fair_queues(queues)
+            
+            # Throttle: o replay não pode sobrecarregar os sistemas downstream
+            if start + batch_size < len(selected):
+                await asyncio.sleep(max(0.0, len(batch) / rate - (time.monotonic() - batch_started)))
+        
+        remaining = sum((await self.get_dead_letter_stats()).values())
+        self.logger.info(f"{requeued} tasks reenfileiradas do dead-letter ({remaining} restantes)")
+        return {"requeued": requeued, "skipped": len(selected) - requeued, "remaining": remaining}
+    
+    # =========================================
+    # AGENDAMENTO (TASKS ATRASADAS E CRON)
+    # =========================================
+    
+    async def promote_delayed_tasks(self) -> int:
+        """Move para as filas, em lotes, as tasks atrasadas cujo horário chegou"""
+        promoted = await self._promote_due_tasks(DELAYED_TASKS_KEY, TaskStatus.SCHEDULED)
+        if promoted:
+            self.logger.info(f"{promoted} tasks agendadas movidas para as filas")
+        return promoted
+    
+    async def _promote_due_tasks(self, source_key: str, status: TaskStatus) -> int:
+        """Move em lotes as tasks vencidas do ZSET para suas filas; cada task é promovida por uma única réplica"""
+        promoted = 0
+        now = datetime.now(timezone.utc).timestamp()
+        
+        while True:
+            due = await self.redis_client.zrangebyscore(
+                source_key, min="-inf", max=now, start=0, num=DELAYED_PROMOTE_BATCH
+            )
+            if not due:
+                break
+            
+            task_ids = [task_id.decode() if isinstance(task_id, bytes) else task_id for task_id in due]
+            promoted += await self._promote_script(
+                keys=[source_key, DELAYED_TASKS_KEY, QUEUE_SIGNAL_KEY, *await self._enqueue_key_groups(task_ids)],
+                args=[
+                    now, self.queue_mode, TASK_STREAM_MAXLEN, "1" if self.fair_scheduling else "0",
+                    status.value, len(task_ids), *task_ids
+                ]
+            )
+            if len(due) < DELAYED_PROMOTE_BATCH:
+                break
+        
+        if promoted and self.fair_scheduling:
+            await self.dispatch_fair_queues()
+        return promoted
+    
+    async def register_schedule(self, name: str, cron: str, task: TaskDefinition,
+                                enabled: bool = True, submit_next_run: bool = False) -> Dict[str, Any]:
+        """
+        Cria/atualiza schedule recorrente; a task é usada como modelo a cada execução.
+        Com submit_next_run, a task da próxima execução é submetida já agendada e seu id
+        retornado em next_task_id; o líder não a dispara de novo.
+        """
+        next_run = CronExpression(cron).next_after(datetime.now(timezone.utc))
+        schedule = {
+            "name": name,
+            "cron": cron,
+            "enabled": enabled,
+            "task": task.model_dump(mode="json", exclude={"id", "created_at", "scheduled_for"}),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(SCHEDULES_KEY, name, json.dumps(schedule))
+        if enabled:
+            pipe.zadd(SCHEDULE_NEXT_RUN_KEY, {name: next_run.timestamp()})
+        else:
+            pipe.zrem(SCHEDULE_NEXT_RUN_KEY, name)
+        await pipe.execute()
+        
+        schedule["next_run_at"] = next_run.isoformat() if enabled else None
+        if enabled and submit_next_run:
+            schedule["next_task_id"], _ = await self._submit_schedule_run(name, schedule, next_run)
+        return schedule
+    
+    async def _submit_schedule_run(self, name: str, schedule: Dict[str, Any], run_at: datetime) -> Tuple[str, bool]:
+        """Submete a task de uma execução da schedule uma única vez; retorna (task_id, submetida agora)"""
+        task = TaskDefinition(**schedule["task"], scheduled_for=run_at)
+        
+        # Trava por execução com o id da task: troca de líder no meio do disparo não duplica a task
+        lock_key = f"schedule_fired:{name}:{int(run_at.timestamp())}"
+        if not await self.redis_client.set(lock_key, task.id, nx=True, ex=SCHEDULE_FIRED_TTL):
+            task_id = await self.redis_client.get(lock_key)
+            return (task_id.decode() if isinstance(task_id, bytes) else task_id), False
+        
+        await self.submit_task(task)
+        return task.id, True
+    
+    async def remove_schedule(self, name: str) -> bool:
+        """Remove uma schedule recorrente"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hdel(SCHEDULES_KEY, name)
+        pipe.zrem(SCHEDULE_NEXT_RUN_KEY, name)
+        removed, _ = await pipe.execute()
+        return bool(removed)
+    
+    async def list_schedules(self, organization_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lista schedules (opcionalmente de uma organização) com a próxima execução"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(SCHEDULES_KEY)
+        pipe.zrange(SCHEDULE_NEXT_RUN_KEY, 0, -1, withscores=True)
+        raw_schedules, next_runs = await pipe.execute()
+        
+        next_run_by_name = {
+            (name.decode() if isinstance(name, bytes) else name): score for name, score in next_runs
+        }
+        
+        schedules = []
+        for raw in raw_schedules.values():
+            schedule = json.loads(raw)
+            if organization_id and schedule["task"].get("organization_id") != organization_id:
+                continue
+            
+            next_run = next_run_by_name.get(schedule["name"])
+            schedule["next_run_at"] = (
+                datetime.fromtimestamp(next_run, tz=timezone.utc).isoformat() if next_run else None
+            )
+            schedules.append(schedule)
+        
+        return sorted(schedules, key=lambda item: item["name"])
+    
+    async def _acquire_scheduler_leadership(self) -> bool:
+        """Eleição de líder: só uma réplica dispara as schedules recorrentes"""
+        acquired = await self._leader_script(
+            keys=[SCHEDULER_LEADER_KEY],
+            args=[self.worker_id, SCHEDULER_LEADER_TTL * 1000]
+        )
+        
+        if bool(acquired) != self.is_scheduler_leader:
+            state = "assumiu" if acquired else "perdeu"
+            self.logger.info(f"Worker {self.worker_id} {state} a liderança do scheduler")
+        
+        self.is_scheduler_leader = bool(acquired)
+        return self.is_scheduler_leader
+    
+    async def fire_due_schedules(self, limit: int = 100) -> int:
+        """Dispara as schedules vencidas (apenas o líder chama)"""
+        now = datetime.now(timezone.utc)
+        due = await self.redis_client.zrangebyscore(
+            SCHEDULE_NEXT_RUN_KEY, min=0, max=now.timestamp(), start=0, num=limit, withscores=True
+        )
+        
+        fired = 0
+        for name, run_ts in due:
+            name = name.decode() if isinstance(name, bytes) else name
+            raw = await self.redis_client.hget(SCHEDULES_KEY, name)
+            if not raw:
+                await self.redis_client.zrem(SCHEDULE_NEXT_RUN_KEY, name)
+                continue
+            
+            schedule = json.loads(raw)
+            run_at = datetime.fromtimestamp(run_ts, tz=timezone.utc)
+            
+            try:
+                # Execuções perdidas (downtime) disparam uma vez; a próxima é calculada a partir de agora
+                next_run = CronExpression(schedule["cron"]).next_after(max(run_at, now))
+                
+                task_id, submitted = await self._submit_schedule_run(name, schedule, run_at)
+                if submitted:
+                    fired += 1
+                    self.logger.info(f"Schedule {name} disparada: task {task_id}")
+                
+                # XX: não recriar schedule removida durante o disparo
+                await self.redis_client.zadd(SCHEDULE_NEXT_RUN_KEY, {name: next_run.timestamp()}, xx=True)
+            except Exception as e:
+                self.logger.error(f"Erro ao disparar schedule {name}: {e}")
+        
+        return fired
+    
+    async def _scheduler_loop(self):
+        """Promove tasks atrasadas (todas as réplicas) e dispara schedules (líder)"""
+        while True:
+            try:
+                await self.promote_delayed_tasks()
+                if self.fair_scheduling:
+                    await self.dispatch_fair_queues()
+                
+                if await self._acquire_scheduler_leadership():
+                    await self.fire_due_schedules()
+            except Exception as e:
+                self.logger.error(f"Erro no scheduler: {e}")
+            
+            await asyncio.sleep(SCHEDULER_INTERVAL)
     
-    async def start_worker(self, queues: List[str] = None):
+    def start_scheduler(self):
+        """Inicia o loop do scheduler (idempotente)"""
+        if not TASK_SCHEDULER_ENABLED:
+            return
+        
+        if self._scheduler_task is None or self._scheduler_task.done():
+            self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+    
+    async def start_worker(self, queues: List[str] = None, block_timeout: int = QUEUE_BLOCK_TIMEOUT):
         """Inicia worker para processar tasks"""
         if queues is None:
-            queues = [f"queue:{p.value}" for p in TaskPriority]
+            queues = [f"queue:{p.value}" for p in PRIORITY_ORDER]
         
         self.logger.info(f"Iniciando worker para filas: {queues}")
+        self.start_lease_maintenance()
+        self.start_scheduler()
         
         while True:
             try:
+                # Só consome filas cujo pool tem capacidade
+                available = await self.wait_for_capacity(queues)
+                
                 # Processar retry queue primeiro
                 await self._process_retry_queue()
                 
-                # Processar filas normais
-                for queue in queues:
-                    task_id = await self.redis_client.rpop(queue)
-                    if task_id:
-                        # Executar task em background
-                        task = asyncio.create_task(self.execute_task(task_id.decode()))
-                        self.running_tasks[task_id.decode()] = task
-                        
-                        # Limpar tasks concluídas
-                        await self._cleanup_completed_tasks()
-                
-                # Aguardar um pouco antes do próximo ciclo
-                await asyncio.sleep(1)
-                
+                # Bloqueia no Redis até chegar task (ou timeout), sem polling
+                task_id = await self.dequeue_task(available, timeout=self.pool_block_timeout(block_timeout))
+                if task_id:
+                    # Executar task em background
+                    await self.dispatch_task(task_id)
+                    
+                    # Limpar tasks concluídas
+                    await self._cleanup_completed_tasks()
+            
             except Exception as e:
                 self.logger.error(f"Erro no worker: {e}")
                 await asyncio.sleep(5)
     
     async def _process_retry_queue(self):
         """Processa fila de retry"""
-        now = datetime.now(timezone.utc).timestamp()
-        
         for priority in TaskPriority:
-            retry_queue = f"retry_queue:{priority.value}"
-            
-            # Buscar tasks prontas para retry
-            ready_tasks = await self.redis_client.zrangebyscore(
-                retry_queue, min=0, max=now, withscores=False
-            )
-            
-            for task_id in ready_tasks:
-                # Mover de volta para fila normal
-                await self.redis_client.zrem(retry_queue, task_id)
-                await self.redis_client.lpush(f"queue:{priority.value}", task_id)
+            # Remoção do ZSET e enqueue no mesmo script: réplicas concorrentes não duplicam o retry
+            await self._promote_due_tasks(f"retry_queue:{priority.value}", TaskStatus.RETRYING)
     
     async def _cleanup_completed_tasks(self):
         """Limpa tasks concluídas da memória"""
@@ -654,32 +3028,92 @@ class BackgroundTaskManager:
         """Cancela uma task"""
         # Cancelar se estiver rodando
         if task_id in self.running_tasks:
+            self._cancelled_task_ids.add(task_id)
             self.running_tasks[task_id].cancel()
             del self.running_tasks[task_id]
         
-        # Remover das filas
-        for priority in TaskPriority:
-            await self.redis_client.lrem(f"queue:{priority.value}", 0, task_id)
-            await self.redis_client.zrem(f"retry_queue:{priority.value}", task_id)
+        # Remover das filas, do lease/processamento e marcar como cancelada (atômico)
+        dependency_error = {"message": f"Dependency {task_id} cancelled", "retryable": False}
+        while True:
+            # Filas da task, worker do claim e sub-fila da organização lidos antes; o script confere se o claim mudou
+            (claim, worker_id, source_queue), = await self._read_claims([task_id])
+            enqueue_keys = await self._enqueue_key_groups([task_id])
+            queue_name = source_queue if self.queue_mode == QUEUE_MODE_STREAMS else enqueue_keys[1]
+            queues, retry_queues = self._cancel_queues(queue_name, source_queue)
+            graph = await self._dependency_graph([task_id])
+            now = datetime.now(timezone.utc)
+            complete, *cancelled_dependents = await self._run_transition(
+                self._cancel_script, task_id,
+                keys=[
+                    f"task:{task_id}", TASK_LEASES_KEY, TASKS_COMPLETED_INDEX,
+                    *self._task_related_keys(task_id), *self._fair_slot_keys(task_id)[1:], TASK_CLAIMS_KEY,
+                    self._processing_key(worker_id), enqueue_keys[2], *queues, *retry_queues,
+                    *self._graph_key_groups(graph)
+                ],
+                args=[
+                    task_id, now.isoformat(), len(queues), now.timestamp(), TaskConfig().result_ttl,
+                    json.dumps(dependency_error), claim, len(retry_queues), len(graph), *graph
+                ]
+            )
+            if complete != -1:
+                break
         
-        # Marcar como cancelada
-        await self.redis_client.hset(f"task:{task_id}", mapping={
-            "status": TaskStatus.CANCELLED,
-            "completed_at": datetime.now(timezone.utc).isoformat()
-        })
+        cancelled_dependents = [
+            dependent_id.decode() if isinstance(dependent_id, bytes) else dependent_id
+            for dependent_id in cancelled_dependents
+        ]
+        if not complete:
+            cancelled_dependents.extend(await self._cascade_late_dependents(
+                [task_id, *cancelled_dependents], TaskStatus.CANCELLED, dependency_error, TaskConfig().result_ttl
+            ))
+        await self.publish_task_event(task_id, TaskStatus.CANCELLED.value)
+        
+        if self.fair_scheduling:
+            await self.dispatch_fair_queues()
+        
+        # Dependentes aguardando esta task são cancelados em cascata
+        for dependent_id in cancelled_dependents:
+            await self.publish_task_event(dependent_id, TaskStatus.CANCELLED.value)
         
         return True
     
+    def _cancel_queues(self, *queue_names: Optional[str]) -> Tuple[List[str], List[str]]:
+        """Listas e ZSETs de onde o cancelamento remove a task: só os da sua prioridade, não todas as filas"""
+        queue_names = [name for name in queue_names if name]
+        priorities = {name.split(":")[1] for name in queue_names if name.count(":") >= 1}
+        if not priorities or not priorities <= {priority.value for priority in TaskPriority}:
+            # Prioridade desconhecida: procurar em todas as retry queues
+            priorities = {priority.value for priority in TaskPriority}
+        
+        queues = [*queue_names, *(f"queue:{priority}" for priority in sorted(priorities))]
+        retry_queues = [*(f"retry_queue:{priority}" for priority in sorted(priorities)), DELAYED_TASKS_KEY]
+        return list(dict.fromkeys(queues)), retry_queues
+    
     async def get_queue_stats(self) -> Dict[str, Any]:
         """Obtém estatísticas das filas"""
         stats = {}
         
-        for priority in TaskPriority:
-            queue_name = f"queue:{priority.value}"
-            retry_queue_name = f"retry_queue:{priority.value}"
-            
-            queue_size = await self.redis_client.llen(queue_name)
-            retry_size = await self.redis_client.zcard(retry_queue_name)
+        # Tamanho de todas as filas num único pipeline
+        queues = {priority: self._priority_queues(priority) for priority in TaskPriority}
+        pipe = self.redis_client.pipeline(transaction=False)
+        for priority, priority_queues in queues.items():
+            for queue_name in priority_queues:
+                if self.queue_mode == QUEUE_MODE_STREAMS:
+                    pipe.xinfo_groups(self._stream_key(queue_name))
+                    pipe.xlen(self._stream_key(queue_name))
+                else:
+                    pipe.llen(queue_name)
+            pipe.zcard(f"retry_queue:{priority.value}")
+        results = iter(await pipe.execute(raise_on_error=False))
+        
+        for priority, priority_queues in queues.items():
+            queue_size = 0
+            for _ in priority_queues:
+                if self.queue_mode == QUEUE_MODE_STREAMS:
+                    queue_size += self._stream_backlog(next(results), next(results))
+                else:
+                    queue_size += next(results)
+            retry_size = next(results)
             
             stats[priority.value] = {
                 "pending": queue_size,
@@ -687,70 +3121,226 @@ class BackgroundTaskManager:
                 "running": len([t for t in self.running_tasks.values() if not t.done()])
             }
         
+        # Backlog das sub-filas por organização também está pendente
+        organizations = await self.get_organization_stats()
+        for org_stats in organizations.values():
+            for queue_name, backlog in org_stats["queues"].items():
+                stats[queue_name.split(":")[1]]["pending"] += backlog
+        
+        # Saturação dos pools de concorrência por tipo
+        stats["pools"] = self.get_pool_stats()
+        stats["organizations"] = organizations
+        stats["dead_letter"] = await self.get_dead_letter_stats()
+        
         return stats
     
-    async def cleanup_old_tasks(self, max_age_days: int = 7):
-        """Limpa tasks antigas"""
+    def _stream_backlog(self, groups, length) -> int:
+        """Entradas ainda não entregues ao consumer group (lag), a partir do XINFO GROUPS e do XLEN da stream"""
+        if isinstance(groups, Exception):
+            # Stream inexistente
+            return 0
+        
+        for group in groups:
+            name = group.get("name")
+            if (name.decode() if isinstance(name, bytes) else name) == self.stream_group:
+                lag = group.get("lag")
+                if lag is not None:
+                    return int(lag)
+        
+        return length
+    
+    async def cleanup_old_tasks(self, max_age_days: int = 7, scan_unindexed: bool = False):
+        """Limpa tasks antigas a partir do índice de conclusão"""
         cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
         cutoff_timestamp = cutoff.timestamp()
         
-        # Buscar todas as keys de task
-        task_keys = await self.redis_client.keys("task:*")
+        if scan_unindexed:
+            await self.backfill_completed_index()
         
         cleaned_count = 0
-        for key in task_keys:
-            task_data = await self.redis_client.hgetall(key)
+        while True:
+            task_ids = await self.redis_client.zrangebyscore(
+                TASKS_COMPLETED_INDEX, min=0, max=cutoff_timestamp,
+                start=0, num=TASK_CLEANUP_BATCH_SIZE
+            )
+            if not task_ids:
+                break
+            
+            task_ids = [t.decode() if isinstance(t, bytes) else t for t in task_ids]
+            
+            # Remover em lote; tasks que já expiraram pelo TTL só saem do índice
+            pipe = self.redis_client.pipeline(transaction=False)
+            for task_id in task_ids:
+                pipe.hget(f"task:{task_id}", "blobs")
+                pipe.delete(f"task:{task_id}")
+                pipe.delete(*self._task_related_keys(task_id))
+            pipe.zrem(TASKS_COMPLETED_INDEX, *task_ids)
+            # Entradas do dead-letter saem junto (retenção = max_age_days desde a falha)
+            for dead_letter_key in self._dead_letter_keys():
+                pipe.zrem(dead_letter_key, *task_ids)
+            results = (await pipe.execute())[:len(task_ids) * 3]
+            
+            cleaned_count += sum(results[1::3])
+            
+            # Payloads no blob store saem junto com a task
+            blob_keys = [key for raw in results[0::3] if raw for key in json.loads(raw)]
+            if blob_keys:
+                await self.blob_store.delete(blob_keys)
             
-            if "completed_at" in task_data:
+            if len(task_ids) < TASK_CLEANUP_BATCH_SIZE:
+                break
+        
+        orphan_blobs = await self.purge_orphan_blobs(cutoff_timestamp)
+        
+        self.logger.info(f"Limpas {cleaned_count} tasks antigas ({orphan_blobs} blobs órfãos)")
+        return cleaned_count
+    
+    async def purge_orphan_blobs(self, cutoff_timestamp: float) -> int:
+        """Remove blobs antigos cuja task já não existe (ex.: expirada pelo TTL)"""
+        if self.blob_store is None:
+            return 0
+        
+        keys = [key for key in await self.blob_store.list_older_than(cutoff_timestamp) if key.startswith("tasks/")]
+        if not keys:
+            return 0
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(f"task:{key.split('/')[1]}")
+        exists = await pipe.execute()
+        
+        orphans = [key for key, found in zip(keys, exists) if not found]
+        if orphans:
+            await self.blob_store.delete(orphans)
+        return len(orphans)
+    
+    async def backfill_completed_index(self, scan_count: int = 1000) -> int:
+        """Indexa (via SCAN, sem bloquear o Redis) tasks finalizadas antes do índice existir"""
+        indexed = 0
+        batch = []
+        
+        async def flush(keys):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hget(key, "completed_at")
+            values = await pipe.execute()
+            
+            entries = {}
+            for key, completed_at in zip(keys, values):
+                if not completed_at:
+                    continue
                 try:
-                    completed_at = datetime.fromisoformat(task_data["completed_at"])
-                    if completed_at.timestamp() < cutoff_timestamp:
-                        await self.redis_client.delete(key)
-                        cleaned_count += 1
+                    completed_at = completed_at.decode() if isinstance(completed_at, bytes) else completed_at
+                    task_id = (key.decode() if isinstance(key, bytes) else key).split(":", 1)[1]
+                    entries[task_id] = datetime.fromisoformat(completed_at).timestamp()
                 except ValueError:
                     pass
+            
+            if entries:
+                await self.redis_client.zadd(TASKS_COMPLETED_INDEX, entries)
+            return len(entries)
         
-        self.logger.info(f"Limpas {cleaned_count} tasks antigas")
-        return cleaned_count
+        async for key in self.redis_client.scan_iter(match="task:*", count=scan_count, _type="HASH"):
+            batch.append(key)
+            if len(batch) >= TASK_CLEANUP_BATCH_SIZE:
+                indexed += await flush(batch)
+                batch = []
+        
+        if batch:
+            indexed += await flush(batch)
+        
+        self.logger.info(f"{indexed} tasks finalizadas adicionadas ao índice de limpeza")
+        return indexed
     
     async def close(self):
         """Fecha conexões e limpa recursos"""
-        # Cancelar todas as tasks em execução
+        # Parar manutenção de leases
+        if self._lease_task:
+            self._lease_task.cancel()
+        
+        # Parar scheduler e liberar a liderança para outra réplica assumir logo
+        if self._scheduler_task:
+            self._scheduler_task.cancel()
+        if self.is_scheduler_leader and self.redis_client:
+            try:
+                await self._release_leader_script(keys=[SCHEDULER_LEADER_KEY], args=[self.worker_id])
+            except Exception:
+                pass
+            self.is_scheduler_leader = False
+        
+        # Cancelar todas as tasks em execução (no modo reliable elas voltam para a fila)
         for task in self.running_tasks.values():
             task.cancel()
+        if self.running_tasks:
+            await asyncio.gather(*self.running_tasks.values(), return_exceptions=True)
         
         # Fechar Redis
         if self.redis_client:
             await self.redis_client.close()
         
+        # Fechar clientes HTTP
+        await self.embedding_client.close()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        
         self.logger.info("Background Task Manager fechado")
 
 # Instância global
 task_manager = BackgroundTaskManager()
 
 # Convenience functions
-async def submit_document_processing(
+def build_document_task(
     document_id: str,
     content: str,
     organization_id: str,
     user_id: str,
     chunk_size: int = 1000,
-    priority: TaskPriority = TaskPriority.NORMAL
-) -> str:
-    """Submete task de processamento de documento"""
-    task = TaskDefinition(
+    priority: TaskPriority = TaskPriority.NORMAL,
+    chunk_overlap: int = 0
+) -> TaskDefinition:
+    """Monta a task de processamento de documento (sem submeter)"""
+    return TaskDefinition(
         name=f"Process Document {document_id}",
         task_type=TaskType.DOCUMENT_PROCESSING,
         priority=priority,
         payload={
             "document_id": document_id,
             "content": content,
-            "chunk_size": chunk_size
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap
         },
         organization_id=organization_id,
         user_id=user_id,
         tags=["document", "embedding"]
     )
+
+def document_needs_sharding(content: str, chunk_size: int = 1000, chunk_overlap: int = 0) -> bool:
+    """Se o documento excede DOCUMENT_SHARD_CHUNKS chunks estimados"""
+    chunker = DocumentChunker(chunk_tokens=max(1, chunk_size // 4), overlap_tokens=min(chunk_overlap, chunk_size // 8))
+    return chunker.estimate_chunk_count(len(content)) > DOCUMENT_SHARD_CHUNKS
+
+async def submit_document_processing(
+    document_id: str,
+    content: str,
+    organization_id: str,
+    user_id: str,
+    chunk_size: int = 1000,
+    priority: TaskPriority = TaskPriority.NORMAL,
+    chunk_overlap: int = 0,
+    sharded: Optional[bool] = None
+) -> str:
+    """Submete task de processamento de documento (em shards paralelos se for grande)"""
+    task = build_document_task(
+        document_id, content, organization_id, user_id,
+        chunk_size=chunk_size, priority=priority, chunk_overlap=chunk_overlap
+    )
+    
+    if sharded is None:
+        sharded = document_needs_sharding(content, chunk_size, chunk_overlap)
+    
+    if sharded:
+        return await task_manager.submit_sharded_document(task)
     
     return await task_manager.submit_task(task)
 
@@ -0,0 +1,180 @@
+"""
+Blob store para payloads grandes de tasks
+Conteúdo comprimido (gzip) em disco local ou em bucket S3-compatível, referenciado por chave
+"""
+
+import asyncio
+import gzip
+import io
+import os
+import tempfile
+import logging
+from pathlib import Path
+from typing import IO, List
+
+# Configurações
+TASK_BLOB_STORE = os.getenv("TASK_BLOB_STORE", "filesystem")  # filesystem | s3
+TASK_BLOB_DIR = os.getenv("TASK_BLOB_DIR", "/tmp/task_blobs")  # deve ser compartilhado entre API e workers
+TASK_BLOB_S3_BUCKET = os.getenv("TASK_BLOB_S3_BUCKET")
+TASK_BLOB_S3_ENDPOINT = os.getenv("TASK_BLOB_S3_ENDPOINT")  # MinIO, R2, ...; vazio usa a AWS
+TASK_BLOB_S3_PREFIX = os.getenv("TASK_BLOB_S3_PREFIX", "task-payloads/")
+BLOB_COMPRESSION_LEVEL = 6
+S3_DELETE_BATCH_SIZE = 1000  # limite do DeleteObjects
+
+logger = logging.getLogger(__name__)
+
+class BlobStore:
+    """Interface do blob store: bytes comprimidos por chave"""
+    
+    async def put(self, key: str, data: bytes) -> int:
+        """Grava o blob comprimido; retorna o tamanho armazenado"""
+        raise NotImplementedError
+    
+    async def get(self, key: str) -> bytes:
+        """Lê e descomprime o blob inteiro"""
+        raise NotImplementedError
+    
+    async def open_text(self, key: str) -> IO[str]:
+        """Abre o blob como texto para leitura incremental (descompressão sob demanda)"""
+        raise NotImplementedError
+    
+    async def delete(self, keys: List[str]):
+        """Remove blobs (chaves inexistentes são ignoradas)"""
+        raise NotImplementedError
+    
+    async def list_older_than(self, cutoff_timestamp: float) -> List[str]:
+        """Chaves de blobs gravados antes de `cutoff_timestamp`"""
+        raise NotImplementedError
+
+class FilesystemBlobStore(BlobStore):
+    """Blobs em arquivos .gz num diretório local (ou volume compartilhado)"""
+    
+    def __init__(self, root: str = TASK_BLOB_DIR):
+        self.root = Path(root).resolve()
+    
+    def _path(self, key: str) -> Path:
+        path = (self.root / f"{key}.gz").resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Chave de blob inválida: {key}")
+        return path
+    
+    def _write(self, path: Path, data: bytes) -> int:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, "wb", compresslevel=BLOB_COMPRESSION_LEVEL) as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # leitores nunca veem arquivo parcial
+        return path.stat().st_size
+    
+    def _read(self, path: Path) -> bytes:
+        with gzip.open(path, "rb") as f:
+            return f.read()
+    
+    def _delete(self, keys: List[str]):
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+    
+    def _list_older_than(self, cutoff_timestamp: float) -> List[str]:
+        return [
+            path.relative_to(self.root).as_posix()[:-len(".gz")]
+            for path in self.root.rglob("*.gz")
+            if path.stat().st_mtime < cutoff_timestamp
+        ]
+    
+    async def put(self, key: str, data: bytes) -> int:
+        return await asyncio.to_thread(self._write, self._path(key), data)
+    
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._read, self._path(key))
+    
+    async def open_text(self, key: str) -> IO[str]:
+        return gzip.open(self._path(key), "rt", encoding="utf-8")
+    
+    async def delete(self, keys: List[str]):
+        await asyncio.to_thread(self._delete, keys)
+    
+    async def list_older_than(self, cutoff_timestamp: float) -> List[str]:
+        if not self.root.exists():
+            return []
+        return await asyncio.to_thread(self._list_older_than, cutoff_timestamp)
+
+class S3BlobStore(BlobStore):
+    """Blobs num bucket S3-compatível (requer boto3)"""
+    
+    def __init__(
+        self,
+        bucket: str = TASK_BLOB_S3_BUCKET,
+        endpoint_url: str = TASK_BLOB_S3_ENDPOINT,
+        prefix: str = TASK_BLOB_S3_PREFIX
+    ):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("TASK_BLOB_STORE=s3 requer boto3 (pip install boto3)")
+        
+        if not bucket:
+            raise RuntimeError("TASK_BLOB_S3_BUCKET não configurado")
+        
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+    
+    def _download(self, key: str) -> IO[bytes]:
+        # Arquivo temporário anônimo: removido quando o leitor é fechado/coletado
+        raw = tempfile.TemporaryFile()
+        self.client.download_fileobj(self.bucket, self.prefix + key, raw)
+        raw.seek(0)
+        return raw
+    
+    def _delete(self, keys: List[str]):
+        for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": self.prefix + key} for key in keys[start:start + S3_DELETE_BATCH_SIZE]],
+                    "Quiet": True
+                }
+            )
+    
+    def _list_older_than(self, cutoff_timestamp: float) -> List[str]:
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                if item["LastModified"].timestamp() < cutoff_timestamp:
+                    keys.append(item["Key"][len(self.prefix):])
+        return keys
+    
+    async def put(self, key: str, data: bytes) -> int:
+        compressed = await asyncio.to_thread(gzip.compress, data, BLOB_COMPRESSION_LEVEL)
+        await asyncio.to_thread(
+            self.client.put_object,
+            Bucket=self.bucket, Key=self.prefix + key, Body=compressed, ContentType="application/gzip"
+        )
+        return len(compressed)
+    
+    async def get(self, key: str) -> bytes:
+        raw = await asyncio.to_thread(self._download, key)
+        with raw:
+            return await asyncio.to_thread(gzip.decompress, raw.read())
+    
+    async def open_text(self, key: str) -> IO[str]:
+        # Download para disco fora do event loop; descompressão incremental na leitura
+        raw = await asyncio.to_thread(self._download, key)
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="rb"), encoding="utf-8")
+    
+    async def delete(self, keys: List[str]):
+        if keys:
+            await asyncio.to_thread(self._delete, keys)
+    
+    async def list_older_than(self, cutoff_timestamp: float) -> List[str]:
+        return await asyncio.to_thread(self._list_older_than, cutoff_timestamp)
+
+def create_blob_store(backend: str = None) -> BlobStore:
+    """Blob store configurado em TASK_BLOB_STORE"""
+    backend = (backend or TASK_BLOB_STORE).lower()
+    if backend == "s3":
+        return S3BlobStore()
+    if backend != "filesystem":
+        logger.warning(f"TASK_BLOB_STORE desconhecido ({backend}), usando filesystem")
+    return FilesystemBlobStore()
@@ -0,0 +1,298 @@
+"""
+Circuit breaker por host de destino dos webhooks
+Janela deslizante de falhas, probes em half-open e timeout adaptativo por percentil de latência,
+com estado compartilhado entre réplicas via Redis
+"""
+
+import math
+import os
+import time
+import logging
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import redis.asyncio as redis
+
+# Configurações
+CIRCUIT_FAILURE_THRESHOLD = float(os.getenv("WEBHOOK_CIRCUIT_FAILURE_THRESHOLD", "0.5"))  # taxa de falha que abre o circuito
+CIRCUIT_MIN_REQUESTS = int(os.getenv("WEBHOOK_CIRCUIT_MIN_REQUESTS", "10"))  # mínimo de requisições na janela
+CIRCUIT_WINDOW_SECONDS = int(os.getenv("WEBHOOK_CIRCUIT_WINDOW", "60"))  # seconds - janela deslizante
+CIRCUIT_BUCKET_SECONDS = 10  # granularidade da janela
+CIRCUIT_OPEN_SECONDS = int(os.getenv("WEBHOOK_CIRCUIT_OPEN_SECONDS", "60"))  # seconds até o próximo probe
+CIRCUIT_PROBE_LEASE = 60  # seconds - probe sem resultado (worker caiu) libera outro probe
+CIRCUIT_LATENCY_SAMPLES = 200  # últimas latências por host
+CIRCUIT_MIN_LATENCY_SAMPLES = 20  # abaixo disso usa o timeout da política
+CIRCUIT_TIMEOUT_PERCENTILE = float(os.getenv("WEBHOOK_TIMEOUT_PERCENTILE", "0.99"))
+CIRCUIT_TIMEOUT_MULTIPLIER = float(os.getenv("WEBHOOK_TIMEOUT_MULTIPLIER", "3.0"))
+CIRCUIT_MIN_TIMEOUT = float(os.getenv("WEBHOOK_MIN_TIMEOUT", "2.0"))  # seconds
+CIRCUIT_TIMEOUT_CACHE_SECONDS = 10  # timeout adaptativo recalculado no máximo a cada N segundos
+CIRCUIT_STATE_TTL = 86400  # hosts sem tráfego expiram
+CIRCUIT_KEY_PREFIX = "circuit"
+CIRCUIT_HOSTS_KEY = "circuit_hosts"
+
+logger = logging.getLogger(__name__)
+
+# =========================================
+# SCRIPTS LUA
+# =========================================
+
+# Decide se uma requisição pode sair: fechado sempre; aberto só após open_until, como probe
+# (passa a half-open); half-open admite um probe por vez
+CIRCUIT_ALLOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'closed' then
+    return {1, 0, 0}
+end
+
+if state == 'open' then
+    local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until') or '0')
+    if now < open_until then
+        return {0, 0, math.ceil(open_until - now)}
+    end
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'probe_until', now + tonumber(ARGV[2]))
+    return {1, 1, 0}
+end
+
+local probe_until = tonumber(redis.call('HGET', KEYS[1], 'probe_until') or '0')
+if now >= probe_until then
+    redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[2]))
+    return {1, 1, 0}
+end
+return {0, 0, math.ceil(probe_until - now)}
+"""
+
+# Registra o resultado de uma requisição: janela em buckets "<bucket>:s|f" e latências recentes.
+# Half-open: sucesso fecha, falha reabre. Fechado: abre quando a taxa de falha da janela passa do limite
+CIRCUIT_RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local success = ARGV[2] == '1'
+local bucket_seconds = tonumber(ARGV[4])
+local bucket = math.floor(now / bucket_seconds)
+local oldest = bucket - tonumber(ARGV[5]) + 1
+local open_seconds = tonumber(ARGV[8])
+
+redis.call('SADD', KEYS[4], ARGV[10])
+redis.call('EXPIRE', KEYS[1], ARGV[11])
+if ARGV[3] ~= '' then
+    redis.call('LPUSH', KEYS[3], ARGV[3])
+    redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[9]) - 1)
+    redis.call('EXPIRE', KEYS[3], ARGV[11])
+end
+
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'half_open' then
+    if success then
+        redis.call('HSET', KEYS[1], 'state', 'closed')
+        redis.call('HDEL', KEYS[1], 'open_until', 'probe_until')
+        redis.call('DEL', KEYS[2])
+        return 'closed'
+    end
+    redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', now + open_seconds)
+    redis.call('HDEL', KEYS[1], 'probe_until')
+    redis.call('HINCRBY', KEYS[1], 'opened', 1)
+    return 'open'
+end
+
+-- Requisição iniciada antes da abertura: não altera o circuito
+if state == 'open' then
+    return 'open'
+end
+
+redis.call('HINCRBY', KEYS[2], bucket .. (success and ':s' or ':f'), 1)
+redis.call('EXPIRE', KEYS[2], bucket_seconds * tonumber(ARGV[5]) * 2)
+
+local total, failures = 0, 0
+local fields = redis.call('HGETALL', KEYS[2])
+for i = 1, #fields, 2 do
+    local field_bucket, kind = string.match(fields[i], '^(%-?%d+):(%a)$')
+    if tonumber(field_bucket) < oldest then
+        redis.call('HDEL', KEYS[2], fields[i])
+    else
+        local count = tonumber(fields[i + 1])
+        total = total + count
+        if kind == 'f' then
+            failures = failures + count
+        end
+    end
+end
+
+if total >= tonumber(ARGV[6]) and failures / total >= tonumber(ARGV[7]) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', now + open_seconds)
+    redis.call('HINCRBY', KEYS[1], 'opened', 1)
+    redis.call('DEL', KEYS[2])
+    return 'open'
+end
+return 'closed'
+"""
+
+class CircuitOpenError(Exception):
+    """Destino com circuito aberto: a entrega vai direto para o retry"""
+    
+    def __init__(self, host: str, retry_after: int):
+        super().__init__(f"Circuit open for {host} (retry in {retry_after}s)")
+        self.host = host
+        self.retry_after = retry_after
+
+def is_failure_status(status_code: Optional[int]) -> bool:
+    """Falhas que contam para o circuito: sem resposta, 5xx e 429 (4xx é erro do payload, não do destino)"""
+    return status_code is None or status_code >= 500 or status_code == 429
+
+class CircuitBreaker:
+    """Circuit breaker por host com estado no Redis; sem Redis, todas as requisições passam"""
+    
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        self.redis_client = redis_client
+        self._scripts_client: Optional[redis.Redis] = None
+        self._allow_script = None
+        self._record_script = None
+        self._timeouts: Dict[str, Tuple[float, Optional[float]]] = {}  # host -> (expira em, p-latência em s)
+    
+    def host_for(self, url: str) -> str:
+        return urlparse(url).netloc.lower() or url
+    
+    def _keys(self, host: str):
+        return (
+            f"{CIRCUIT_KEY_PREFIX}:{host}",
+            f"{CIRCUIT_KEY_PREFIX}:{host}:window",
+            f"{CIRCUIT_KEY_PREFIX}:{host}:latency"
+        )
+    
+    def _ensure_scripts(self):
+        # redis_client é atribuído depois da construção (initialize dos managers)
+        if self._scripts_client is not self.redis_client:
+            self._allow_script = self.redis_client.register_script(CIRCUIT_ALLOW_SCRIPT)
+            self._record_script = self.redis_client.register_script(CIRCUIT_RECORD_SCRIPT)
+            self._scripts_client = self.redis_client
+    
+    async def allow(self, url: str) -> Tuple[bool, bool, int]:
+        """(pode enviar, é probe de half-open, segundos até o próximo probe)"""
+        if not self.redis_client:
+            return True, False, 0
+        
+        try:
+            self._ensure_scripts()
+            state_key, _, _ = self._keys(self.host_for(url))
+            allowed, probe, retry_after = await self._allow_script(
+                keys=[state_key], args=[time.time(), CIRCUIT_PROBE_LEASE]
+            )
+            return bool(allowed), bool(probe), int(retry_after)
+        except Exception as e:
+            # Falha do Redis não pode bloquear as entregas
+            logger.error(f"Erro ao consultar circuit breaker: {e}")
+            return True, False, 0
+    
+    async def check(self, url: str) -> bool:
+        """Como allow(), mas levanta CircuitOpenError; retorna se é probe"""
+        allowed, probe, retry_after = await self.allow(url)
+        if not allowed:
+            raise CircuitOpenError(self.host_for(url), retry_after)
+        return probe
+    
+    async def record(self, url: str, success: bool, latency_ms: Optional[int] = None) -> Optional[str]:
+        """Registra o resultado de uma requisição; retorna o estado do circuito"""
+        if not self.redis_client:
+            return None
+        
+        host = self.host_for(url)
+        try:
+            self._ensure_scripts()
+            state = await self._record_script(
+                keys=[*self._keys(host), CIRCUIT_HOSTS_KEY],
+                args=[
+                    time.time(), "1" if success else "0",
+                    "" if latency_ms is None else latency_ms,
+                    CIRCUIT_BUCKET_SECONDS, max(1, CIRCUIT_WINDOW_SECONDS // CIRCUIT_BUCKET_SECONDS),
+                    CIRCUIT_MIN_REQUESTS, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS,
+                    CIRCUIT_LATENCY_SAMPLES, host, CIRCUIT_STATE_TTL
+                ]
+            )
+            state = state.decode() if isinstance(state, bytes) else state
+            if state == "open":
+                logger.warning(f"Circuito aberto para {host}")
+            return state
+        except Exception as e:
+            logger.error(f"Erro ao registrar resultado no circuit breaker: {e}")
+            return None
+    
+    def _latency_percentile(self, samples) -> Optional[float]:
+        """Percentil configurado das latências (em segundos)"""
+        if len(samples) < CIRCUIT_MIN_LATENCY_SAMPLES:
+            return None
+        latencies = sorted(float(sample) for sample in samples)
+        index = min(len(latencies) - 1, math.ceil(CIRCUIT_TIMEOUT_PERCENTILE * len(latencies)) - 1)
+        return latencies[index] / 1000
+    
+    def _adaptive_timeout(self, percentile: Optional[float], default: float) -> float:
+        if percentile is None:
+            return default
+        return min(default, max(CIRCUIT_MIN_TIMEOUT, percentile * CIRCUIT_TIMEOUT_MULTIPLIER))
+    
+    async def timeout_for(self, url: str, default: float) -> float:
+        """Timeout adaptativo: percentil da latência × multiplicador, limitado ao timeout da política"""
+        if not self.redis_client:
+            return default
+        
+        host = self.host_for(url)
+        now = time.monotonic()
+        cached = self._timeouts.get(host)
+        if cached and cached[0] > now:
+            return self._adaptive_timeout(cached[1], default)
+        
+        try:
+            _, _, latency_key = self._keys(host)
+            percentile = self._latency_percentile(await self.redis_client.lrange(latency_key, 0, -1))
+        except Exception as e:
+            logger.error(f"Erro ao calcular timeout adaptativo para {host}: {e}")
+            percentile = None
+        
+        self._timeouts[host] = (now + CIRCUIT_TIMEOUT_CACHE_SECONDS, percentile)
+        return self._adaptive_timeout(percentile, default)
+    
+    async def get_states(self) -> Dict[str, Dict[str, Any]]:
+        """Estado do circuito, janela atual e latência de cada host conhecido"""
+        if not self.redis_client:
+            return {}
+        
+        hosts = sorted(host.decode() if isinstance(host, bytes) else host
+                       for host in await self.redis_client.smembers(CIRCUIT_HOSTS_KEY))
+        pipe = self.redis_client.pipeline(transaction=False)
+        for host in hosts:
+            state_key, window_key, latency_key = self._keys(host)
+            pipe.hgetall(state_key)
+            pipe.hgetall(window_key)
+            pipe.lrange(latency_key, 0, -1)
+        results = await pipe.execute()
+        
+        now = time.time()
+        oldest = math.floor(now / CIRCUIT_BUCKET_SECONDS) - max(1, CIRCUIT_WINDOW_SECONDS // CIRCUIT_BUCKET_SECONDS) + 1
+        states = {}
+        for index, host in enumerate(hosts):
+            state, window, latencies = results[index * 3:index * 3 + 3]
+            if not state and not window and not latencies:
+                # Todas as chaves expiraram
+                await self.redis_client.srem(CIRCUIT_HOSTS_KEY, host)
+                continue
+            
+            state = {k.decode(): v.decode() for k, v in state.items()}
+            requests = failures = 0
+            for field, count in window.items():
+                bucket, kind = field.decode().split(":")
+                if int(bucket) >= oldest:
+                    requests += int(count)
+                    failures += int(count) if kind == "f" else 0
+            
+            open_until = float(state.get("open_until", 0))
+            percentile = self._latency_percentile(latencies)
+            states[host] = {
+                "state": state.get("state", "closed"),
+                "requests": requests,
+                "failures": failures,
+                "failure_rate": round(failures / requests, 2) if requests else 0.0,
+                "retry_in": max(0, math.ceil(open_until - now)) if state.get("state") == "open" else 0,
+                "times_opened": int(state.get("opened", 0)),
+                "latency_percentile_ms": int(percentile * 1000) if percentile is not None else None,
+                "adaptive_timeout": round(self._adaptive_timeout(percentile, float("inf")), 2) if percentile is not None else None
+            }
+        
+        return states
@@ -67,6 +67,18 @@ class OptimizedPrismaClient:
                 logger.warning(f"Redis cache não disponível: {e}")
                 
             # Configurar connection pool para raw queries
+            await self.get_pool()
+                
+            logger.info("Database conectado com sucesso")
+            
+        except Exception as e:
+            logger.error(f"Erro ao conectar database: {e}")
+            raise DatabaseError(f"Falha na conexão: {e}")
+    
+    async def get_pool(self) -> Optional[asyncpg.Pool]:
+        """Retorna o connection pool asyncpg, criando-o sob demanda"""
+        if self._connection_pool is None:
+            import os
             database_url = os.getenv("DIRECT_URL")
             if database_url:
                 self._connection_pool = await asyncpg.create_pool(
@@ -75,12 +87,7 @@ class OptimizedPrismaClient:
                     max_size=self.config.MAX_CONNECTIONS,
                     command_timeout=self.config.CONNECTION_TIMEOUT
                 )
-                
-            logger.info("Database conectado com sucesso")
-            
-        except Exception as e:
-            logger.error(f"Erro ao conectar database: {e}")
-            raise DatabaseError(f"Falha na conexão: {e}")
+        return self._connection_pool
     
     async def disconnect(self):
         """Desconecta do banco"""
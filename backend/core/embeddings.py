@@ -0,0 +1,623 @@
+"""
+Pipeline de embeddings para a knowledge base
+Geração em lote com orçamento de tokens e cliente HTTP compartilhado
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+import uuid
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import httpx
+
+# Configuração
+EMBEDDINGS_API_URL = os.getenv("EMBEDDINGS_API_URL", "https://openrouter.ai/api/v1/embeddings")
+EMBEDDINGS_API_KEY = os.getenv("OPENROUTER_API_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = 1536
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "8000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "128"))
+EMBEDDING_MAX_CONCURRENT_BATCHES = int(os.getenv("EMBEDDING_MAX_CONCURRENT_BATCHES", "4"))
+EMBEDDING_REQUEST_TIMEOUT = float(os.getenv("EMBEDDING_REQUEST_TIMEOUT", "60"))
+EMBEDDING_WRITE_BATCH_SIZE = int(os.getenv("EMBEDDING_WRITE_BATCH_SIZE", "500"))
+CHUNK_READ_BLOCK_SIZE = 64 * 1024  # caracteres lidos por vez da fonte
+CHUNK_THREAD_BATCH_SIZE = int(os.getenv("CHUNK_THREAD_BATCH_SIZE", "32"))  # chunks gerados por ida à thread
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))  # LRU em memória
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 86400)))  # seconds
+SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+# Upsert multi-linha idempotente (chave: chunk_id)
+UPSERT_EMBEDDINGS_SQL = """
+INSERT INTO document_embeddings (
+    id, document_id, organization_id, chunk_id, content, embedding, position, created_at
+)
+SELECT t.id, $1, $2, t.chunk_id, t.content, t.embedding::vector, t.position, NOW()
+FROM unnest($3::uuid[], $4::text[], $5::text[], $6::text[], $7::int[])
+    AS t(id, chunk_id, content, embedding, position)
+ON CONFLICT (chunk_id) DO UPDATE SET
+    document_id = EXCLUDED.document_id,
+    organization_id = EXCLUDED.organization_id,
+    content = EXCLUDED.content,
+    embedding = EXCLUDED.embedding,
+    position = EXCLUDED.position
+"""
+
+# Logger
+logger = logging.getLogger(__name__)
+
+# Vetor retornado quando o provedor falha (nunca vai para o cache)
+FALLBACK_EMBEDDING = [0.1] * EMBEDDING_DIMENSIONS
+
+# Tokenizer opcional (tiktoken); sem ele usa estimativa por caracteres
+_tokenizer = None
+_tokenizer_loaded = False
+
+def estimate_tokens(text: str) -> int:
+    """Estima tokens de um texto (~4 caracteres por token)"""
+    return max(1, (len(text) + 3) // 4)
+
+def count_tokens(text: str) -> int:
+    """Conta tokens com tiktoken se instalado, senão estima"""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = None
+    
+    if _tokenizer is not None:
+        return max(1, len(_tokenizer.encode(text, disallowed_special=())))
+    return estimate_tokens(text)
+
+# =========================================
+# CHUNKING
+# =========================================
+
+# Fronteira de sentença (pontuação + espaço) ou de parágrafo (linha em branco)
+_UNIT_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+TextSource = Union[str, Iterable[str], Any]
+
+def _iter_blocks(source: TextSource, block_size: int = CHUNK_READ_BLOCK_SIZE) -> Iterator[str]:
+    """Lê a fonte (texto, arquivo aberto ou iterável de blocos) aos pedaços"""
+    if isinstance(source, str):
+        for start in range(0, len(source), block_size):
+            yield source[start:start + block_size]
+    elif hasattr(source, "read"):
+        while True:
+            block = source.read(block_size)
+            if not block:
+                break
+            yield block.decode("utf-8", errors="replace") if isinstance(block, bytes) else block
+    else:
+        for block in source:
+            yield block.decode("utf-8", errors="replace") if isinstance(block, bytes) else block
+
+def iter_text_units(source: TextSource, block_size: int = CHUNK_READ_BLOCK_SIZE) -> Iterator[Tuple[str, bool]]:
+    """Gera (sentença, fim_de_parágrafo) de forma incremental, sem carregar a fonte inteira"""
+    buffer = ""
+    
+    for block in _iter_blocks(source, block_size):
+        buffer += block
+        last = 0
+        
+        for match in _UNIT_BOUNDARY.finditer(buffer):
+            # Espaço no fim do buffer pode continuar no próximo bloco
+            if match.end() >= len(buffer):
+                break
+            unit = buffer[last:match.start()].strip()
+            if unit:
+                yield unit, bool(_PARAGRAPH_BREAK.search(match.group()))
+            last = match.end()
+        
+        buffer = buffer[last:]
+        
+        # Texto sem pontuação: corta no último espaço para manter memória limitada
+        if len(buffer) > block_size * 2:
+            cut = buffer.rfind(" ", 0, block_size)
+            cut = cut if cut > 0 else block_size
+            yield buffer[:cut].strip(), False
+            buffer = buffer[cut:]
+    
+    tail = buffer.strip()
+    if tail:
+        yield tail, True
+
+class DocumentChunker:
+    """Chunker em streaming por tokens, com overlap e fronteiras de sentença/parágrafo"""
+    
+    def __init__(self, chunk_tokens: int = 250, overlap_tokens: int = 0, paragraph_min_ratio: float = 0.5):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens deve ser menor que chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        # Fecha o chunk em fim de parágrafo se já tiver pelo menos esta fração do tamanho
+        self.paragraph_min_ratio = paragraph_min_ratio
+    
+    def estimate_chunk_count(self, total_chars: int) -> int:
+        """Estimativa de chunks para uma fonte de `total_chars` caracteres (para progresso)"""
+        step_tokens = self.chunk_tokens - self.overlap_tokens
+        return max(1, -(-total_chars // (step_tokens * 4)))
+    
+    def chunks(self, source: TextSource) -> Iterator[str]:
+        """Gera chunks à medida que a fonte é lida"""
+        window: List[Tuple[str, int, bool]] = []  # (texto, tokens, fim_de_parágrafo)
+        window_tokens = 0
+        fresh = 0  # unidades novas desde o último chunk emitido
+        
+        for unit, paragraph_end in iter_text_units(source):
+            pieces = self._split_long_unit(unit)
+            
+            for i, piece in enumerate(pieces):
+                tokens = count_tokens(piece)
+                
+                if window and window_tokens + tokens > self.chunk_tokens:
+                    if fresh:
+                        yield self._join(window)
+                    window = self._overlap(window) if fresh else []
+                    window_tokens = sum(t for _, t, _ in window)
+                    fresh = 0
+                    
+                    # Overlap + próxima unidade não cabe: descarta o overlap
+                    if window_tokens + tokens > self.chunk_tokens:
+                        window, window_tokens = [], 0
+                
+                is_paragraph_end = paragraph_end and i == len(pieces) - 1
+                window.append((piece, tokens, is_paragraph_end))
+                window_tokens += tokens
+                fresh += 1
+                
+                if is_paragraph_end and window_tokens >= self.chunk_tokens * self.paragraph_min_ratio:
+                    yield self._join(window)
+                    window = self._overlap(window)
+                    window_tokens = sum(t for _, t, _ in window)
+                    fresh = 0
+        
+        if fresh:
+            yield self._join(window)
+    
+    async def achunks(self, source: TextSource, batch_size: int = CHUNK_THREAD_BATCH_SIZE) -> AsyncIterator[str]:
+        """Versão assíncrona de `chunks`: leitura da fonte e tokenização rodam em thread, em lotes"""
+        chunks = self.chunks(source)
+        while True:
+            batch = await asyncio.to_thread(lambda: list(islice(chunks, batch_size)))
+            if not batch:
+                return
+            for chunk in batch:
+                yield chunk
+    
+    def _split_long_unit(self, unit: str) -> List[str]:
+        """Divide sentenças maiores que o chunk em pedaços por palavras"""
+        if count_tokens(unit) <= self.chunk_tokens:
+            return [unit]
+        
+        pieces = []
+        current: List[str] = []
+        current_tokens = 0
+        
+        for word in unit.split():
+            tokens = count_tokens(word) + (1 if current else 0)
+            if current and current_tokens + tokens > self.chunk_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+                tokens = count_tokens(word)
+            current.append(word)
+            current_tokens += tokens
+        
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+    
+    def _overlap(self, window: List[Tuple[str, int, bool]]) -> List[Tuple[str, int, bool]]:
+        """Unidades finais do chunk anterior que cabem no overlap"""
+        if not self.overlap_tokens:
+            return []
+        
+        kept: List[Tuple[str, int, bool]] = []
+        tokens = 0
+        for item in reversed(window):
+            if tokens + item[1] > self.overlap_tokens:
+                break
+            kept.insert(0, item)
+            tokens += item[1]
+        return kept
+    
+    @staticmethod
+    def _join(window: List[Tuple[str, int, bool]]) -> str:
+        """Junta unidades preservando quebras de parágrafo"""
+        parts = []
+        for i, (text, _, paragraph_end) in enumerate(window):
+            parts.append(text)
+            if i < len(window) - 1:
+                parts.append("\n\n" if paragraph_end else " ")
+        return "".join(parts)
+
+# =========================================
+# CACHE DE EMBEDDINGS
+# =========================================
+
+class EmbeddingCache:
+    """Cache endereçado por conteúdo (modelo + hash do chunk normalizado)
+    
+    LRU em memória na frente do Redis; entradas expiram por TTL nas duas camadas
+    e o LRU é limitado por número de entradas.
+    """
+    
+    def __init__(
+        self,
+        redis_client: Optional[Any] = None,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl: int = EMBEDDING_CACHE_TTL,
+        enabled: bool = EMBEDDING_CACHE_ENABLED
+    ):
+        self.redis_client = redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lru: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self.stats = {"hits_memory": 0, "hits_redis": 0, "misses": 0, "writes": 0, "evictions": 0}
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normaliza unicode e espaços para que edições cosméticas não invalidem o cache"""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+    
+    def key(self, model: str, text: str) -> str:
+        """Chave do cache para (modelo, conteúdo)"""
+        digest = hashlib.sha256(self.normalize(text).encode()).hexdigest()
+        return f"embedding_cache:{model}:{digest}"
+    
+    async def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Busca embeddings em lote: LRU primeiro, depois um único MGET no Redis"""
+        if not self.enabled:
+            return [None] * len(texts)
+        
+        keys = [self.key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = [self._lru_get(key) for key in keys]
+        self.stats["hits_memory"] += sum(1 for r in results if r is not None)
+        
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing and self.redis_client is not None:
+            try:
+                values = await self.redis_client.mget([keys[i] for i in missing])
+                for i, value in zip(missing, values):
+                    if value:
+                        vector = array("f", value).tolist()
+                        results[i] = vector
+                        self._lru_set(keys[i], vector)
+                        self.stats["hits_redis"] += 1
+            except Exception as e:
+                logger.warning(f"Erro ao consultar cache de embeddings: {e}")
+        
+        self.stats["misses"] += sum(1 for r in results if r is None)
+        return results
+    
+    async def set_many(self, model: str, items: List[Tuple[str, List[float]]]):
+        """Grava embeddings no LRU e no Redis (pipeline com TTL)"""
+        if not self.enabled:
+            return
+        
+        entries = [
+            (self.key(model, text), vector)
+            for text, vector in items
+            if vector and vector != FALLBACK_EMBEDDING
+        ]
+        if not entries:
+            return
+        
+        for key, vector in entries:
+            self._lru_set(key, vector)
+        self.stats["writes"] += len(entries)
+        
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, vector in entries:
+                    pipe.setex(key, self.ttl, array("f", vector).tobytes())
+                await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Erro ao gravar cache de embeddings: {e}")
+    
+    def _lru_get(self, key: str) -> Optional[List[float]]:
+        """Busca no LRU respeitando TTL"""
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at < time.monotonic():
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return vector
+    
+    def _lru_set(self, key: str, vector: List[float]):
+        """Insere no LRU, despejando as entradas menos usadas acima do limite"""
+        self._lru[key] = (time.monotonic() + self.ttl, vector)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.stats["evictions"] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas de hit/miss do cache"""
+        lookups = self.stats["hits_memory"] + self.stats["hits_redis"] + self.stats["misses"]
+        hits = self.stats["hits_memory"] + self.stats["hits_redis"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "memory_entries": len(self._lru),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+# =========================================
+# CLIENTE DE EMBEDDINGS
+# =========================================
+
+class EmbeddingClient:
+    """Cliente de embeddings com batching por tokens e pool de conexões"""
+    
+    def __init__(
+        self,
+        api_url: str = EMBEDDINGS_API_URL,
+        api_key: Optional[str] = EMBEDDINGS_API_KEY,
+        model: str = EMBEDDING_MODEL,
+        max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_inputs: int = EMBEDDING_BATCH_MAX_INPUTS,
+        max_concurrent_batches: int = EMBEDDING_MAX_CONCURRENT_BATCHES,
+        timeout: float = EMBEDDING_REQUEST_TIMEOUT
+    ):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.max_concurrent_batches = max_concurrent_batches
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(max_concurrent_batches)
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente HTTP compartilhado (criado sob demanda)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrent_batches * 2,
+                    max_keepalive_connections=self.max_concurrent_batches
+                ),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": "https://agentesdeconversao.com.br"
+                }
+            )
+        return self._client
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Gera embeddings para um lote em uma única requisição"""
+        # Sem chave não há provedor: falhar em vez de gravar embeddings de fallback
+        if not self.api_key:
+            raise RuntimeError("OPENROUTER_API_KEY não configurada: defina a variável de ambiente para gerar embeddings")
+        
+        async with self._semaphore:
+            try:
+                response = await self.client.post(
+                    self.api_url,
+                    json={
+                        "model": self.model,
+                        "input": texts
+                    }
+                )
+                
+                if response.status_code == 200:
+                    data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+                    if len(data) == len(texts):
+                        return [item["embedding"] for item in data]
+                    logger.warning(f"Resposta de embeddings incompleta: {len(data)}/{len(texts)}")
+                else:
+                    logger.warning(f"Erro HTTP {response.status_code} ao gerar embeddings")
+            
+            except Exception as e:
+                logger.error(f"Erro ao gerar embeddings em lote: {e}")
+            
+            # Fallback: retorna embeddings mock
+            return [list(FALLBACK_EMBEDDING) for _ in texts]
+    
+    async def embed_stream(
+        self,
+        chunks: Union[Iterable[str], AsyncIterable[str]],
+        cache: Optional[EmbeddingCache] = None
+    ) -> AsyncIterator[List[Tuple[int, str, List[float], bool]]]:
+        """Consome chunks de um iterador e produz lotes (posição, texto, embedding, do_cache) assim que ficam prontos
+        
+        Os lotes são montados por orçamento de tokens enquanto os anteriores estão em voo,
+        com no máximo `max_concurrent_batches` requisições pendentes (backpressure no iterador).
+        Com `cache`, só os chunks ausentes do cache vão para o provedor.
+        Aceita também iteradores assíncronos (ex.: `DocumentChunker.achunks`).
+        """
+        pending: set = set()
+        batch: List[Tuple[int, str]] = []
+        batch_tokens = 0
+        
+        async def run_batch(items: List[Tuple[int, str]]) -> List[Tuple[int, str, List[float], bool]]:
+            texts = [text for _, text in items]
+            cached = await cache.get_many(self.model, texts) if cache else [None] * len(texts)
+            
+            missing = [i for i, vector in enumerate(cached) if vector is None]
+            vectors = list(cached)
+            if missing:
+                generated = await self.embed_batch([texts[i] for i in missing])
+                for i, vector in zip(missing, generated):
+                    vectors[i] = vector
+            
+            return [
+                (position, text, vector, cached[i] is not None)
+                for i, ((position, text), vector) in enumerate(zip(items, vectors))
+            ]
+        
+        async def iterate() -> AsyncIterator[str]:
+            if hasattr(chunks, "__aiter__"):
+                async for chunk in chunks:
+                    yield chunk
+            else:
+                for chunk in chunks:
+                    yield chunk
+        
+        try:
+            position = -1
+            async for chunk in iterate():
+                position += 1
+                tokens = estimate_tokens(chunk)
+                
+                if batch and (
+                    batch_tokens + tokens > self.max_batch_tokens
+                    or len(batch) >= self.max_batch_inputs
+                ):
+                    pending.add(asyncio.create_task(run_batch(batch)))
+                    batch, batch_tokens = [], 0
+                    
+                    # Não lê mais a fonte enquanto o limite de lotes em voo estiver cheio
+                    while len(pending) >= self.max_concurrent_batches:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            yield task.result()
+                    
+                    # Cede o loop para os lotes em voo enquanto o chunking continua
+                    await asyncio.sleep(0)
+                
+                batch.append((position, chunk))
+                batch_tokens += tokens
+            
+            if batch:
+                pending.add(asyncio.create_task(run_batch(batch)))
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def embed_many(
+        self,
+        texts: List[str],
+        on_batch_done: Optional[Callable[[int, int], Awaitable[None]]] = None
+    ) -> List[List[float]]:
+        """Gera embeddings para todos os textos com lotes em paralelo (limitados)"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        done = 0
+        
+        async for batch in self.embed_stream(texts):
+            for position, _, vector, _ in batch:
+                results[position] = vector
+            done += len(batch)
+            if on_batch_done:
+                await on_batch_done(done, len(texts))
+        
+        return results
+    
+    async def close(self):
+        """Fecha o cliente HTTP"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# =========================================
+# PERSISTÊNCIA
+# =========================================
+
+class EmbeddingWriter:
+    """Escrita em lote (upsert por chunk_id) de embeddings na tabela document_embeddings"""
+    
+    def __init__(
+        self,
+        pool: Optional[Any] = None,
+        supabase_url: Optional[str] = SUPABASE_URL,
+        supabase_key: Optional[str] = SUPABASE_SERVICE_KEY,
+        batch_size: int = EMBEDDING_WRITE_BATCH_SIZE
+    ):
+        self.pool = pool  # asyncpg.Pool de OptimizedPrismaClient, quando disponível
+        self.supabase_url = supabase_url
+        self.supabase_key = supabase_key
+        self.batch_size = batch_size
+        self._supabase_client = None
+    
+    @staticmethod
+    def row_id(chunk_id: str) -> str:
+        """ID determinístico por chunk para que reprocessamentos sejam idempotentes"""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"document_embeddings/{chunk_id}"))
+    
+    async def upsert(
+        self,
+        document_id: str,
+        organization_id: Optional[str],
+        embeddings: List[Dict[str, Any]]
+    ) -> int:
+        """Grava embeddings em lotes de `batch_size` linhas"""
+        written = 0
+        
+        for start in range(0, len(embeddings), self.batch_size):
+            batch = embeddings[start:start + self.batch_size]
+            
+            if self.pool is not None:
+                await self._upsert_postgres(document_id, organization_id, batch)
+            else:
+                await asyncio.to_thread(self._upsert_supabase, document_id, organization_id, batch)
+            
+            written += len(batch)
+        
+        return written
+    
+    async def _upsert_postgres(self, document_id: str, organization_id: Optional[str], batch: List[Dict[str, Any]]):
+        """Upsert multi-linha via unnest em uma única query"""
+        async with self.pool.acquire() as connection:
+            await connection.execute(
+                UPSERT_EMBEDDINGS_SQL,
+                document_id,
+                organization_id,
+                [self.row_id(e["chunk_id"]) for e in batch],
+                [e["chunk_id"] for e in batch],
+                [e["content"] for e in batch],
+                [json.dumps(e["embedding"]) for e in batch],
+                [e["position"] for e in batch]
+            )
+    
+    def _upsert_supabase(self, document_id: str, organization_id: Optional[str], batch: List[Dict[str, Any]]):
+        """Fallback: upsert multi-linha via PostgREST (executado fora do event loop)"""
+        if self._supabase_client is None:
+            from supabase import create_client
+            self._supabase_client = create_client(self.supabase_url, self.supabase_key)
+        
+        created_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {
+                "id": self.row_id(e["chunk_id"]),
+                "document_id": document_id,
+                "organization_id": organization_id,
+                "chunk_id": e["chunk_id"],
+                "content": e["content"],
+                "embedding": e["embedding"],
+                "position": e["position"],
+                "created_at": created_at
+            }
+            for e in batch
+        ]
+        
+        self._supabase_client.table("document_embeddings").upsert(rows, on_conflict="chunk_id").execute()
@@ -0,0 +1,119 @@
+"""
+Agendamento de tasks recorrentes
+Expressões cron (5 campos, UTC) usadas pelas schedules do BackgroundTaskManager
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Set
+
+# Atalhos suportados
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+# (mínimo, máximo) de cada campo: minuto, hora, dia do mês, mês, dia da semana (0 e 7 = domingo)
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+# Limite de busca da próxima execução (expressões impossíveis, ex.: 30 de fevereiro)
+CRON_MAX_LOOKAHEAD_DAYS = 366 * 5
+
+class CronError(ValueError):
+    """Expressão cron inválida"""
+
+def _parse_field(value: str, minimum: int, maximum: int) -> Set[int]:
+    """Converte um campo cron (*, */n, a-b, a-b/n, listas) no conjunto de valores"""
+    values = set()
+    
+    for part in value.split(","):
+        step = 1
+        if "/" in part:
+            part, step_value = part.split("/", 1)
+            try:
+                step = int(step_value)
+            except ValueError:
+                raise CronError(f"Passo inválido: {step_value}")
+            if step <= 0:
+                raise CronError(f"Passo inválido: {step_value}")
+        
+        if part == "*":
+            start, end = minimum, maximum
+        elif "-" in part:
+            start_value, end_value = part.split("-", 1)
+            try:
+                start, end = int(start_value), int(end_value)
+            except ValueError:
+                raise CronError(f"Intervalo inválido: {part}")
+        else:
+            try:
+                start = int(part)
+            except ValueError:
+                raise CronError(f"Valor inválido: {part}")
+            end = maximum if step > 1 else start
+        
+        if start < minimum or end > maximum or start > end:
+            raise CronError(f"Valor fora do intervalo {minimum}-{maximum}: {part}")
+        
+        values.update(range(start, end + 1, step))
+    
+    return values
+
+class CronExpression:
+    """Expressão cron de 5 campos avaliada em UTC"""
+    
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = CRON_ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise CronError(f"Expressão cron deve ter 5 campos: {expression}")
+        
+        parsed: List[Set[int]] = [
+            _parse_field(field, minimum, maximum)
+            for field, (minimum, maximum) in zip(fields, CRON_FIELD_RANGES)
+        ]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        
+        # Semântica cron: com dia do mês e dia da semana restritos, basta um dos dois
+        self._days_restricted = fields[2] != "*"
+        self._weekdays_restricted = fields[4] != "*"
+    
+    def _day_matches(self, dt: datetime) -> bool:
+        weekday = (dt.weekday() + 1) % 7  # datetime: segunda = 0; cron: domingo = 0
+        day_ok = dt.day in self.days
+        weekday_ok = weekday in self.weekdays
+        
+        if self._days_restricted and self._weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+    
+    def next_after(self, after: datetime) -> datetime:
+        """Próxima execução estritamente depois de `after`"""
+        if after.tzinfo is None:
+            after = after.replace(tzinfo=timezone.utc)
+        
+        dt = after.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=CRON_MAX_LOOKAHEAD_DAYS)
+        
+        while dt < limit:
+            if dt.month not in self.months:
+                # Pular para o primeiro dia do próximo mês
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+        
+        raise CronError(f"Expressão cron sem próxima execução: {self.expression}")
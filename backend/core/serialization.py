@@ -0,0 +1,210 @@
+"""
+Serialização de payloads das filas (tasks e webhooks)
+JSON legado, orjson ou msgpack, com compressão opcional (zstd/zlib) e header de versão
+"""
+
+import json
+import zlib
+import os
+import logging
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel
+
+# Configurações
+SERIALIZER_FORMAT = os.getenv("TASK_SERIALIZER", "json")  # json | orjson | msgpack
+SERIALIZER_COMPRESSION = os.getenv("TASK_SERIALIZER_COMPRESSION", "none")  # none | zstd | zlib
+SERIALIZER_COMPRESS_MIN_SIZE = int(os.getenv("TASK_SERIALIZER_COMPRESS_MIN_SIZE", "1024"))  # bytes
+SERIALIZER_COMPRESSION_LEVEL = 3
+
+# Header: magic (2 bytes) + versão + formato + compressão. JSON legado não tem header
+# (nunca começa com \x00), então payloads antigos e novos convivem nas mesmas filas
+SERIALIZATION_MAGIC = b"\x00S"
+SERIALIZATION_VERSION = 1
+HEADER_SIZE = len(SERIALIZATION_MAGIC) + 3
+
+FORMAT_IDS = {"orjson": 1, "msgpack": 2}
+COMPRESSION_IDS = {"none": 0, "zstd": 1, "zlib": 2}
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+# Dependências opcionais
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class SerializationError(ValueError):
+    """Payload com header desconhecido ou codec indisponível"""
+
+def _default(value: Any) -> Any:
+    """Tipos não nativos dos codecs (datetime em ISO 8601, como no pydantic)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+class Serializer:
+    """Codifica/decodifica payloads das filas; lê qualquer formato, escreve o configurado"""
+    
+    def __init__(
+        self,
+        format: str = SERIALIZER_FORMAT,
+        compression: str = SERIALIZER_COMPRESSION,
+        compress_min_size: int = SERIALIZER_COMPRESS_MIN_SIZE,
+        compression_level: int = SERIALIZER_COMPRESSION_LEVEL
+    ):
+        format = (format or "json").lower()
+        compression = (compression or "none").lower()
+        
+        # Sem a biblioteca instalada, cai para o JSON legado/zlib em vez de quebrar o worker
+        if format not in ("json", *FORMAT_IDS):
+            logger.warning(f"Serializer desconhecido ({format}), usando json")
+            format = "json"
+        if format == "orjson" and orjson is None:
+            logger.warning("orjson não instalado, usando json")
+            format = "json"
+        if format == "msgpack" and msgpack is None:
+            logger.warning("msgpack não instalado, usando json")
+            format = "json"
+        if compression not in COMPRESSION_IDS:
+            logger.warning(f"Compressão desconhecida ({compression}), desativada")
+            compression = "none"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard não instalado, usando zlib")
+            compression = "zlib"
+        
+        self.format = format
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.compression_level = compression_level
+        self._zstd_compressor = (
+            zstandard.ZstdCompressor(level=compression_level) if compression == "zstd" else None
+        )
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+    
+    @property
+    def is_legacy(self) -> bool:
+        """JSON sem header: legível por workers de versões anteriores"""
+        return self.format == "json" and self.compression == "none"
+    
+    # =========================================
+    # ESCRITA
+    # =========================================
+    
+    def dumps(self, obj: Any) -> bytes:
+        """Serializa dicts/listas/valores simples"""
+        if self.format == "json":
+            body = json.dumps(obj, default=_default).encode("utf-8")
+        else:
+            body = self._encode(obj)
+        return self._frame(body)
+    
+    def dumps_model(self, model: BaseModel) -> bytes:
+        """Serializa um model pydantic"""
+        if self.format == "json":
+            body = model.model_dump_json().encode("utf-8")
+        else:
+            body = self._encode(model.model_dump())
+        return self._frame(body)
+    
+    def _encode(self, obj: Any) -> bytes:
+        if self.format == "orjson":
+            return orjson.dumps(obj, default=_default)
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    
+    def _frame(self, body: bytes) -> bytes:
+        if self.is_legacy:
+            return body
+        
+        compression = self.compression
+        if compression != "none" and len(body) >= self.compress_min_size:
+            if compression == "zstd":
+                body = self._zstd_compressor.compress(body)
+            else:
+                body = zlib.compress(body, self.compression_level)
+        else:
+            compression = "none"
+        
+        header = SERIALIZATION_MAGIC + bytes([
+            SERIALIZATION_VERSION,
+            FORMAT_IDS.get(self.format, 0),
+            COMPRESSION_IDS[compression]
+        ])
+        return header + body
+    
+    # =========================================
+    # LEITURA
+    # =========================================
+    
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """Desserializa payload em qualquer formato suportado"""
+        format_id, body = self._unframe(data)
+        if format_id == 0:
+            return orjson.loads(body) if orjson else json.loads(body)
+        return self._decode(format_id, body)
+    
+    def loads_model(self, model_cls: Type[M], data: Union[bytes, str]) -> M:
+        """Desserializa e valida um model pydantic"""
+        format_id, body = self._unframe(data)
+        if format_id in (0, FORMAT_IDS["orjson"]):
+            # O corpo é JSON: validação direto dos bytes (pydantic-core), sem dict intermediário
+            return model_cls.model_validate_json(body)
+        return model_cls.model_validate(self._decode(format_id, body))
+    
+    def _unframe(self, data: Union[bytes, str]):
+        """(formato, corpo descomprimido); JSON legado tem formato 0"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not data.startswith(SERIALIZATION_MAGIC):
+            return 0, data
+        
+        if len(data) < HEADER_SIZE:
+            raise SerializationError("Header de serialização truncado")
+        
+        version, format_id, compression_id = data[2], data[3], data[4]
+        if version > SERIALIZATION_VERSION:
+            raise SerializationError(f"Versão de serialização não suportada: {version}")
+        
+        body = data[HEADER_SIZE:]
+        if compression_id == COMPRESSION_IDS["zstd"]:
+            if self._zstd_decompressor is None:
+                raise SerializationError("Payload zstd recebido sem zstandard instalado")
+            body = self._zstd_decompressor.decompress(body)
+        elif compression_id == COMPRESSION_IDS["zlib"]:
+            body = zlib.decompress(body)
+        elif compression_id != COMPRESSION_IDS["none"]:
+            raise SerializationError(f"Compressão desconhecida: {compression_id}")
+        
+        return format_id, body
+    
+    def _decode(self, format_id: int, body: bytes) -> Any:
+        if format_id == FORMAT_IDS["orjson"]:
+            return orjson.loads(body) if orjson else json.loads(body)
+        if format_id == FORMAT_IDS["msgpack"]:
+            if msgpack is None:
+                raise SerializationError("Payload msgpack recebido sem msgpack instalado")
+            return msgpack.unpackb(body, raw=False)
+        raise SerializationError(f"Formato de serialização desconhecido: {format_id}")
+
+def create_serializer(format: Optional[str] = None, compression: Optional[str] = None) -> Serializer:
+    """Serializer configurado por TASK_SERIALIZER / TASK_SERIALIZER_COMPRESSION"""
+    return Serializer(
+        format=format or SERIALIZER_FORMAT,
+        compression=compression or SERIALIZER_COMPRESSION
+    )
@@ -8,6 +8,8 @@ import json
 import hmac
 import hashlib
 import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, List, Union, Callable
 from enum import Enum
@@ -19,8 +21,13 @@ import httpx
 import redis.asyncio as redis
 from pydantic import BaseModel, Field, HttpUrl
 from supabase import create_client, Client
+from postgrest import AsyncPostgrestClient
+from postgrest.types import ReturnMethod
 import os
 
+from .serialization import create_serializer
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, is_failure_status
+
 # Configuração
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
@@ -28,6 +35,21 @@ SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 N8N_BASE_URL = os.getenv("N8N_WEBHOOK_URL", "https://primary-em-atividade.up.railway.app")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "your-webhook-secret-key")
 API_BASE_URL = os.getenv("API_BASE_URL", "https://api.agentesdeconversao.com.br")
+WEBHOOK_SERIALIZER = os.getenv("WEBHOOK_SERIALIZER")  # json | orjson | msgpack; padrão: TASK_SERIALIZER
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))  # requisições simultâneas (todas as entregas)
+WEBHOOK_MAX_PER_HOST = int(os.getenv("WEBHOOK_MAX_PER_HOST", "10"))  # requisições simultâneas por host de destino
+WEBHOOK_DELIVERY_RETRY_KEY = "webhook_delivery_retry"  # ZSET "<event_id>|<destino>" -> próximo retry (timestamp)
+WEBHOOK_DELIVERY_STATE_TTL = int(os.getenv("WEBHOOK_DELIVERY_STATE_TTL", str(7 * 86400)))  # seconds
+WEBHOOK_DELIVERY_RETRY_BATCH = 100
+N8N_TARGET = "n8n"  # destino N8N no estado das entregas (demais destinos: id do endpoint)
+EVENT_LOGIC_TARGET = "_event_logic"  # lógica interna do evento já executada
+WEBHOOK_ENDPOINT_CACHE_TTL = int(os.getenv("WEBHOOK_ENDPOINT_CACHE_TTL", "300"))  # seconds - recarga completa do índice
+WEBHOOK_ENDPOINT_CACHE_RETRY = 30  # seconds - nova tentativa após falha ao carregar o índice
+WEBHOOK_ENDPOINTS_CHANNEL = "webhook_endpoints:invalidate"  # pub/sub de alterações de endpoints
+WEBHOOK_WRITE_BATCH_SIZE = int(os.getenv("WEBHOOK_WRITE_BATCH_SIZE", "100"))  # linhas por escrita em lote
+WEBHOOK_WRITE_FLUSH_INTERVAL = float(os.getenv("WEBHOOK_WRITE_FLUSH_INTERVAL", "1.0"))  # seconds
+WEBHOOK_WRITE_BUFFER_MAX = int(os.getenv("WEBHOOK_WRITE_BUFFER_MAX", "10000"))  # registros pendentes antes de bloquear
+WEBHOOK_RESULT_TTL = 86400  # 24 hours
 
 # Logger configurado
 logging.basicConfig(level=logging.INFO)
@@ -109,7 +131,6 @@ class WebhookPayload(BaseModel):
     data: Dict[str, Any]
     user_id: Optional[str] = None
     organization_id: Optional[str] = None
-    retry_count: int = 0
     signature: Optional[str] = None
 
 class WebhookEndpoint(BaseModel):
@@ -236,6 +257,186 @@ class N8NClient:
         """Fecha o cliente HTTP"""
         await self.client.aclose()
 
+# =========================================
+# PERSISTÊNCIA EM LOTE (WRITE-BEHIND)
+# =========================================
+
+class WebhookWriteBuffer:
+    """Buffer em memória dos registros de webhooks, gravados em lote fora do caminho de entrega"""
+    
+    def __init__(
+        self,
+        batch_size: int = WEBHOOK_WRITE_BATCH_SIZE,
+        flush_interval: float = WEBHOOK_WRITE_FLUSH_INTERVAL,
+        max_size: int = WEBHOOK_WRITE_BUFFER_MAX
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.db: Optional[AsyncPostgrestClient] = None
+        self.redis_client: Optional[redis.Redis] = None
+        
+        self.deliveries: List[Dict[str, Any]] = []
+        self.statuses: Dict[str, Dict[str, Any]] = {}  # event_id -> último status (coalescido)
+        self.results: Dict[str, Dict[str, Any]] = {}  # event_id -> último resultado (coalescido)
+        
+        self._space = asyncio.Condition()
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._closing = False
+    
+    def start(self, db: Optional[AsyncPostgrestClient], redis_client: Optional[redis.Redis]):
+        """Inicia o flush periódico"""
+        self.db = db
+        self.redis_client = redis_client
+        self._closing = False
+        self._flusher_task = asyncio.create_task(self._flush_loop())
+    
+    @property
+    def running(self) -> bool:
+        return self._flusher_task is not None and not self._flusher_task.done()
+    
+    def __len__(self) -> int:
+        return len(self.deliveries) + len(self.statuses) + len(self.results)
+    
+    async def _put(self, add: Callable[[], None]):
+        """Enfileira um registro; com o buffer cheio, aguarda o próximo flush (backpressure)"""
+        async with self._space:
+            if self.running:
+                await self._space.wait_for(lambda: len(self) < self.max_size or not self.running)
+            add()
+        
+        if not self.running:
+            # Sem flusher (worker não inicializado): grava na hora
+            await self.flush()
+        elif len(self) >= self.batch_size:
+            self._flush_requested.set()
+    
+    async def add_delivery(self, row: Dict[str, Any]):
+        if self.db:
+            await self._put(lambda: self.deliveries.append(row))
+    
+    async def add_status(self, event_id: str, row: Dict[str, Any]):
+        if self.db:
+            await self._put(lambda: self.statuses.__setitem__(event_id, row))
+    
+    async def add_result(self, event_id: str, result: Dict[str, Any]):
+        if self.redis_client:
+            await self._put(lambda: self.results.__setitem__(event_id, result))
+    
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+    
+    async def flush(self):
+        """Grava tudo que está no buffer: deliveries em INSERT multi-linha, status por grupo, resultados em pipeline"""
+        async with self._flush_lock:
+            deliveries, self.deliveries = self.deliveries, []
+            statuses, self.statuses = self.statuses, {}
+            results, self.results = self.results, {}
+            
+            async with self._space:
+                self._space.notify_all()
+            
+            if deliveries:
+                await self._write_deliveries(deliveries)
+            if statuses:
+                await self._write_statuses(statuses)
+            if results:
+                await self._write_results(results)
+    
+    async def _write_deliveries(self, rows: List[Dict[str, Any]]):
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            try:
+                await self.db.table("webhook_deliveries").insert(batch, returning=ReturnMethod.minimal).execute()
+            except Exception as e:
+                if len(batch) == 1:
+                    logger.error(f"Erro ao salvar registro de delivery {batch[0].get('id')}: {e}")
+                    continue
+                # O PostgREST rejeita o lote inteiro por uma linha inválida: regravar linha a linha
+                logger.warning(f"Erro ao salvar {len(batch)} registros de delivery, gravando um a um: {e}")
+                await self._write_deliveries_individually(batch)
+    
+    async def _write_deliveries_individually(self, rows: List[Dict[str, Any]]):
+        failed = 0
+        for row in rows:
+            try:
+                await self.db.table("webhook_deliveries").insert(row, returning=ReturnMethod.minimal).execute()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Erro ao salvar registro de delivery {row.get('id')}: {e}")
+        if failed:
+            logger.error(f"{failed} de {len(rows)} registros de delivery descartados")
+    
+    async def _write_statuses(self, statuses: Dict[str, Dict[str, Any]]):
+        # Um UPDATE ... WHERE id IN (...) por combinação (status, erro)
+        groups: Dict[tuple, List[str]] = {}
+        processed_at: Dict[tuple, str] = {}
+        for event_id, row in statuses.items():
+            group = (row["status"], row.get("error_message"))
+            groups.setdefault(group, []).append(event_id)
+            processed_at[group] = max(processed_at.get(group, ""), row["processed_at"])
+        
+        for (status, error_message), event_ids in groups.items():
+            update_data = {"status": status, "processed_at": processed_at[(status, error_message)]}
+            if error_message:
+                update_data["error_message"] = error_message
+            
+            for start in range(0, len(event_ids), self.batch_size):
+                batch = event_ids[start:start + self.batch_size]
+                try:
+                    await self.db.table("webhook_events").update(
+                        update_data, returning=ReturnMethod.minimal
+                    ).in_("id", batch).execute()
+                except Exception as e:
+                    if len(batch) == 1:
+                        logger.error(f"Erro ao atualizar status do evento {batch[0]}: {e}")
+                        continue
+                    logger.warning(f"Erro ao atualizar status de {len(batch)} eventos, atualizando um a um: {e}")
+                    await self._write_statuses_individually(update_data, batch)
+    
+    async def _write_statuses_individually(self, update_data: Dict[str, Any], event_ids: List[str]):
+        failed = 0
+        for event_id in event_ids:
+            try:
+                await self.db.table("webhook_events").update(
+                    update_data, returning=ReturnMethod.minimal
+                ).eq("id", event_id).execute()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Erro ao atualizar status do evento {event_id}: {e}")
+        if failed:
+            logger.error(f"Status de {failed} de {len(event_ids)} eventos não atualizado")
+    
+    async def _write_results(self, results: Dict[str, Dict[str, Any]]):
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for event_id, result in results.items():
+                pipe.setex(f"webhook_result:{event_id}", WEBHOOK_RESULT_TTL, json.dumps(result, default=str))
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Erro ao salvar resultado de {len(results)} eventos: {e}")
+    
+    async def close(self):
+        """Para o flush periódico e grava o que restou no buffer"""
+        if self._flusher_task:
+            # Sem cancelar: um lote em gravação não pode ser perdido
+            self._closing = True
+            self._flush_requested.set()
+            await self._flusher_task
+            self._flusher_task = None
+        
+        async with self._space:
+            self._space.notify_all()
+        await self.flush()
+
 # =========================================
 # WEBHOOK MANAGER PRINCIPAL
 # =========================================
@@ -248,9 +449,22 @@ class WebhookManager:
         self.supabase_client: Optional[Client] = None
         self.n8n_client: Optional[N8NClient] = None
         self.signer = WebhookSigner(WEBHOOK_SECRET)
-        self.http_client = httpx.AsyncClient(timeout=30.0)
+        self.http_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=WEBHOOK_MAX_IN_FLIGHT)
+        )
         self.processing_tasks: Dict[str, asyncio.Task] = {}
-        
+        self.serializer = create_serializer(WEBHOOK_SERIALIZER)
+        self.delivery_semaphore = asyncio.Semaphore(WEBHOOK_MAX_IN_FLIGHT)
+        self.host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.endpoint_index: Dict[WebhookEventType, Dict[str, WebhookEndpoint]] = {}
+        self._endpoint_index_expires_at = 0.0  # time.monotonic()
+        self._endpoint_index_lock = asyncio.Lock()
+        self._endpoint_listener_task: Optional[asyncio.Task] = None
+        self.supabase_async: Optional[AsyncPostgrestClient] = None
+        self.write_buffer = WebhookWriteBuffer()
+        self.circuit_breaker = CircuitBreaker()
+    
     async def initialize(self):
         """Inicializa o gerenciador"""
         try:
@@ -258,19 +472,39 @@ class WebhookManager:
             if REDIS_URL:
                 self.redis_client = redis.from_url(REDIS_URL)
                 await self.redis_client.ping()
+                self.circuit_breaker.redis_client = self.redis_client
                 logger.info("Redis conectado com sucesso")
             
             # Conectar ao Supabase
             if SUPABASE_URL and SUPABASE_SERVICE_KEY:
                 self.supabase_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
                 logger.info("Supabase conectado com sucesso")
+                
+                # Cliente PostgREST assíncrono para as escritas em lote
+                self.supabase_async = AsyncPostgrestClient(
+                    f"{SUPABASE_URL}/rest/v1",
+                    headers={
+                        "apikey": SUPABASE_SERVICE_KEY,
+                        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+                        "Accept": "application/json",
+                        "Content-Type": "application/json"
+                    }
+                )
+            
+            self.write_buffer.start(self.supabase_async, self.redis_client)
             
             # Inicializar cliente N8N
             self.n8n_client = N8NClient(N8N_BASE_URL)
             logger.info("N8N client inicializado")
             
-            logger.info("WebhookManager inicializado com sucesso")
+            # Índice de assinaturas em memória, atualizado via pub/sub
+            if self.supabase_client:
+                await self._load_endpoint_index()
+                if self.redis_client:
+                    self._endpoint_listener_task = asyncio.create_task(self._endpoint_invalidation_listener())
             
+            logger.info("WebhookManager inicializado com sucesso")
+        
         except Exception as e:
             logger.error(f"Erro ao inicializar WebhookManager: {e}")
             raise
@@ -311,14 +545,14 @@ class WebhookManager:
                     "created_at": datetime.now(timezone.utc).isoformat()
                 }
                 
-                result = self.supabase_client.table("webhook_events").insert(event_record).execute()
+                await self._insert_event_record(event_record)
                 logger.info(f"Evento criado no Supabase: {event_id}")
             
             # Adicionar à fila de processamento
             if self.redis_client:
                 await self.redis_client.lpush(
                     "webhook_queue:high" if self._is_high_priority(event_type) else "webhook_queue:normal",
-                    payload.model_dump_json()
+                    self.serializer.dumps_model(payload)
                 )
                 logger.info(f"Evento adicionado à fila: {event_id}")
             
@@ -332,6 +566,18 @@ class WebhookManager:
             logger.error(f"Erro ao criar evento de webhook: {e}")
             raise
     
+    async def _insert_event_record(self, event_record: Dict[str, Any]):
+        """Grava o evento antes de enfileirá-lo, sem bloquear o event loop"""
+        if self.supabase_async:
+            await self.supabase_async.table("webhook_events").insert(
+                event_record, returning=ReturnMethod.minimal
+            ).execute()
+        else:
+            # Cliente síncrono (supabase-py): fora do event loop
+            await asyncio.to_thread(
+                lambda: self.supabase_client.table("webhook_events").insert(event_record).execute()
+            )
+    
     def _is_high_priority(self, event_type: WebhookEventType) -> bool:
         """Determina se um evento é de alta prioridade"""
         high_priority_events = {
@@ -350,53 +596,125 @@ class WebhookManager:
             # Atualizar status para processando
             await self._update_event_status(payload.event_id, WebhookEventStatus.PROCESSING)
             
-            # Enviar para N8N se aplicável
-            n8n_result = None
-            if self.n8n_client:
-                n8n_result = await self.n8n_client.send_webhook(payload.event_type, payload.data)
+            # Estado por destino: no reprocessamento do evento só vai o que ainda não foi tentado
+            states = await self._get_delivery_states(payload.event_id)
+            await self._save_event_payload(payload)
             
             # Buscar endpoints configurados
             endpoints = await self._get_active_endpoints_for_event(payload.event_type)
             
-            # Enviar para cada endpoint
-            delivery_results = []
-            for endpoint in endpoints:
-                delivery = await self._deliver_webhook(payload, endpoint)
-                delivery_results.append(delivery)
-            
-            # Processar lógica específica do evento
-            await self._handle_event_logic(payload)
-            
-            # Atualizar status final
-            all_successful = all(
-                delivery.status == WebhookDeliveryStatus.SUCCESS 
-                for delivery in delivery_results
-            )
+            # N8N e endpoints em paralelo: um assinante lento não atrasa os demais
+            # Cada entrega registra o próprio resultado e agenda o próprio retry
+            attempts = [
+                self._attempt_endpoint(payload, endpoint, attempt=1)
+                for endpoint in endpoints if endpoint.id not in states
+            ]
+            if N8N_TARGET not in states:
+                attempts.append(self._attempt_n8n(payload, attempt=1))
+            await asyncio.gather(*attempts)
             
-            final_status = WebhookEventStatus.COMPLETED if all_successful else WebhookEventStatus.FAILED
-            await self._update_event_status(payload.event_id, final_status)
-            
-            # Salvar resultados
-            event_result = {
-                "n8n_result": n8n_result,
-                "deliveries": len(delivery_results),
-                "successful_deliveries": sum(1 for d in delivery_results if d.status == WebhookDeliveryStatus.SUCCESS),
-                "processed_at": datetime.now(timezone.utc).isoformat()
-            }
-            
-            await self._save_event_result(payload.event_id, event_result)
-            
-            logger.info(f"Evento processado com sucesso: {payload.event_id}")
+            # Processar lógica específica do evento (uma vez por evento)
+            if EVENT_LOGIC_TARGET not in states:
+                await self._handle_event_logic(payload)
+                await self._set_delivery_state(
+                    payload.event_id, EVENT_LOGIC_TARGET, {"status": WebhookDeliveryStatus.SUCCESS.value}
+                )
             
+            final_status = await self._finish_event(payload.event_id)
+            logger.info(f"Evento processado: {payload.event_id} ({final_status.value})")
+        
         except Exception as e:
+            # Entregas já tentadas seguem com o próprio retry (webhook_delivery_retry)
             logger.error(f"Erro ao processar evento {payload.event_id}: {e}")
             await self._update_event_status(payload.event_id, WebhookEventStatus.FAILED, str(e))
-            
-            # Verificar se deve tentar novamente
-            if payload.retry_count < 3:
-                await self._schedule_retry(payload)
     
-    async def _deliver_webhook(self, payload: WebhookPayload, endpoint: WebhookEndpoint) -> WebhookDelivery:
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Semáforo do host de destino (criado no primeiro uso)"""
+        host = urlparse(url).netloc.lower()
+        semaphore = self.host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self.host_semaphores[host] = asyncio.Semaphore(WEBHOOK_MAX_PER_HOST)
+        return semaphore
+    
+    @asynccontextmanager
+    async def _delivery_slot(self, url: str):
+        """Vaga no host de destino e no limite global de requisições em andamento"""
+        # Host primeiro: aguardar um host saturado não ocupa vaga global
+        async with self._host_semaphore(url):
+            async with self.delivery_semaphore:
+                yield
+    
+    async def _send_to_n8n(self, payload: WebhookPayload) -> Optional[Dict[str, Any]]:
+        """Envia o evento para o N8N respeitando os limites de concorrência"""
+        if not self.n8n_client:
+            return None
+        
+        try:
+            async with self._delivery_slot(self.n8n_client.base_url):
+                return await self.n8n_client.send_webhook(payload.event_type, payload.data)
+        except Exception as e:
+            logger.error(f"Erro ao enviar evento {payload.event_id} para N8N: {e}")
+            return {"status": "failed", "error": str(e)}
+    
+    async def _deliver_limited(self, payload: WebhookPayload, endpoint: WebhookEndpoint,
+                               attempt: int = 1) -> WebhookDelivery:
+        """Entrega para um endpoint respeitando o circuit breaker e os limites global e por host"""
+        url = str(endpoint.url)
+        
+        # Circuito aberto: CircuitOpenError antes de ocupar vaga; probe de half-open usa o timeout cheio
+        probe = await self.circuit_breaker.check(url)
+        policy_timeout = endpoint.retry_policy.timeout
+        timeout = policy_timeout if probe else await self.circuit_breaker.timeout_for(url, policy_timeout)
+        
+        async with self._delivery_slot(url):
+            delivery = await self._deliver_webhook(payload, endpoint, attempt, timeout=timeout)
+        
+        timed_out = delivery.status == WebhookDeliveryStatus.TIMEOUT
+        await self.circuit_breaker.record(
+            url,
+            success=not timed_out and not is_failure_status(delivery.status_code),
+            latency_ms=delivery.delivery_duration_ms if timed_out or delivery.status_code is not None else None
+        )
+        return delivery
+    
+    async def _attempt_n8n(self, payload: WebhookPayload, attempt: int) -> Optional[Dict[str, Any]]:
+        """Envia ao N8N e registra o resultado (com retry próprio) no estado das entregas"""
+        result = await self._send_to_n8n(payload)
+        if result is None or result.get("status") == "skipped":
+            return result
+        
+        await self._record_delivery_outcome(
+            payload.event_id, N8N_TARGET, WebhookRetryPolicy(), attempt,
+            success=result.get("status") == "success",
+            status_code=result.get("status_code"),
+            error=result.get("error") or (None if result.get("status") == "success" else result.get("response"))
+        )
+        return result
+    
+    async def _attempt_endpoint(self, payload: WebhookPayload, endpoint: WebhookEndpoint,
+                                attempt: int) -> Optional[WebhookDelivery]:
+        """Entrega a um endpoint e registra o resultado (com retry pela política do endpoint)"""
+        try:
+            delivery = await self._deliver_limited(payload, endpoint, attempt)
+        except CircuitOpenError as e:
+            # Sem requisição nem registro de delivery: direto para o retry, não antes do próximo probe
+            await self._record_delivery_outcome(
+                payload.event_id, endpoint.id, endpoint.retry_policy, attempt,
+                success=False, error=str(e), retry_after=e.retry_after
+            )
+            return None
+        
+        success = delivery.status == WebhookDeliveryStatus.SUCCESS
+        await self._record_delivery_outcome(
+            payload.event_id, endpoint.id, endpoint.retry_policy, attempt,
+            success=success,
+            status_code=delivery.status_code,
+            error=None if success else (delivery.error_message or f"HTTP {delivery.status_code}")
+        )
+        return delivery
+    
+    async def _deliver_webhook(self, payload: WebhookPayload, endpoint: WebhookEndpoint,
+                               attempt: int = 1, timeout: Optional[float] = None) -> WebhookDelivery:
         """Entrega webhook para um endpoint específico"""
         delivery_id = str(uuid.uuid4())
         start_time = datetime.now(timezone.utc)
@@ -438,7 +756,7 @@ class WebhookManager:
                 str(endpoint.url),
                 content=webhook_body,
                 headers=headers,
-                timeout=endpoint.retry_policy.timeout
+                timeout=timeout or endpoint.retry_policy.timeout
             )
             
             end_time = datetime.now(timezone.utc)
@@ -454,6 +772,7 @@ class WebhookManager:
                 response_body=response.text[:1000] if response.text else None,
                 response_headers=dict(response.headers),
                 delivery_duration_ms=duration_ms,
+                attempt_number=attempt,
                 delivered_at=end_time
             )
             
@@ -474,6 +793,7 @@ class WebhookManager:
                 status=WebhookDeliveryStatus.TIMEOUT,
                 error_message="Request timeout",
                 delivery_duration_ms=duration_ms,
+                attempt_number=attempt,
                 delivered_at=end_time
             )
             
@@ -492,6 +812,7 @@ class WebhookManager:
                 status=WebhookDeliveryStatus.FAILED,
                 error_message=str(e),
                 delivery_duration_ms=duration_ms,
+                attempt_number=attempt,
                 delivered_at=end_time
             )
             
@@ -634,104 +955,359 @@ class WebhookManager:
         status: WebhookEventStatus,
         error_message: Optional[str] = None
     ):
-        """Atualiza status de um evento"""
-        if self.supabase_client:
-            try:
-                update_data = {
-                    "status": status.value,
-                    "processed_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                if error_message:
-                    update_data["error_message"] = error_message
-                
-                self.supabase_client.table("webhook_events").update(update_data).eq("id", event_id).execute()
-                
-            except Exception as e:
-                logger.error(f"Erro ao atualizar status do evento {event_id}: {e}")
+        """Atualiza status de um evento (gravado em lote pelo write buffer)"""
+        update_data = {
+            "status": status.value,
+            "processed_at": datetime.now(timezone.utc).isoformat()
+        }
+        
+        if error_message:
+            update_data["error_message"] = error_message
+        
+        await self.write_buffer.add_status(event_id, update_data)
     
     async def _save_event_result(self, event_id: str, result: Dict[str, Any]):
-        """Salva resultado do processamento de evento"""
-        if self.redis_client:
-            try:
-                await self.redis_client.setex(
-                    f"webhook_result:{event_id}",
-                    86400,  # 24 hours
-                    json.dumps(result, default=str)
-                )
-            except Exception as e:
-                logger.error(f"Erro ao salvar resultado do evento {event_id}: {e}")
+        """Salva resultado do processamento de evento (gravado em lote pelo write buffer)"""
+        await self.write_buffer.add_result(event_id, result)
     
     async def _save_delivery_record(self, delivery: WebhookDelivery):
-        """Salva registro de delivery no Supabase"""
-        if self.supabase_client:
-            try:
-                delivery_data = {
-                    "id": delivery.id,
-                    "webhook_event_id": delivery.webhook_event_id,
-                    "webhook_endpoint_id": delivery.webhook_endpoint_id,
-                    "status_code": delivery.status_code,
-                    "response_body": delivery.response_body,
-                    "response_headers": delivery.response_headers,
-                    "delivery_duration_ms": delivery.delivery_duration_ms,
-                    "attempt_number": delivery.attempt_number,
-                    "delivered_at": delivery.delivered_at.isoformat(),
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                self.supabase_client.table("webhook_deliveries").insert(delivery_data).execute()
-                
-            except Exception as e:
-                logger.error(f"Erro ao salvar registro de delivery: {e}")
+        """Salva registro de delivery no Supabase (gravado em lote pelo write buffer)"""
+        delivery_data = {
+            "id": delivery.id,
+            "webhook_event_id": delivery.webhook_event_id,
+            "webhook_endpoint_id": delivery.webhook_endpoint_id,
+            "status_code": delivery.status_code,
+            "response_body": delivery.response_body,
+            "response_headers": delivery.response_headers,
+            "delivery_duration_ms": delivery.delivery_duration_ms,
+            "attempt_number": delivery.attempt_number,
+            "delivered_at": delivery.delivered_at.isoformat(),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        
+        await self.write_buffer.add_delivery(delivery_data)
+    
+    # =========================================
+    # ÍNDICE DE ASSINATURAS (EVENTO -> ENDPOINTS)
+    # =========================================
     
     async def _get_active_endpoints_for_event(self, event_type: WebhookEventType) -> List[WebhookEndpoint]:
-        """Busca endpoints ativos que escutam este evento"""
+        """Busca endpoints ativos que escutam este evento (índice em memória)"""
         if not self.supabase_client:
             return []
         
+        # Fallback de staleness: recarga completa se o pub/sub perdeu alguma alteração
+        if time.monotonic() >= self._endpoint_index_expires_at:
+            async with self._endpoint_index_lock:
+                if time.monotonic() >= self._endpoint_index_expires_at:
+                    await self._load_endpoint_index()
+        
+        return list(self.endpoint_index.get(event_type, {}).values())
+    
+    def _endpoint_from_row(self, row: Dict[str, Any]) -> WebhookEndpoint:
+        known_events = {e.value for e in WebhookEventType}
+        return WebhookEndpoint(
+            id=row["id"],
+            url=row["url"],
+            events=[WebhookEventType(e) for e in row.get("events") or [] if e in known_events],
+            secret=row.get("secret"),
+            is_active=row["is_active"],
+            headers=row.get("headers") or {},
+            retry_policy=self._retry_policy_from_row(row)
+        )
+    
+    def _retry_policy_from_row(self, row: Dict[str, Any]) -> WebhookRetryPolicy:
+        """Política de retry do endpoint (coluna JSONB retry_policy); campos ausentes ou inválidos usam o padrão"""
+        config = row.get("retry_policy") or {}
+        if isinstance(config, str):
+            try:
+                config = json.loads(config)
+            except ValueError:
+                config = {}
+        if not isinstance(config, dict):
+            config = {}
+        
+        defaults = asdict(WebhookRetryPolicy())
+        policy = {}
+        for name, default in defaults.items():
+            try:
+                policy[name] = type(default)(config.get(name, default))
+            except (TypeError, ValueError):
+                logger.warning(f"retry_policy.{name} inválido no endpoint {row.get('id')}, usando {default}")
+                policy[name] = default
+        return WebhookRetryPolicy(**policy)
+    
+    async def _load_endpoint_index(self):
+        """Carrega todos os endpoints ativos do Supabase (fora do event loop)"""
         try:
-            result = self.supabase_client.table("webhook_endpoints").select("*").eq("is_active", True).execute()
+            result = await asyncio.to_thread(
+                lambda: self.supabase_client.table("webhook_endpoints").select("*").eq("is_active", True).execute()
+            )
             
-            endpoints = []
+            index: Dict[WebhookEventType, Dict[str, WebhookEndpoint]] = {}
             for row in result.data:
-                if event_type.value in row.get("events", []):
-                    endpoint = WebhookEndpoint(
-                        id=row["id"],
-                        url=row["url"],
-                        events=[WebhookEventType(e) for e in row["events"]],
-                        secret=row.get("secret"),
-                        is_active=row["is_active"],
-                        headers=row.get("headers", {})
-                    )
-                    endpoints.append(endpoint)
-            
-            return endpoints
+                endpoint = self._endpoint_from_row(row)
+                for event_type in endpoint.events:
+                    index.setdefault(event_type, {})[endpoint.id] = endpoint
             
+            self.endpoint_index = index
+            self._endpoint_index_expires_at = time.monotonic() + WEBHOOK_ENDPOINT_CACHE_TTL
+            logger.info(f"Índice de endpoints carregado: {len(result.data)} endpoints ativos")
+        
         except Exception as e:
-            logger.error(f"Erro ao buscar endpoints para evento {event_type}: {e}")
-            return []
+            # Mantém o índice anterior e tenta de novo em breve
+            self._endpoint_index_expires_at = time.monotonic() + WEBHOOK_ENDPOINT_CACHE_RETRY
+            logger.error(f"Erro ao carregar índice de endpoints: {e}")
+    
+    def _remove_from_index(self, endpoint_id: str):
+        for endpoints in self.endpoint_index.values():
+            endpoints.pop(endpoint_id, None)
+    
+    async def _refresh_endpoint(self, endpoint_id: str):
+        """Atualiza um endpoint no índice a partir do Supabase"""
+        result = await asyncio.to_thread(
+            lambda: self.supabase_client.table("webhook_endpoints").select("*").eq("id", endpoint_id).execute()
+        )
+        
+        self._remove_from_index(endpoint_id)
+        if result.data and result.data[0].get("is_active"):
+            endpoint = self._endpoint_from_row(result.data[0])
+            for event_type in endpoint.events:
+                self.endpoint_index.setdefault(event_type, {})[endpoint.id] = endpoint
+    
+    async def _apply_endpoint_change(self, message: Dict[str, Any]):
+        """Aplica uma invalidação: upsert/delete de um endpoint ou reload completo"""
+        action = message.get("action")
+        endpoint_id = message.get("endpoint_id")
+        
+        if action == "delete" and endpoint_id:
+            self._remove_from_index(endpoint_id)
+        elif action == "upsert" and endpoint_id:
+            await self._refresh_endpoint(endpoint_id)
+        else:
+            async with self._endpoint_index_lock:
+                await self._load_endpoint_index()
+    
+    async def publish_endpoint_change(self, endpoint_id: Optional[str] = None, action: str = "upsert"):
+        """Notifica todas as réplicas de que um endpoint foi criado/alterado/removido"""
+        message = {"action": action, "endpoint_id": endpoint_id}
+        try:
+            if self.redis_client:
+                await self.redis_client.publish(WEBHOOK_ENDPOINTS_CHANNEL, json.dumps(message))
+            elif self.supabase_client:
+                await self._apply_endpoint_change(message)
+        except Exception as e:
+            # A recarga por TTL cobre a invalidação perdida
+            logger.error(f"Erro ao publicar alteração do endpoint {endpoint_id}: {e}")
+    
+    async def _endpoint_invalidation_listener(self):
+        """Escuta o canal de invalidação e atualiza o índice incrementalmente"""
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(WEBHOOK_ENDPOINTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        await self._apply_endpoint_change(json.loads(message["data"]))
+                    except Exception as e:
+                        logger.error(f"Erro ao aplicar invalidação de endpoint: {e}")
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Conexão pub/sub de endpoints perdida: {e}")
+                # Alterações perdidas durante a desconexão: recarregar ao voltar
+                self._endpoint_index_expires_at = 0.0
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+    
+    def get_endpoint_index_stats(self) -> Dict[str, Any]:
+        """Tamanho do índice de assinaturas e tempo até a próxima recarga completa"""
+        endpoint_ids = {endpoint_id for endpoints in self.endpoint_index.values() for endpoint_id in endpoints}
+        return {
+            "endpoints": len(endpoint_ids),
+            "event_types": len([endpoints for endpoints in self.endpoint_index.values() if endpoints]),
+            "reload_in_seconds": max(0, int(self._endpoint_index_expires_at - time.monotonic())),
+            "listener": "active" if self._endpoint_listener_task and not self._endpoint_listener_task.done() else "inactive"
+        }
+    
+    # =========================================
+    # ESTADO E RETRY POR ENTREGA (EVENTO, DESTINO)
+    # =========================================
+    
+    def _delivery_state_key(self, event_id: str) -> str:
+        return f"webhook_delivery_state:{event_id}"
+    
+    def _event_payload_key(self, event_id: str) -> str:
+        return f"webhook_event_payload:{event_id}"
     
-    async def _schedule_retry(self, payload: WebhookPayload):
-        """Agenda retry de um evento"""
+    async def _save_event_payload(self, payload: WebhookPayload):
+        """Guarda o payload do evento para os retries por entrega"""
+        if self.redis_client:
+            await self.redis_client.set(
+                self._event_payload_key(payload.event_id),
+                self.serializer.dumps_model(payload),
+                ex=WEBHOOK_DELIVERY_STATE_TTL
+            )
+    
+    async def _get_delivery_states(self, event_id: str) -> Dict[str, Dict[str, Any]]:
+        """Estado de cada destino do evento (status, tentativas, último erro, próximo retry)"""
+        if not self.redis_client:
+            return {}
+        
+        raw_states = await self.redis_client.hgetall(self._delivery_state_key(event_id))
+        return {
+            (target.decode() if isinstance(target, bytes) else target): json.loads(state)
+            for target, state in raw_states.items()
+        }
+    
+    async def _set_delivery_state(self, event_id: str, target: str, state: Dict[str, Any],
+                                  retry_at: Optional[datetime] = None):
+        """Grava o estado de um destino e, se houver, agenda o retry só dele"""
+        if not self.redis_client:
+            return
+        
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(self._delivery_state_key(event_id), target, json.dumps(state))
+        pipe.expire(self._delivery_state_key(event_id), WEBHOOK_DELIVERY_STATE_TTL)
+        if retry_at:
+            pipe.zadd(WEBHOOK_DELIVERY_RETRY_KEY, {f"{event_id}|{target}": retry_at.timestamp()})
+        await pipe.execute()
+    
+    async def _record_delivery_outcome(
+        self,
+        event_id: str,
+        target: str,
+        retry_policy: WebhookRetryPolicy,
+        attempt: int,
+        success: bool,
+        status_code: Optional[int] = None,
+        error: Optional[str] = None,
+        retry_after: int = 0
+    ) -> Dict[str, Any]:
+        """Registra o resultado de uma tentativa; falhas com tentativas restantes agendam retry"""
+        now = datetime.now(timezone.utc)
+        state = {
+            "status": WebhookDeliveryStatus.SUCCESS.value,
+            "attempts": attempt,
+            "status_code": status_code,
+            "error": error,
+            "updated_at": now.isoformat()
+        }
+        
+        retry_at = None
+        if not success:
+            if attempt <= retry_policy.max_retries:
+                delay = max(retry_policy.get_delay(attempt - 1), retry_after)
+                retry_at = now + timedelta(seconds=delay)
+                state["status"] = WebhookDeliveryStatus.RETRYING.value
+                state["next_retry_at"] = retry_at.isoformat()
+            else:
+                state["status"] = WebhookDeliveryStatus.FAILED.value
+        
+        await self._set_delivery_state(event_id, target, state, retry_at)
+        return state
+    
+    async def _finish_event(self, event_id: str) -> WebhookEventStatus:
+        """Status e resultado do evento a partir do estado de todas as entregas"""
+        states = await self._get_delivery_states(event_id)
+        deliveries = {target: state for target, state in states.items() if target != EVENT_LOGIC_TARGET}
+        statuses = [state["status"] for state in deliveries.values()]
+        
+        if WebhookDeliveryStatus.RETRYING.value in statuses:
+            final_status = WebhookEventStatus.RETRYING
+        elif all(status == WebhookDeliveryStatus.SUCCESS.value for status in statuses):
+            final_status = WebhookEventStatus.COMPLETED
+        else:
+            final_status = WebhookEventStatus.FAILED
+        
+        await self._update_event_status(event_id, final_status)
+        await self._save_event_result(event_id, {
+            "n8n_result": deliveries.get(N8N_TARGET),
+            "deliveries": len(deliveries),
+            "successful_deliveries": statuses.count(WebhookDeliveryStatus.SUCCESS.value),
+            "pending_retries": statuses.count(WebhookDeliveryStatus.RETRYING.value),
+            "delivery_states": deliveries,
+            "processed_at": datetime.now(timezone.utc).isoformat()
+        })
+        return final_status
+    
+    async def _process_delivery_retries(self):
+        """Reenvia apenas as entregas (evento, destino) cujo retry venceu"""
         if not self.redis_client:
             return
         
         try:
-            payload.retry_count += 1
-            retry_policy = WebhookRetryPolicy()
-            delay = retry_policy.get_delay(payload.retry_count - 1)
-            
-            # Adicionar à fila de retry com delay
-            retry_time = datetime.now(timezone.utc) + timedelta(seconds=delay)
-            await self.redis_client.zadd(
-                "webhook_retry_queue",
-                {payload.model_dump_json(): retry_time.timestamp()}
+            due = await self.redis_client.zrangebyscore(
+                WEBHOOK_DELIVERY_RETRY_KEY, min=0, max=datetime.now(timezone.utc).timestamp(),
+                start=0, num=WEBHOOK_DELIVERY_RETRY_BATCH
             )
+            if not due:
+                return
+            
+            # ZREM decide qual réplica fica com cada retry
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member in due:
+                pipe.zrem(WEBHOOK_DELIVERY_RETRY_KEY, member)
+            claimed = await pipe.execute()
+            
+            targets_by_event: Dict[str, List[str]] = {}
+            for member, removed in zip(due, claimed):
+                if removed:
+                    member = member.decode() if isinstance(member, bytes) else member
+                    event_id, target = member.split("|", 1)
+                    targets_by_event.setdefault(event_id, []).append(target)
             
-            logger.info(f"Evento {payload.event_id} agendado para retry em {delay}s")
+            for event_id, targets in targets_by_event.items():
+                # Chave única: um retry anterior do mesmo evento pode ainda estar em andamento
+                task = asyncio.create_task(self._retry_event_deliveries(event_id, targets))
+                self.processing_tasks[f"{event_id}|retry:{uuid.uuid4().hex}"] = task
+        
+        except Exception as e:
+            logger.error(f"Erro ao processar retries de entregas: {e}")
+    
+    async def _retry_event_deliveries(self, event_id: str, targets: List[str]):
+        """Nova tentativa (em paralelo) das entregas com falha de um evento"""
+        try:
+            raw_payload = await self.redis_client.get(self._event_payload_key(event_id))
+            if not raw_payload:
+                logger.warning(f"Payload do evento {event_id} expirado, retries descartados: {targets}")
+                return
+            
+            payload = self.serializer.loads_model(WebhookPayload, raw_payload)
+            states = await self._get_delivery_states(event_id)
+            endpoints = {}
+            if any(target != N8N_TARGET for target in targets):
+                endpoints = {
+                    endpoint.id: endpoint
+                    for endpoint in await self._get_active_endpoints_for_event(payload.event_type)
+                }
             
+            attempts = []
+            for target in targets:
+                attempt = states.get(target, {}).get("attempts", 0) + 1
+                if target == N8N_TARGET:
+                    attempts.append(self._attempt_n8n(payload, attempt))
+                elif target in endpoints:
+                    attempts.append(self._attempt_endpoint(payload, endpoints[target], attempt))
+                else:
+                    # Endpoint removido ou desativado desde a falha
+                    await self._set_delivery_state(event_id, target, {
+                        **states.get(target, {}),
+                        "status": WebhookDeliveryStatus.FAILED.value,
+                        "error": "Endpoint inativo ou removido",
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    })
+            
+            await asyncio.gather(*attempts)
+            await self._finish_event(event_id)
+            logger.info(f"Retry de {len(targets)} entregas do evento {event_id} concluído")
+        
         except Exception as e:
-            logger.error(f"Erro ao agendar retry: {e}")
+            logger.error(f"Erro no retry das entregas do evento {event_id}: {e}")
     
     async def start_worker(self):
         """Inicia worker para processar webhooks"""
@@ -739,22 +1315,22 @@ class WebhookManager:
         
         while True:
             try:
-                # Processar fila de retry primeiro
-                await self._process_retry_queue()
+                # Processar retries das entregas primeiro
+                await self._process_delivery_retries()
                 
                 # Processar filas normais (alta prioridade primeiro)
                 for queue in ["webhook_queue:high", "webhook_queue:normal"]:
                     if self.redis_client:
                         payload_json = await self.redis_client.rpop(queue)
                         if payload_json:
-                            payload = WebhookPayload.model_validate_json(payload_json.decode())
+                            payload = self.serializer.loads_model(WebhookPayload, payload_json)
                             
                             # Processar em background
                             task = asyncio.create_task(self._process_webhook_event(payload))
                             self.processing_tasks[payload.event_id] = task
-                            
-                            # Limpar tasks concluídas
-                            await self._cleanup_completed_tasks()
+                
+                # Limpar tasks concluídas (a cada ciclo, inclusive retries de entregas)
+                await self._cleanup_completed_tasks()
                 
                 # Aguardar um pouco antes do próximo ciclo
                 await asyncio.sleep(1)
@@ -763,34 +1339,6 @@ class WebhookManager:
                 logger.error(f"Erro no webhook worker: {e}")
                 await asyncio.sleep(5)
     
-    async def _process_retry_queue(self):
-        """Processa fila de retry"""
-        if not self.redis_client:
-            return
-        
-        try:
-            now = datetime.now(timezone.utc).timestamp()
-            
-            # Buscar eventos prontos para retry
-            ready_events = await self.redis_client.zrangebyscore(
-                "webhook_retry_queue",
-                min=0,
-                max=now,
-                withscores=False
-            )
-            
-            for event_json in ready_events:
-                # Remover da fila de retry
-                await self.redis_client.zrem("webhook_retry_queue", event_json)
-                
-                # Adicionar de volta à fila normal
-                payload = WebhookPayload.model_validate_json(event_json.decode())
-                queue = "webhook_queue:high" if self._is_high_priority(payload.event_type) else "webhook_queue:normal"
-                await self.redis_client.lpush(queue, event_json)
-                
-        except Exception as e:
-            logger.error(f"Erro ao processar fila de retry: {e}")
-    
     async def _cleanup_completed_tasks(self):
         """Limpa tasks concluídas da memória"""
         completed_tasks = []
@@ -837,7 +1385,16 @@ class WebhookManager:
             if not task.done():
                 task.cancel()
         
+        if self._endpoint_listener_task and not self._endpoint_listener_task.done():
+            self._endpoint_listener_task.cancel()
+        
+        # Gravar registros pendentes antes de fechar as conexões
+        await self.write_buffer.close()
+        
         # Fechar clientes
+        if self.supabase_async:
+            await self.supabase_async.aclose()
+        
         if self.redis_client:
             await self.redis_client.close()
         
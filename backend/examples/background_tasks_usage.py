@@ -317,8 +317,8 @@ async def example_analytics_scheduling():
         
         if response.status_code == 200:
             result = response.json()
-            task_id = result["task_id"]
-            print(f"✅ Analytics diárias agendadas: {task_id}")
+            task_id = result["schedule"]
+            print(f"✅ Analytics diárias agendadas: {task_id} ({result['cron']})")
             print(f"📅 Próxima execução: {result['scheduled_for']}")
         else:
             raise Exception(f"Failed to schedule analytics: {response.text}")
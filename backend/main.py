@@ -18,7 +18,7 @@ from api.ai_integration import include_ai_router, cleanup_ai
 from api.background import router as background_router
 from api.webhooks import router as webhooks_router
 from core.background_tasks import task_manager
-from core.webhooks import webhook_manager
+from core.webhooks import WEBHOOK_DELIVERY_RETRY_KEY, webhook_manager
 
 # Lifespan manager para AI, Background Tasks e Webhooks cleanup
 @asynccontextmanager
@@ -26,6 +26,7 @@ async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting AgentForge API with AI Integration, Background Tasks and Webhooks...")
     await task_manager.initialize()
+    task_manager.start_scheduler()
     print("✅ Background Task Manager initialized")
     await webhook_manager.initialize()
     print("✅ Webhook Manager initialized")
@@ -809,7 +810,7 @@ async def health_check():
         if webhook_manager.redis_client:
             high_queue = await webhook_manager.redis_client.llen("webhook_queue:high")
             normal_queue = await webhook_manager.redis_client.llen("webhook_queue:normal") 
-            retry_queue = await webhook_manager.redis_client.zcard("webhook_retry_queue")
+            retry_queue = await webhook_manager.redis_client.zcard(WEBHOOK_DELIVERY_RETRY_KEY)
             
             webhook_stats = {
                 "high_priority_queue": high_queue,
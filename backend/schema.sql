@@ -88,6 +88,22 @@ CREATE TABLE messages (
     FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
 );
 
+-- Document embeddings table (knowledge base)
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE document_embeddings (
+    id UUID PRIMARY KEY,
+    document_id TEXT NOT NULL,
+    organization_id TEXT,
+    chunk_id TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL,
+    embedding vector(1536),
+    position INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX idx_document_embeddings_document_id ON document_embeddings(document_id);
+
 -- Create RLS policies
 -- These policies control who can access what data
 
@@ -131,3 +147,4 @@ ALTER TABLE datastores ENABLE ROW LEVEL SECURITY;
 ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
 ALTER TABLE conversations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE messages ENABLE ROW LEVEL SECURITY;
+ALTER TABLE document_embeddings ENABLE ROW LEVEL SECURITY;
@@ -165,6 +165,10 @@ async def test_queue_operations():
         total_pending = 0
         total_running = 0
         
+        pools = stats.pop("pools", {})
+        organizations = stats.pop("organizations", {})
+        dead_letter = stats.pop("dead_letter", {})
+        
         for priority, queue_stats in stats.items():
             pending = queue_stats.get("pending", 0)
             running = queue_stats.get("running", 0)
@@ -177,6 +181,14 @@ async def test_queue_operations():
         
         print(f"📈 Total: {total_pending} pending, {total_running} running")
         
+        for pool_name, pool_stats in pools.items():
+            print(f"  🏊 {pool_name}: {pool_stats['active']}/{pool_stats['limit']} ativos")
+        
+        for org, org_stats in organizations.items():
+            print(f"  🏢 {org}: {org_stats['pending']} na sub-fila, {org_stats['in_flight']} em andamento")
+        
+        print(f"💀 Dead-letter: {sum(dead_letter.values())} tasks")
+        
         return True
     except Exception as e:
         print(f"❌ Erro nas operações de fila: {e}")
@@ -0,0 +1,35 @@
+"""
+Fixtures dos testes do backend: managers sobre Redis em memória (fakeredis com Lua)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NEXT_PUBLIC_SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.test")
+
+import fakeredis.aioredis
+
+from core import background_tasks
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.aioredis.FakeRedis()
+
+@pytest.fixture
+async def task_manager(redis_client, monkeypatch):
+    """BackgroundTaskManager inicializado sobre o fakeredis"""
+    monkeypatch.setattr(background_tasks.redis, "from_url", lambda *args, **kwargs: redis_client)
+    manager = background_tasks.BackgroundTaskManager()
+    await manager.initialize()
+    yield manager
+    
+    for task in manager.running_tasks.values():
+        task.cancel()
@@ -0,0 +1,165 @@
+"""
+Circuit breaker por host: transições de estado, timeout adaptativo e retry das tasks com circuito aberto
+"""
+
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+from core import circuit_breaker
+from core.background_tasks import TaskDefinition, TaskStatus, TaskType
+from core.circuit_breaker import (
+    CIRCUIT_MIN_REQUESTS,
+    CIRCUIT_OPEN_SECONDS,
+    CircuitBreaker,
+    CircuitOpenError
+)
+
+pytestmark = pytest.mark.anyio
+
+URL = "https://hooks.example.com/events"
+
+class FakeClock:
+    """Relógio controlado pelo teste no lugar do módulo time"""
+    
+    def __init__(self):
+        self.now = 1_700_000_000.0
+    
+    def time(self) -> float:
+        return self.now
+    
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+@pytest.fixture
+def breaker(redis_client, clock):
+    return CircuitBreaker(redis_client=redis_client)
+
+async def open_circuit(breaker: CircuitBreaker):
+    for _ in range(CIRCUIT_MIN_REQUESTS):
+        await breaker.record(URL, False)
+
+# =========================================
+# TRANSIÇÕES DE ESTADO
+# =========================================
+
+async def test_failures_below_minimum_keep_circuit_closed(breaker):
+    for _ in range(CIRCUIT_MIN_REQUESTS - 1):
+        assert await breaker.record(URL, False) == "closed"
+    
+    assert await breaker.allow(URL) == (True, False, 0)
+
+async def test_failure_rate_opens_circuit(breaker):
+    await open_circuit(breaker)
+    
+    allowed, probe, retry_after = await breaker.allow(URL)
+    assert (allowed, probe) == (False, False)
+    assert retry_after == CIRCUIT_OPEN_SECONDS
+    with pytest.raises(CircuitOpenError) as error:
+        await breaker.check(URL)
+    assert error.value.host == "hooks.example.com"
+    # Outro host não é afetado
+    assert await breaker.check("https://other.example.com/") is False
+
+async def test_half_open_admits_single_probe_and_success_closes(breaker, clock):
+    await open_circuit(breaker)
+    clock.now += CIRCUIT_OPEN_SECONDS
+    
+    assert await breaker.allow(URL) == (True, True, 0)
+    assert (await breaker.allow(URL))[0] is False
+    
+    assert await breaker.record(URL, True) == "closed"
+    assert await breaker.allow(URL) == (True, False, 0)
+
+async def test_failed_probe_reopens_circuit(breaker, clock):
+    await open_circuit(breaker)
+    clock.now += CIRCUIT_OPEN_SECONDS
+    assert await breaker.check(URL) is True
+    
+    assert await breaker.record(URL, False) == "open"
+    
+    states = await breaker.get_states()
+    assert states["hooks.example.com"]["state"] == "open"
+    assert states["hooks.example.com"]["times_opened"] == 2
+
+async def test_without_redis_every_request_passes():
+    breaker = CircuitBreaker()
+    
+    assert await breaker.allow(URL) == (True, False, 0)
+    assert await breaker.record(URL, False) is None
+    assert await breaker.timeout_for(URL, 30.0) == 30.0
+
+# =========================================
+# TIMEOUT ADAPTATIVO
+# =========================================
+
+@pytest.mark.parametrize("latency_ms, expected", [
+    (100, circuit_breaker.CIRCUIT_MIN_TIMEOUT),  # piso
+    (1000, 3.0),  # p99 × multiplicador
+    (20000, 30.0),  # limitado ao timeout da política
+])
+async def test_adaptive_timeout_from_latency_percentile(breaker, latency_ms, expected):
+    for _ in range(circuit_breaker.CIRCUIT_MIN_LATENCY_SAMPLES):
+        await breaker.record(URL, True, latency_ms)
+    
+    assert await breaker.timeout_for(URL, 30.0) == expected
+
+async def test_adaptive_timeout_needs_minimum_samples_and_is_cached(breaker, clock):
+    await breaker.record(URL, True, 1000)
+    assert await breaker.timeout_for(URL, 30.0) == 30.0
+    
+    for _ in range(circuit_breaker.CIRCUIT_MIN_LATENCY_SAMPLES):
+        await breaker.record(URL, True, 1000)
+    assert await breaker.timeout_for(URL, 30.0) == 30.0
+    
+    clock.now += circuit_breaker.CIRCUIT_TIMEOUT_CACHE_SECONDS
+    assert await breaker.timeout_for(URL, 30.0) == 3.0
+
+# =========================================
+# TASKS COM CIRCUITO ABERTO
+# =========================================
+
+async def test_webhook_task_retried_after_circuit_reopens(task_manager, clock):
+    await open_circuit(task_manager.circuit_breaker)
+    
+    task = TaskDefinition(
+        name="webhook", task_type=TaskType.WEBHOOK_DELIVERY, payload={"webhook_url": URL, "data": {}}
+    )
+    task.config.retry_policy.base_delay = 1
+    await task_manager.submit_task(task)
+    
+    before = datetime.now(timezone.utc).timestamp()
+    await task_manager.execute_task(await task_manager.dequeue_task(["queue:normal:webhook_delivery"], 1))
+    
+    assert (await task_manager.get_task_status(task.id)).status == TaskStatus.RETRYING
+    retry_at = await task_manager.redis_client.zscore("retry_queue:normal", task.id)
+    assert retry_at >= before + CIRCUIT_OPEN_SECONDS
+
+async def test_webhook_tasks_share_manager_http_client(task_manager, clock):
+    requests = []
+    
+    def respond(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, text="ok")
+    
+    task_manager._http_client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+    client = task_manager.http_client
+    for _ in range(2):
+        task = TaskDefinition(
+            name="webhook", task_type=TaskType.WEBHOOK_DELIVERY, payload={"webhook_url": URL, "data": {}}
+        )
+        await task_manager.submit_task(task)
+        await task_manager.execute_task(await task_manager.dequeue_task(["queue:normal:webhook_delivery"], 1))
+        assert (await task_manager.get_task_status(task.id)).status == TaskStatus.COMPLETED
+    
+    assert len(requests) == 2
+    assert task_manager.http_client is client
+    await task_manager.close()
+    assert client.is_closed
@@ -0,0 +1,71 @@
+"""
+Dead-letter: replay das tasks que falharam permanentemente, em lotes com throttle
+"""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from core import background_tasks
+from core.background_tasks import TaskDefinition, TaskStatus, TaskType
+
+pytestmark = pytest.mark.anyio
+
+QUEUE = "queue:normal:external_sync"
+DEAD_LETTER = "dead_letter:external_sync"
+
+async def dead_letter_tasks(manager, count: int) -> List[TaskDefinition]:
+    tasks = []
+    for i in range(count):
+        task = TaskDefinition(name=f"sync {i}", task_type=TaskType.EXTERNAL_SYNC, payload={})
+        task.config.retry_policy.max_retries = 0
+        await manager.submit_task(task)
+        assert await manager.dequeue_task([QUEUE], 1) == task.id
+        await manager._handle_task_failure(task.id, "boom", task=task)
+        tasks.append(task)
+    return tasks
+
+async def test_replay_requeues_task_and_removes_entry(task_manager, redis_client):
+    task, = await dead_letter_tasks(task_manager, 1)
+    assert [entry["task_id"] for entry in (await task_manager.list_dead_letters())["entries"]] == [task.id]
+    
+    result = await task_manager.requeue_dead_letters()
+    
+    assert result == {"requeued": 1, "skipped": 0, "remaining": 0}
+    assert await redis_client.zcard(DEAD_LETTER) == 0
+    assert await redis_client.lrange(QUEUE, 0, -1) == [task.id.encode()]
+    status = await task_manager.get_task_status(task.id)
+    assert status.status == TaskStatus.PENDING
+    assert await redis_client.hget(f"task:{task.id}", "replays") == b"1"
+    
+    # Replay repetido não duplica a task na fila
+    assert (await task_manager.requeue_dead_letters(task_ids=[task.id]))["skipped"] == 1
+    assert await redis_client.llen(QUEUE) == 1
+
+async def test_replay_selected_tasks_only(task_manager, redis_client):
+    first, second = await dead_letter_tasks(task_manager, 2)
+    
+    result = await task_manager.requeue_dead_letters(task_ids=[second.id])
+    
+    assert result == {"requeued": 1, "skipped": 0, "remaining": 1}
+    assert await redis_client.zrange(DEAD_LETTER, 0, -1) == [first.id.encode()]
+    assert await redis_client.lrange(QUEUE, 0, -1) == [second.id.encode()]
+
+async def test_replay_throttled_between_batches(task_manager, redis_client, monkeypatch):
+    await dead_letter_tasks(task_manager, 5)
+    sleep = asyncio.sleep
+    pauses: List[float] = []
+    
+    async def record_sleep(delay, *args, **kwargs):
+        pauses.append(delay)
+        await sleep(0)
+    
+    monkeypatch.setattr(background_tasks.asyncio, "sleep", record_sleep)
+    result = await task_manager.requeue_dead_letters(batch_size=2, rate=4)
+    
+    assert result["requeued"] == 5
+    assert await redis_client.llen(QUEUE) == 5
+    # 3 lotes: pausa depois de cada lote, menos o último, de até 2 tasks / 4 tasks/s
+    assert len(pauses) == 2
+    assert all(0.4 < pause <= 0.5 for pause in pauses)
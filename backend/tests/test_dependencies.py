@@ -0,0 +1,144 @@
+"""
+Dependências entre tasks (DAG): fan-in, ordem topológica e falha em cascata
+"""
+
+from typing import List
+
+import pytest
+
+from core.background_tasks import TaskDefinition, TaskHandler, TaskStatus, TaskType
+
+pytestmark = pytest.mark.anyio
+
+QUEUE = "queue:normal:external_sync"
+
+class RecordingHandler(TaskHandler):
+    """Handler de teste: registra a ordem de execução e falha nas tasks de nome `fail`"""
+    
+    def __init__(self, task_manager):
+        super().__init__(task_manager)
+        self.executed: List[str] = []
+    
+    async def execute(self, task: TaskDefinition):
+        self.executed.append(task.name)
+        if task.name == "fail":
+            raise RuntimeError("boom")
+        return {"name": task.name}
+
+def make_task(name: str, dependencies: List[TaskDefinition] = ()) -> TaskDefinition:
+    task = TaskDefinition(
+        name=name, task_type=TaskType.EXTERNAL_SYNC, payload={},
+        dependencies=[dependency.id for dependency in dependencies]
+    )
+    task.config.retry_policy.max_retries = 0
+    return task
+
+@pytest.fixture
+def handler(task_manager):
+    recording = RecordingHandler(task_manager)
+    task_manager.task_handlers[TaskType.EXTERNAL_SYNC] = recording
+    return recording
+
+async def run_queue(manager):
+    while await manager.redis_client.llen(QUEUE):
+        await manager.execute_task(await manager.dequeue_task([QUEUE], 1))
+
+async def status_of(manager, task: TaskDefinition) -> TaskStatus:
+    return (await manager.get_task_status(task.id)).status
+
+async def test_fan_in_waits_for_every_dependency(task_manager, handler):
+    shards = [make_task(f"shard {i}") for i in range(3)]
+    aggregate = make_task("aggregate", shards)
+    
+    # Fora de ordem: o grafo é submetido em ordem topológica
+    ordered = await task_manager.submit_dag([aggregate, *shards])
+    
+    assert ordered[-1] == aggregate.id
+    assert await status_of(task_manager, aggregate) == TaskStatus.WAITING
+    
+    await run_queue(task_manager)
+    
+    assert handler.executed == ["shard 0", "shard 1", "shard 2", "aggregate"]
+    assert await status_of(task_manager, aggregate) == TaskStatus.COMPLETED
+    results = await task_manager.get_dependency_results(aggregate)
+    assert [result["name"] for result in results.values()] == ["shard 0", "shard 1", "shard 2"]
+
+async def test_diamond_dag_runs_join_once(task_manager, handler):
+    root = make_task("root")
+    left, right = make_task("left", [root]), make_task("right", [root])
+    join = make_task("join", [left, right])
+    
+    await task_manager.submit_dag([join, right, left, root])
+    await run_queue(task_manager)
+    
+    assert handler.executed[0] == "root"
+    assert handler.executed[-1] == "join"
+    assert handler.executed.count("join") == 1
+
+async def test_long_chain_submitted_in_order(task_manager):
+    chain = [make_task("0")]
+    for i in range(1, 500):
+        chain.append(make_task(str(i), [chain[-1]]))
+    
+    ordered = await task_manager.submit_dag(list(reversed(chain)))
+    
+    assert ordered == [task.id for task in chain]
+
+async def test_cycle_rejected(task_manager):
+    first, second = make_task("first"), make_task("second")
+    first.dependencies = [second.id]
+    second.dependencies = [first.id]
+    
+    with pytest.raises(ValueError, match="ciclo"):
+        await task_manager.submit_dag([first, second])
+
+async def test_failure_cascades_to_transitive_dependents(task_manager, handler):
+    failing = make_task("fail")
+    child = make_task("child", [failing])
+    grandchild = make_task("grandchild", [child])
+    unrelated = make_task("unrelated")
+    await task_manager.submit_dag([failing, child, grandchild, unrelated])
+    
+    await run_queue(task_manager)
+    
+    assert handler.executed == ["fail", "unrelated"]
+    for task in (failing, child, grandchild):
+        assert await status_of(task_manager, task) == TaskStatus.FAILED
+    status = await task_manager.get_task_status(grandchild.id)
+    assert status.error["message"] == f"Dependency {failing.id} failed"
+    
+    # Só a task de origem vai para o dead-letter
+    dead_letters = await task_manager.list_dead_letters()
+    assert [entry["task_id"] for entry in dead_letters["entries"]] == [failing.id]
+
+async def test_cancel_cascades_to_dependents(task_manager, handler):
+    dependency = make_task("dependency")
+    dependent = make_task("dependent", [dependency])
+    await task_manager.submit_dag([dependency, dependent])
+    
+    await task_manager.cancel_task(dependency.id)
+    await run_queue(task_manager)
+    
+    assert handler.executed == []
+    assert await status_of(task_manager, dependent) == TaskStatus.CANCELLED
+
+async def test_dependency_on_failed_task_rejected(task_manager, handler):
+    failing = make_task("fail")
+    await task_manager.submit_task(failing)
+    await run_queue(task_manager)
+    
+    with pytest.raises(ValueError, match="falhou ou foi cancelada"):
+        await task_manager.submit_task(make_task("late", [failing]))
+
+async def test_expired_dependency_has_clear_error(task_manager, handler):
+    dependency = make_task("dependency")
+    await task_manager.submit_task(dependency)
+    await run_queue(task_manager)
+    
+    # Concluída e expirada pelo result_ttl: continua no índice de conclusão até a limpeza
+    await task_manager.redis_client.delete(f"task:{dependency.id}")
+    
+    with pytest.raises(ValueError, match="expirou"):
+        await task_manager.submit_task(make_task("late", [dependency]))
+    with pytest.raises(ValueError, match="não encontrada"):
+        await task_manager.submit_task(make_task("late", [make_task("never submitted")]))
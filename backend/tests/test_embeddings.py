@@ -0,0 +1,137 @@
+"""
+Pipeline de embeddings: cliente, chunker e cache
+"""
+
+import io
+
+import pytest
+
+from core.embeddings import (
+    FALLBACK_EMBEDDING,
+    DocumentChunker,
+    EmbeddingCache,
+    EmbeddingClient,
+    count_tokens,
+    iter_text_units
+)
+
+pytestmark = pytest.mark.anyio
+
+async def test_missing_api_key_fails_instead_of_fallback():
+    client = EmbeddingClient(api_key=None)
+    
+    with pytest.raises(RuntimeError, match="OPENROUTER_API_KEY"):
+        await client.embed_batch(["texto"])
+
+# =========================================
+# CHUNKING
+# =========================================
+
+def make_document(paragraphs: int = 20, sentences: int = 12) -> str:
+    return "\n\n".join(
+        " ".join(f"Frase {p}.{i} com algumas palavras de teste." for i in range(sentences))
+        for p in range(paragraphs)
+    )
+
+def chunk_unit_tokens(chunk: str) -> int:
+    return sum(count_tokens(unit) for unit, _ in iter_text_units(chunk))
+
+def test_chunks_respect_token_budget():
+    chunker = DocumentChunker(chunk_tokens=60)
+    chunks = list(chunker.chunks(make_document()))
+    
+    assert len(chunks) > 1
+    assert all(chunk_unit_tokens(chunk) <= 60 for chunk in chunks)
+
+def test_long_sentence_split_by_words():
+    chunks = list(DocumentChunker(chunk_tokens=50).chunks("palavra " * 500))
+    
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == ["palavra"] * 500
+
+def test_overlap_repeats_tail_of_previous_chunk():
+    chunks = list(DocumentChunker(chunk_tokens=60, overlap_tokens=15).chunks(make_document()))
+    
+    for previous, current in zip(chunks, chunks[1:]):
+        first_sentence = next(iter_text_units(current))[0]
+        assert first_sentence in previous
+
+def test_without_overlap_no_sentence_repeats():
+    chunks = list(DocumentChunker(chunk_tokens=60).chunks(make_document()))
+    sentences = [unit for chunk in chunks for unit, _ in iter_text_units(chunk)]
+    
+    assert len(sentences) == len(set(sentences)) == 20 * 12
+
+def test_streaming_source_matches_whole_text():
+    text = make_document()
+    expected = list(DocumentChunker(chunk_tokens=60, overlap_tokens=15).chunks(text))
+    
+    # Blocos pequenos cortam sentenças e separadores de parágrafo no meio
+    blocks = (text[i:i + 5] for i in range(0, len(text), 5))
+    assert list(DocumentChunker(chunk_tokens=60, overlap_tokens=15).chunks(blocks)) == expected
+    assert list(DocumentChunker(chunk_tokens=60, overlap_tokens=15).chunks(io.StringIO(text))) == expected
+    assert list(iter_text_units(text, block_size=50)) == list(iter_text_units(text))
+
+async def test_async_chunks_match_sync_chunks():
+    chunker = DocumentChunker(chunk_tokens=60, overlap_tokens=15)
+    text = make_document()
+    
+    assert [chunk async for chunk in chunker.achunks(text, batch_size=4)] == list(chunker.chunks(text))
+
+def test_overlap_must_be_smaller_than_chunk():
+    with pytest.raises(ValueError):
+        DocumentChunker(chunk_tokens=50, overlap_tokens=50)
+
+# =========================================
+# CACHE
+# =========================================
+
+MODEL = "text-embedding-3-small"
+
+class FailingRedis:
+    """Redis indisponível: toda operação falha"""
+    
+    async def mget(self, keys):
+        raise ConnectionError("redis down")
+    
+    def pipeline(self, transaction=False):
+        raise ConnectionError("redis down")
+
+async def test_cache_hit_by_normalized_content(redis_client):
+    cache = EmbeddingCache(redis_client=redis_client)
+    await cache.set_many(MODEL, [("Olá  mundo\n", [0.5, 0.25])])
+    
+    assert await cache.get_many(MODEL, [" Olá mundo", "outro texto"]) == [[0.5, 0.25], None]
+    assert cache.stats["hits_memory"] == 1
+    assert cache.stats["misses"] == 1
+    # Mesmo conteúdo com outro modelo é outra entrada
+    assert await cache.get_many("other-model", ["Olá mundo"]) == [None]
+
+async def test_cache_falls_back_to_redis_and_repopulates_lru(redis_client):
+    await EmbeddingCache(redis_client=redis_client).set_many(MODEL, [("texto", [0.5, 0.25])])
+    
+    # Outra réplica: LRU vazio, mesmo Redis
+    cache = EmbeddingCache(redis_client=redis_client)
+    assert await cache.get_many(MODEL, ["texto"]) == [[0.5, 0.25]]
+    assert cache.stats["hits_redis"] == 1
+    
+    assert await cache.get_many(MODEL, ["texto"]) == [[0.5, 0.25]]
+    assert cache.stats["hits_memory"] == 1
+    assert await redis_client.ttl(cache.key(MODEL, "texto")) > 0
+
+async def test_cache_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(max_entries=2)
+    await cache.set_many(MODEL, [("a", [1.0]), ("b", [2.0])])
+    await cache.get_many(MODEL, ["a"])
+    await cache.set_many(MODEL, [("c", [3.0])])
+    
+    assert await cache.get_many(MODEL, ["a", "b", "c"]) == [[1.0], None, [3.0]]
+    assert cache.stats["evictions"] == 1
+
+async def test_cache_ignores_fallback_vectors_and_redis_errors():
+    cache = EmbeddingCache(redis_client=FailingRedis())
+    await cache.set_many(MODEL, [("falhou", list(FALLBACK_EMBEDDING)), ("ok", [1.0])])
+    
+    assert await cache.get_many(MODEL, ["falhou", "ok"]) == [None, [1.0]]
+    assert cache.get_stats()["memory_entries"] == 1
@@ -0,0 +1,158 @@
+"""
+Vagas do escalonamento justo liberadas em sucesso, falha e cancelamento
+"""
+
+import asyncio
+
+import pytest
+
+from core import background_tasks
+from core.background_tasks import (
+    FAIR_DISPATCHED_KEY,
+    FAIR_IN_FLIGHT_KEY,
+    QUEUE_MODE_RELIABLE,
+    TaskDefinition,
+    TaskHandler,
+    TaskPriority,
+    TaskStatus,
+    TaskType
+)
+
+pytestmark = pytest.mark.anyio
+
+QUEUE = f"queue:{TaskPriority.NORMAL.value}:{TaskType.EXTERNAL_SYNC.value}"
+
+class ScriptedHandler(TaskHandler):
+    """Handler de teste: conclui, falha ou fica bloqueado até ser cancelado"""
+    
+    def __init__(self, task_manager, behavior: str):
+        super().__init__(task_manager)
+        self.behavior = behavior
+        self.started = asyncio.Event()
+    
+    async def execute(self, task: TaskDefinition):
+        self.started.set()
+        if self.behavior == "fail":
+            raise RuntimeError("boom")
+        if self.behavior == "block":
+            await asyncio.Event().wait()
+        return {"ok": True}
+
+def use_handler(manager, behavior: str) -> ScriptedHandler:
+    handler = ScriptedHandler(manager, behavior)
+    manager.task_handlers[TaskType.EXTERNAL_SYNC] = handler
+    return handler
+
+async def submit_and_dequeue(manager) -> TaskDefinition:
+    task = TaskDefinition(name="sync", task_type=TaskType.EXTERNAL_SYNC, payload={}, organization_id="org-a")
+    task.config.retry_policy.max_retries = 0
+    await manager.submit_task(task)
+    
+    assert await manager.redis_client.hgetall(FAIR_IN_FLIGHT_KEY) == {b"org-a": b"1"}
+    assert await manager.dequeue_task([QUEUE], 1) == task.id
+    return task
+
+async def assert_slots_released(manager):
+    assert await manager.redis_client.hgetall(FAIR_IN_FLIGHT_KEY) == {}
+    assert await manager.redis_client.hgetall(FAIR_DISPATCHED_KEY) == {}
+
+@pytest.fixture
+def fair_manager(task_manager):
+    task_manager.fair_scheduling = True
+    return task_manager
+
+async def test_slot_released_on_success(fair_manager):
+    use_handler(fair_manager, "ok")
+    task = await submit_and_dequeue(fair_manager)
+    
+    await fair_manager.execute_task(task.id)
+    
+    assert (await fair_manager.get_task_status(task.id)).status == TaskStatus.COMPLETED
+    await assert_slots_released(fair_manager)
+
+async def test_slot_released_on_failure(fair_manager):
+    use_handler(fair_manager, "fail")
+    task = await submit_and_dequeue(fair_manager)
+    
+    await fair_manager.execute_task(task.id)
+    
+    assert (await fair_manager.get_task_status(task.id)).status == TaskStatus.FAILED
+    await assert_slots_released(fair_manager)
+
+async def test_slot_released_on_shutdown_without_lease(fair_manager):
+    handler = use_handler(fair_manager, "block")
+    task = await submit_and_dequeue(fair_manager)
+    
+    running = asyncio.create_task(fair_manager.execute_task(task.id))
+    await handler.started.wait()
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+    
+    await assert_slots_released(fair_manager)
+
+async def test_slot_kept_until_requeued_task_finishes(fair_manager):
+    fair_manager.queue_mode = QUEUE_MODE_RELIABLE
+    handler = use_handler(fair_manager, "block")
+    task = await submit_and_dequeue(fair_manager)
+    
+    running = asyncio.create_task(fair_manager.execute_task(task.id))
+    await handler.started.wait()
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+    
+    # Devolvida à fila: continua ocupando a vaga até finalizar
+    assert await fair_manager.redis_client.hgetall(FAIR_IN_FLIGHT_KEY) == {b"org-a": b"1"}
+    
+    handler.behavior = "ok"
+    assert await fair_manager.dequeue_task([QUEUE], 1) == task.id
+    await fair_manager.execute_task(task.id)
+    await assert_slots_released(fair_manager)
+
+async def test_slot_released_while_waiting_for_retry(fair_manager):
+    use_handler(fair_manager, "fail")
+    task = TaskDefinition(name="sync", task_type=TaskType.EXTERNAL_SYNC, payload={}, organization_id="org-a")
+    task.config.retry_policy.base_delay = 0
+    await fair_manager.submit_task(task)
+    assert await fair_manager.dequeue_task([QUEUE], 1) == task.id
+    
+    await fair_manager.execute_task(task.id)
+    
+    assert (await fair_manager.get_task_status(task.id)).status == TaskStatus.RETRYING
+    await assert_slots_released(fair_manager)
+    
+    # O retry vencido volta pela sub-fila da organização e ocupa a vaga de novo
+    await fair_manager._process_retry_queue()
+    assert await fair_manager.redis_client.hgetall(FAIR_IN_FLIGHT_KEY) == {b"org-a": b"1"}
+    assert await fair_manager.dequeue_task([QUEUE], 1) == task.id
+
+async def test_released_dependent_enters_organization_queue(fair_manager):
+    use_handler(fair_manager, "ok")
+    await fair_manager.set_organization_limit("org-a", 1)
+    dependency = await submit_and_dequeue(fair_manager)
+    dependent = TaskDefinition(
+        name="sync", task_type=TaskType.EXTERNAL_SYNC, payload={}, organization_id="org-a",
+        dependencies=[dependency.id]
+    )
+    await fair_manager.submit_task(dependent)
+    other = TaskDefinition(name="sync", task_type=TaskType.EXTERNAL_SYNC, payload={}, organization_id="org-a")
+    await fair_manager.submit_task(other)
+    
+    await fair_manager.execute_task(dependency.id)
+    
+    # Limite da organização respeitado: um despacho por vez, o dependente inclusive
+    assert await fair_manager.redis_client.hgetall(FAIR_IN_FLIGHT_KEY) == {b"org-a": b"1"}
+    assert await fair_manager.redis_client.llen(QUEUE) == 1
+    assert (await fair_manager.get_organization_stats())["org-a"]["pending"] == 1
+
+async def test_fair_scheduling_requires_leases(redis_client, monkeypatch, caplog):
+    monkeypatch.setattr(background_tasks.redis, "from_url", lambda *args, **kwargs: redis_client)
+    manager = background_tasks.BackgroundTaskManager()
+    manager.queue_mode = "simple"
+    manager.fair_scheduling = True
+    
+    await manager.initialize()
+    
+    assert manager.queue_mode == QUEUE_MODE_RELIABLE
+    assert "TASK_QUEUE_MODE=simple substituído por reliable" in caplog.text
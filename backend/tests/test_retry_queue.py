@@ -0,0 +1,31 @@
+"""
+Retry queue: tasks vencidas voltam para a fila uma única vez, mesmo com várias réplicas
+"""
+
+import asyncio
+
+import pytest
+
+from core import background_tasks
+from core.background_tasks import TaskDefinition, TaskStatus, TaskType
+
+pytestmark = pytest.mark.anyio
+
+QUEUE = "queue:normal:external_sync"
+
+async def test_due_retry_enqueued_once_across_replicas(task_manager, redis_client, monkeypatch):
+    task = TaskDefinition(name="sync", task_type=TaskType.EXTERNAL_SYNC, payload={})
+    task.config.retry_policy.base_delay = 0
+    await task_manager.submit_task(task)
+    assert await task_manager.dequeue_task([QUEUE], 1) == task.id
+    await task_manager._handle_task_failure(task.id, "timeout", task=task)
+    
+    # Outra réplica sobre o mesmo Redis lê o mesmo lote vencido
+    monkeypatch.setattr(background_tasks.redis, "from_url", lambda *args, **kwargs: redis_client)
+    replica = background_tasks.BackgroundTaskManager()
+    await replica.initialize()
+    await asyncio.gather(task_manager._process_retry_queue(), replica._process_retry_queue())
+    
+    assert await redis_client.lrange(QUEUE, 0, -1) == [task.id.encode()]
+    assert await redis_client.zcard("retry_queue:normal") == 0
+    assert (await task_manager.get_task_status(task.id)).status == TaskStatus.PENDING
@@ -0,0 +1,112 @@
+"""
+Schedules recorrentes: expressões cron e disparo único pelo líder
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from core import background_tasks
+from core.background_tasks import SCHEDULE_NEXT_RUN_KEY, TaskDefinition, TaskStatus, TaskType
+from core.scheduler import CronError, CronExpression
+
+pytestmark = pytest.mark.anyio
+
+def at(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+# =========================================
+# EXPRESSÕES CRON
+# =========================================
+
+def test_fields_ranges_steps_and_lists():
+    cron = CronExpression("*/15 9-17/4 1,15 * 1-5")
+    
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == {9, 13, 17}
+    assert cron.days == {1, 15}
+    assert cron.months == set(range(1, 13))
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+
+def test_aliases_and_sunday_as_seven():
+    assert CronExpression("@daily").next_after(at(2024, 3, 10, 12, 0)) == at(2024, 3, 11, 0, 0)
+    assert CronExpression("0 0 * * 7").weekdays == {0}
+    # Valor com passo vai até o fim do campo
+    assert CronExpression("5/20 * * * *").minutes == {5, 25, 45}
+
+@pytest.mark.parametrize("expression", [
+    "* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "*/0 * * * *", "a * * * *", "5-1 * * * *"
+])
+def test_invalid_expressions_rejected(expression):
+    with pytest.raises(CronError):
+        CronExpression(expression)
+
+@pytest.mark.parametrize("expression, after, expected", [
+    # Estritamente depois: o próprio minuto não conta
+    ("0 0 * * *", at(2024, 3, 10, 0, 0), at(2024, 3, 11, 0, 0)),
+    ("*/15 * * * *", at(2024, 3, 10, 12, 7, 30), at(2024, 3, 10, 12, 15)),
+    # Virada de mês e de ano
+    ("30 6 1 * *", at(2024, 1, 31, 7, 0), at(2024, 2, 1, 6, 30)),
+    ("0 0 1 1 *", at(2024, 6, 1), at(2025, 1, 1)),
+    # 29 de fevereiro só em ano bissexto
+    ("0 12 29 2 *", at(2025, 3, 1), at(2028, 2, 29, 12, 0)),
+    # 2024-03-10 é domingo: próxima segunda
+    ("0 9 * * 1", at(2024, 3, 10, 10, 0), at(2024, 3, 11, 9, 0)),
+    # Dia do mês e dia da semana restritos: basta um dos dois (sexta, 15/03)
+    ("0 0 20 * 5", at(2024, 3, 10), at(2024, 3, 15)),
+])
+def test_next_fire_time(expression, after, expected):
+    assert CronExpression(expression).next_after(after) == expected
+
+def test_impossible_date_has_no_next_run():
+    with pytest.raises(CronError, match="sem próxima execução"):
+        CronExpression("0 0 30 2 *").next_after(at(2024, 1, 1))
+
+# =========================================
+# LÍDER DO SCHEDULER
+# =========================================
+
+def make_template() -> TaskDefinition:
+    return TaskDefinition(name="report", task_type=TaskType.ANALYTICS_PROCESSING, payload={})
+
+async def test_only_leader_fires_due_schedule(task_manager, redis_client, monkeypatch):
+    monkeypatch.setattr(background_tasks.redis, "from_url", lambda *args, **kwargs: redis_client)
+    replica = background_tasks.BackgroundTaskManager()
+    replica.worker_id = "replica-2"
+    await replica.initialize()
+    
+    await task_manager.register_schedule("report", "@hourly", make_template())
+    await redis_client.zadd(SCHEDULE_NEXT_RUN_KEY, {"report": datetime.now(timezone.utc).timestamp() - 1})
+    
+    async def scheduler_cycle(manager):
+        if await manager._acquire_scheduler_leadership():
+            return await manager.fire_due_schedules()
+        return 0
+    
+    fired = await asyncio.gather(scheduler_cycle(task_manager), scheduler_cycle(replica))
+    
+    assert sorted(fired) == [0, 1]
+    assert [task_manager.is_scheduler_leader, replica.is_scheduler_leader].count(True) == 1
+    assert await redis_client.llen("queue:normal:analytics_processing") == 1
+    # Próxima execução já calculada: outro ciclo não dispara de novo
+    assert await scheduler_cycle(task_manager) + await scheduler_cycle(replica) == 0
+
+async def test_submit_next_run_returns_task_fired_once(task_manager, redis_client, monkeypatch):
+    schedule = await task_manager.register_schedule("report", "@hourly", make_template(), submit_next_run=True)
+    again = await task_manager.register_schedule("report", "@hourly", make_template(), submit_next_run=True)
+    
+    assert again["next_task_id"] == schedule["next_task_id"]
+    assert (await task_manager.get_task_status(schedule["next_task_id"])).status == TaskStatus.SCHEDULED
+    
+    # Na hora da execução o líder encontra a trava e não submete outra task
+    run_at = datetime.fromisoformat(schedule["next_run_at"])
+    
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return run_at + timedelta(seconds=1)
+    
+    monkeypatch.setattr(background_tasks, "datetime", Later)
+    assert await task_manager.fire_due_schedules() == 0
+    assert await redis_client.zscore(SCHEDULE_NEXT_RUN_KEY, "report") == (run_at + timedelta(hours=1)).timestamp()
@@ -0,0 +1,105 @@
+"""
+Serialização dos payloads das filas: round-trip por formato e compressão, payloads legados sem header
+"""
+
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from core.background_tasks import TaskDefinition, TaskPriority, TaskType
+from core.serialization import (
+    COMPRESSION_IDS,
+    FORMAT_IDS,
+    SERIALIZATION_MAGIC,
+    SERIALIZATION_VERSION,
+    SerializationError,
+    Serializer
+)
+
+FORMATS = ["json", "orjson", "msgpack"]
+COMPRESSIONS = ["none", "zstd", "zlib"]
+
+PAYLOAD = {
+    "document_id": "doc-1",
+    "content": "Conteúdo com acentuação " * 200,  # acima do mínimo de compressão
+    "chunks": [{"index": i, "score": i / 10} for i in range(5)],
+    "flags": {"reprocess": True, "notes": None},
+}
+
+def make_task() -> TaskDefinition:
+    return TaskDefinition(
+        name="Processar documento", task_type=TaskType.DOCUMENT_PROCESSING,
+        priority=TaskPriority.HIGH, payload=PAYLOAD, organization_id="org-1", tags=["docs"]
+    )
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("format", FORMATS)
+def test_round_trip(format, compression):
+    serializer = Serializer(format=format, compression=compression)
+    data = serializer.dumps(PAYLOAD)
+    
+    assert serializer.loads(data) == PAYLOAD
+    # Header com formato e compressão; só json sem compressão continua legado
+    if serializer.is_legacy:
+        assert not data.startswith(SERIALIZATION_MAGIC)
+    else:
+        assert data[:3] == SERIALIZATION_MAGIC + bytes([SERIALIZATION_VERSION])
+        assert data[3] == FORMAT_IDS.get(format, 0)
+        assert data[4] == COMPRESSION_IDS[compression]
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("format", FORMATS)
+def test_model_round_trip(format, compression):
+    serializer = Serializer(format=format, compression=compression)
+    task = make_task()
+    
+    assert serializer.loads_model(TaskDefinition, serializer.dumps_model(task)) == task
+
+@pytest.mark.parametrize("format", FORMATS)
+def test_datetimes_encoded_as_iso(format):
+    created_at = datetime(2024, 3, 10, 12, 30, tzinfo=timezone.utc)
+    serializer = Serializer(format=format, compression="none")
+    
+    assert serializer.loads(serializer.dumps({"created_at": created_at})) == {"created_at": created_at.isoformat()}
+
+def test_small_payload_not_compressed():
+    serializer = Serializer(format="msgpack", compression="zstd", compress_min_size=1024)
+    data = serializer.dumps({"id": 1})
+    
+    assert data[4] == COMPRESSION_IDS["none"]
+    assert serializer.loads(data) == {"id": 1}
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("format", FORMATS)
+def test_reads_payloads_written_with_any_configuration(format, compression):
+    data = Serializer(format=format, compression=compression).dumps(PAYLOAD)
+    
+    # Réplicas com outra configuração durante o rollout
+    for reader in (Serializer(format="json", compression="none"), Serializer(format="msgpack", compression="zlib")):
+        assert reader.loads(data) == PAYLOAD
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("format", FORMATS)
+def test_legacy_payload_without_header_still_decodes(format, compression):
+    serializer = Serializer(format=format, compression=compression)
+    task = make_task()
+    
+    assert serializer.loads(json.dumps(PAYLOAD).encode()) == PAYLOAD
+    assert serializer.loads(json.dumps(PAYLOAD)) == PAYLOAD
+    assert serializer.loads_model(TaskDefinition, task.model_dump_json()) == task
+
+def test_newer_version_and_truncated_header_rejected():
+    serializer = Serializer(format="orjson", compression="none")
+    body = serializer.dumps(PAYLOAD)[5:]
+    
+    with pytest.raises(SerializationError, match="Versão"):
+        serializer.loads(SERIALIZATION_MAGIC + bytes([SERIALIZATION_VERSION + 1, 1, 0]) + body)
+    with pytest.raises(SerializationError, match="truncado"):
+        serializer.loads(SERIALIZATION_MAGIC + b"\x01")
+
+def test_unknown_codec_falls_back_to_legacy_json():
+    serializer = Serializer(format="cbor", compression="lz4")
+    
+    assert serializer.is_legacy
+    assert serializer.dumps(PAYLOAD) == json.dumps(PAYLOAD).encode()
@@ -0,0 +1,97 @@
+"""
+Consumo das filas respeitando os pools por tipo e o filtro de filas disponíveis
+"""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from core.background_tasks import (
+    PRIORITY_ORDER,
+    QUEUE_MODE_STREAMS,
+    TaskDefinition,
+    TaskPriority,
+    TaskType
+)
+
+pytestmark = pytest.mark.anyio
+
+PRIORITY_QUEUES = [f"queue:{priority.value}" for priority in PRIORITY_ORDER]
+
+def make_task(task_type: TaskType, priority: TaskPriority = TaskPriority.NORMAL) -> TaskDefinition:
+    return TaskDefinition(name="task", task_type=task_type, priority=priority, payload={})
+
+async def fill_pool(manager, task_type: TaskType):
+    pool = manager.task_pools[task_type]
+    for _ in range(pool.limit):
+        await pool.acquire()
+    return pool
+
+@pytest.fixture
+def streams_manager(task_manager):
+    task_manager.queue_mode = QUEUE_MODE_STREAMS
+    return task_manager
+
+async def test_full_pool_type_is_not_read_from_stream(streams_manager):
+    documents = [make_task(TaskType.DOCUMENT_PROCESSING) for _ in range(3)]
+    sync = make_task(TaskType.EXTERNAL_SYNC, TaskPriority.LOW)
+    for task in [*documents, sync]:
+        await streams_manager.submit_task(task)
+    pool = await fill_pool(streams_manager, TaskType.DOCUMENT_PROCESSING)
+    
+    task_id = await streams_manager.dequeue_task(streams_manager.available_queues(PRIORITY_QUEUES), 1)
+    
+    # Tasks do pool cheio continuam no stream, disponíveis para outras réplicas
+    assert task_id == sync.id
+    assert len(streams_manager._stream_buffer) == 0
+    
+    for _ in range(pool.limit):
+        pool.release()
+    task_id = await streams_manager.dequeue_task(streams_manager.available_queues(PRIORITY_QUEUES), 1)
+    assert task_id == documents[0].id
+
+async def test_higher_priority_stream_served_first(streams_manager):
+    normal = make_task(TaskType.EXTERNAL_SYNC)
+    critical = make_task(TaskType.EXTERNAL_SYNC, TaskPriority.CRITICAL)
+    for task in [normal, critical]:
+        await streams_manager.submit_task(task)
+    
+    queues = streams_manager.available_queues(PRIORITY_QUEUES)
+    assert await streams_manager.dequeue_task(queues, 1) == critical.id
+    assert await streams_manager.dequeue_task(queues, 1) == normal.id
+
+@pytest.mark.parametrize("queue_mode", ["simple", QUEUE_MODE_STREAMS])
+async def test_waiting_on_type_pool_does_not_hold_global_slot(task_manager, queue_mode):
+    task_manager.queue_mode = queue_mode
+    task = make_task(TaskType.DOCUMENT_PROCESSING)
+    await task_manager.submit_task(task)
+    
+    # Task legada (fila sem tipo): o tipo só é conhecido depois de consumida
+    redis_client = task_manager.redis_client
+    if queue_mode == QUEUE_MODE_STREAMS:
+        await redis_client.delete("stream:normal:document_processing")
+        await redis_client.xadd("stream:normal", {"task_id": task.id})
+    else:
+        await redis_client.delete("queue:normal:document_processing")
+        await redis_client.lpush("queue:normal", task.id)
+    
+    pool = await fill_pool(task_manager, TaskType.DOCUMENT_PROCESSING)
+    executed: List[str] = []
+    
+    async def execute_task(task_id):
+        executed.append(task_id)
+    
+    task_manager.execute_task = execute_task
+    task_id = await task_manager.dequeue_task(task_manager.available_queues(["queue:normal"]), 1)
+    await task_manager.dispatch_task(task_id)
+    await asyncio.sleep(0.01)
+    
+    assert pool.waiting == 1
+    assert task_manager.global_pool.active == 0
+    assert executed == []
+    
+    pool.release()
+    await asyncio.gather(*task_manager.running_tasks.values())
+    assert executed == [task.id]
+    assert task_manager.global_pool.active == 0
@@ -0,0 +1,68 @@
+"""
+Status de tasks lido de volta do Redis
+"""
+
+import pytest
+
+from core.background_tasks import QUEUE_MODE_STREAMS, TaskDefinition, TaskPriority, TaskStatus, TaskType
+
+pytestmark = pytest.mark.anyio
+
+def make_task(**kwargs) -> TaskDefinition:
+    return TaskDefinition(name="sync", task_type=TaskType.EXTERNAL_SYNC, payload={}, **kwargs)
+
+async def test_failed_task_status_includes_error(task_manager):
+    task = make_task()
+    task.config.retry_policy.max_retries = 0
+    await task_manager.submit_task(task)
+    
+    await task_manager._handle_task_failure(task.id, "boom", is_retryable=False, task=task)
+    
+    status = await task_manager.get_task_status(task.id)
+    assert status.status == TaskStatus.FAILED
+    assert status.error == {"message": "boom", "retryable": False}
+
+async def test_retrying_task_status_includes_error(task_manager):
+    task = make_task()
+    await task_manager.submit_task(task)
+    
+    await task_manager._handle_task_failure(task.id, "timeout", task=task)
+    
+    status = await task_manager.get_task_status(task.id)
+    assert status.status == TaskStatus.RETRYING
+    assert status.error["retryable"] is True
+    assert status.next_retry_at is not None
+
+async def test_progress_event_carries_current_status(task_manager):
+    dependency = make_task()
+    parent = make_task(dependencies=[dependency.id])
+    await task_manager.submit_dag([dependency, parent])
+    
+    await task_manager.record_shard_completion(parent.id, "shard-1", 2)
+    
+    event, = await task_manager.get_task_events(parent.id)
+    assert event["type"] == "progress"
+    assert event["status"] == TaskStatus.WAITING.value
+    assert event["message"] == "Shards concluídos: 1/2"
+
+@pytest.mark.parametrize("queue_mode", ["simple", QUEUE_MODE_STREAMS])
+async def test_cancel_removes_task_from_its_queues(task_manager, queue_mode):
+    task_manager.queue_mode = queue_mode
+    retrying = make_task(priority=TaskPriority.HIGH)
+    pending = make_task(priority=TaskPriority.HIGH)
+    for task in (retrying, pending):
+        await task_manager.submit_task(task)
+    assert await task_manager.dequeue_task(["queue:high:external_sync"], 1) == retrying.id
+    await task_manager._handle_task_failure(retrying.id, "timeout", task=retrying)
+    
+    stats = await task_manager.get_queue_stats()
+    assert (stats["high"]["pending"], stats["high"]["retrying"]) == (1, 1)
+    
+    for task in (pending, retrying):
+        assert await task_manager.cancel_task(task.id)
+        assert (await task_manager.get_task_status(task.id)).status == TaskStatus.CANCELLED
+    
+    # Na stream a entrada fica até ser lida e descartada pelo consumidor
+    stats = await task_manager.get_queue_stats()
+    assert stats["high"]["pending"] == (1 if queue_mode == QUEUE_MODE_STREAMS else 0)
+    assert stats["high"]["retrying"] == 0
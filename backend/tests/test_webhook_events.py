@@ -0,0 +1,74 @@
+"""
+Criação de eventos de webhook: gravação no Supabase sem bloquear o event loop
+"""
+
+import threading
+from typing import Any, Dict, List
+
+import pytest
+
+from core import webhooks
+from core.webhooks import WebhookEventType
+
+pytestmark = pytest.mark.anyio
+
+class FakeQuery:
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = table
+        self.row: Dict[str, Any] = {}
+    
+    def insert(self, row, returning=None):
+        self.row = row
+        return self
+    
+    def run(self):
+        self.client.inserted.append((self.table, self.row["id"]))
+        self.client.threads.append(threading.current_thread())
+        return self
+
+class FakeSyncClient:
+    """supabase-py: execute() síncrono"""
+    
+    def __init__(self):
+        self.inserted: List[tuple] = []
+        self.threads: List[threading.Thread] = []
+    
+    def table(self, name: str):
+        query = FakeQuery(self, name)
+        query.execute = query.run
+        return query
+
+class FakeAsyncClient(FakeSyncClient):
+    """PostgREST assíncrono: execute() é corrotina"""
+    
+    def table(self, name: str):
+        query = FakeQuery(self, name)
+        
+        async def execute():
+            return query.run()
+        
+        query.execute = execute
+        return query
+
+@pytest.fixture
+def webhook_manager(redis_client):
+    manager = webhooks.WebhookManager()
+    manager.redis_client = redis_client
+    manager.supabase_client = FakeSyncClient()
+    return manager
+
+async def test_event_recorded_with_async_client_before_enqueue(webhook_manager, redis_client):
+    webhook_manager.supabase_async = FakeAsyncClient()
+    
+    event_id = await webhook_manager.create_event(WebhookEventType.USER_REGISTERED, {"email": "a@b.c"})
+    
+    assert webhook_manager.supabase_async.inserted == [("webhook_events", event_id)]
+    assert webhook_manager.supabase_client.inserted == []
+    assert await redis_client.llen("webhook_queue:high") == 1
+
+async def test_sync_client_runs_off_event_loop(webhook_manager):
+    event_id = await webhook_manager.create_event(WebhookEventType.USER_REGISTERED, {})
+    
+    assert webhook_manager.supabase_client.inserted == [("webhook_events", event_id)]
+    assert webhook_manager.supabase_client.threads[0] is not threading.main_thread()
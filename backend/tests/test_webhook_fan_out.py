@@ -0,0 +1,100 @@
+"""
+Fan-out dos webhooks: limites de requisições simultâneas global e por host de destino
+"""
+
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+from core import webhooks
+from core.webhooks import (
+    WebhookEndpoint,
+    WebhookEventStatus,
+    WebhookEventType,
+    WebhookPayload,
+    WebhookRetryPolicy
+)
+
+pytestmark = pytest.mark.anyio
+
+HOSTS = ["a.example.com", "b.example.com", "c.example.com"]
+ENDPOINTS_PER_HOST = 6
+MAX_IN_FLIGHT = 4
+MAX_PER_HOST = 2
+
+class ConcurrencyTransport:
+    """Transporte HTTP simulado que mede as requisições simultâneas (total e por host)"""
+    
+    def __init__(self):
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self.total = 0
+        self.max_total = 0
+        self.requests = 0
+    
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.in_flight[host] += 1
+        self.total += 1
+        self.max_in_flight[host] = max(self.max_in_flight[host], self.in_flight[host])
+        self.max_total = max(self.max_total, self.total)
+        try:
+            await asyncio.sleep(0.01)
+            self.requests += 1
+            return httpx.Response(200, text="ok")
+        finally:
+            self.in_flight[host] -= 1
+            self.total -= 1
+
+@pytest.fixture
+def transport():
+    return ConcurrencyTransport()
+
+@pytest.fixture
+def webhook_manager(redis_client, transport, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_MAX_PER_HOST", MAX_PER_HOST)
+    manager = webhooks.WebhookManager()
+    manager.redis_client = redis_client
+    manager.write_buffer.redis_client = redis_client
+    manager.http_client = httpx.AsyncClient(transport=httpx.MockTransport(transport.handle))
+    manager.delivery_semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+    
+    registered = [
+        WebhookEndpoint(
+            id=f"{host}-{i}", url=f"https://{host}/hook/{i}",
+            events=[WebhookEventType.USER_REGISTERED], retry_policy=WebhookRetryPolicy(base_delay=0)
+        )
+        for host in HOSTS for i in range(ENDPOINTS_PER_HOST)
+    ]
+    
+    async def get_active_endpoints(event_type):
+        return registered
+    
+    async def update_event_status(event_id, status, error_message=None):
+        manager.event_statuses[event_id] = status
+    
+    async def handle_event_logic(payload):
+        pass
+    
+    manager.event_statuses = {}
+    manager._get_active_endpoints_for_event = get_active_endpoints
+    manager._update_event_status = update_event_status
+    manager._handle_event_logic = handle_event_logic
+    return manager
+
+async def test_fan_out_respects_global_and_per_host_limits(webhook_manager, transport):
+    payload = WebhookPayload(
+        event_type=WebhookEventType.USER_REGISTERED, event_id="ev1",
+        timestamp=datetime.now(timezone.utc), data={}
+    )
+    
+    await webhook_manager._process_webhook_event(payload)
+    
+    assert transport.requests == len(HOSTS) * ENDPOINTS_PER_HOST
+    assert webhook_manager.event_statuses["ev1"] == WebhookEventStatus.COMPLETED
+    # Os limites são atingidos, nunca ultrapassados
+    assert transport.max_total == MAX_IN_FLIGHT
+    assert max(transport.max_in_flight.values()) == MAX_PER_HOST
@@ -0,0 +1,165 @@
+"""
+Retry por entrega (evento, destino) dos webhooks
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import List, Set
+
+import pytest
+
+from core import webhooks
+from core.webhooks import (
+    WEBHOOK_DELIVERY_RETRY_KEY,
+    WebhookDeliveryStatus,
+    WebhookEndpoint,
+    WebhookEventStatus,
+    WebhookEventType,
+    WebhookPayload,
+    WebhookRetryPolicy
+)
+
+pytestmark = pytest.mark.anyio
+
+HOSTS = ["good", "bad"]
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = ""
+        self.headers = {}
+
+class FakeN8N:
+    base_url = "https://n8n.local"
+    
+    async def send_webhook(self, event_type, data):
+        return {"status": "success", "status_code": 200}
+
+class FakeEndpoints:
+    """Destinos HTTP em memória; hosts em `down` respondem 500"""
+    
+    def __init__(self):
+        self.calls: List[str] = []
+        self.down: Set[str] = set()
+    
+    async def post(self, url, **kwargs):
+        host = url.split("/")[2].split(".")[0]
+        self.calls.append(host)
+        return FakeResponse(500 if host in self.down else 200)
+
+@pytest.fixture
+def endpoints():
+    return FakeEndpoints()
+
+@pytest.fixture
+def webhook_manager(redis_client, endpoints):
+    manager = webhooks.WebhookManager()
+    manager.redis_client = redis_client
+    manager.write_buffer.redis_client = redis_client
+    manager.http_client.post = endpoints.post
+    manager.n8n_client = FakeN8N()
+    
+    policy = WebhookRetryPolicy(max_retries=2, base_delay=0)
+    registered = [
+        WebhookEndpoint(
+            id=host, url=f"https://{host}.example.com/hook",
+            events=[WebhookEventType.USER_REGISTERED], retry_policy=policy
+        )
+        for host in HOSTS
+    ]
+    
+    async def get_active_endpoints(event_type):
+        return registered
+    
+    async def update_event_status(event_id, status, error_message=None):
+        manager.event_statuses[event_id] = status
+    
+    async def handle_event_logic(payload):
+        pass
+    
+    manager.event_statuses = {}
+    manager._get_active_endpoints_for_event = get_active_endpoints
+    manager._update_event_status = update_event_status
+    manager._handle_event_logic = handle_event_logic
+    return manager
+
+def make_payload(event_id: str = "ev1") -> WebhookPayload:
+    return WebhookPayload(
+        event_type=WebhookEventType.USER_REGISTERED,
+        event_id=event_id,
+        timestamp=datetime.now(timezone.utc),
+        data={}
+    )
+
+async def run_due_retries(manager):
+    await manager._process_delivery_retries()
+    await asyncio.gather(*manager.processing_tasks.values())
+
+async def test_only_failed_destination_is_retried(webhook_manager, endpoints):
+    endpoints.down.add("bad")
+    await webhook_manager._process_webhook_event(make_payload())
+    
+    assert sorted(endpoints.calls) == ["bad", "good"]
+    assert await webhook_manager.redis_client.zrange(WEBHOOK_DELIVERY_RETRY_KEY, 0, -1) == [b"ev1|bad"]
+    
+    endpoints.calls.clear()
+    endpoints.down.clear()
+    await run_due_retries(webhook_manager)
+    
+    assert endpoints.calls == ["bad"]
+    assert webhook_manager.event_statuses["ev1"] == WebhookEventStatus.COMPLETED
+    states = await webhook_manager._get_delivery_states("ev1")
+    assert states["bad"]["status"] == WebhookDeliveryStatus.SUCCESS.value
+    assert states["bad"]["attempts"] == 2
+
+async def test_retry_does_not_replace_running_retry(webhook_manager, endpoints):
+    endpoints.down.add("bad")
+    for event_id in ["ev1", "ev2"]:
+        await webhook_manager._process_webhook_event(make_payload(event_id))
+    
+    release = asyncio.Event()
+    retried: List[List[str]] = []
+    
+    async def slow_retry(event_id, targets):
+        retried.append(targets)
+        await release.wait()
+    
+    webhook_manager._retry_event_deliveries = slow_retry
+    await webhook_manager._process_delivery_retries()
+    
+    # Novo retry do mesmo evento enquanto o anterior ainda está em andamento
+    await webhook_manager.redis_client.zadd(WEBHOOK_DELIVERY_RETRY_KEY, {"ev1|bad": 0})
+    await webhook_manager._process_delivery_retries()
+    
+    assert len(webhook_manager.processing_tasks) == 3
+    
+    release.set()
+    await asyncio.gather(*webhook_manager.processing_tasks.values())
+    await webhook_manager._cleanup_completed_tasks()
+    assert webhook_manager.processing_tasks == {}
+
+def test_endpoint_row_retry_policy_parsed(webhook_manager):
+    row = {
+        "id": "ep1", "url": "https://good.example.com/hook", "events": ["user.registered", "unknown"],
+        "is_active": True, "retry_policy": {"max_retries": 2, "base_delay": "5", "timeout": None}
+    }
+    
+    endpoint = webhook_manager._endpoint_from_row(row)
+    
+    assert endpoint.events == [WebhookEventType.USER_REGISTERED]
+    assert endpoint.retry_policy == WebhookRetryPolicy(max_retries=2, base_delay=5)
+    # Sem a coluna (ou JSON como texto)
+    assert webhook_manager._endpoint_from_row({**row, "retry_policy": None}).retry_policy == WebhookRetryPolicy()
+    row["retry_policy"] = '{"max_retries": 1}'
+    assert webhook_manager._endpoint_from_row(row).retry_policy.max_retries == 1
+
+async def test_event_error_marks_failed_without_event_retry(webhook_manager, endpoints):
+    async def broken_endpoints(event_type):
+        raise RuntimeError("supabase down")
+    
+    webhook_manager._get_active_endpoints_for_event = broken_endpoints
+    await webhook_manager._process_webhook_event(make_payload())
+    
+    assert webhook_manager.event_statuses["ev1"] == WebhookEventStatus.FAILED
+    assert endpoints.calls == []
+    assert await webhook_manager.redis_client.keys("webhook_retry_queue") == []
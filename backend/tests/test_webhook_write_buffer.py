@@ -0,0 +1,80 @@
+"""
+Gravação em lote dos registros de webhooks: uma linha inválida não derruba o lote
+"""
+
+from typing import Any, Dict, List
+
+import pytest
+
+from core.webhooks import WebhookWriteBuffer
+
+pytestmark = pytest.mark.anyio
+
+class FakeQuery:
+    def __init__(self, db: "FakePostgrest", table: str):
+        self.db = db
+        self.table = table
+        self.rows: List[Dict[str, Any]] = []
+        self.ids: List[str] = []
+        self.update_data: Dict[str, Any] = {}
+    
+    def insert(self, rows, returning=None):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+    
+    def update(self, data, returning=None):
+        self.update_data = data
+        return self
+    
+    def in_(self, column, values):
+        self.ids = list(values)
+        return self
+    
+    def eq(self, column, value):
+        self.ids = [value]
+        return self
+    
+    async def execute(self):
+        # Como o PostgREST: qualquer linha inválida rejeita a requisição inteira
+        if any(row.get("id") == "bad" for row in self.rows) or "bad" in self.ids:
+            raise Exception("violates constraint")
+        self.db.inserted.extend(row["id"] for row in self.rows)
+        self.db.updated.extend(self.ids)
+
+class FakePostgrest:
+    def __init__(self):
+        self.inserted: List[str] = []
+        self.updated: List[str] = []
+    
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+@pytest.fixture
+def buffer():
+    write_buffer = WebhookWriteBuffer(batch_size=10)
+    write_buffer.db = FakePostgrest()
+    return write_buffer
+
+async def test_bad_delivery_row_does_not_drop_batch(buffer):
+    for delivery_id in ["d1", "bad", "d2"]:
+        buffer.deliveries.append({"id": delivery_id})
+    
+    await buffer.flush()
+    
+    assert buffer.db.inserted == ["d1", "d2"]
+
+async def test_bad_status_row_does_not_drop_batch(buffer):
+    for event_id in ["e1", "bad", "e2"]:
+        buffer.statuses[event_id] = {"status": "completed", "processed_at": "2024-01-01T00:00:00+00:00"}
+    
+    await buffer.flush()
+    
+    assert buffer.db.updated == ["e1", "e2"]
+
+async def test_valid_batch_written_in_one_request(buffer):
+    for delivery_id in ["d1", "d2", "d3"]:
+        buffer.deliveries.append({"id": delivery_id})
+    
+    await buffer.flush()
+    
+    assert buffer.db.inserted == ["d1", "d2", "d3"]
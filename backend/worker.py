@@ -25,25 +25,32 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Importar task manager
-from core.background_tasks import task_manager, TaskPriority
+from core.background_tasks import task_manager, PRIORITY_ORDER, QUEUE_BLOCK_TIMEOUT
 
 class BackgroundWorker:
     """Worker para processar background tasks"""
     
-    def __init__(self, queues: List[str] = None, max_concurrent_tasks: int = 10):
-        self.queues = queues or [f"queue:{p.value}" for p in TaskPriority]
+    def __init__(self, queues: List[str] = None, max_concurrent_tasks: int = 10, block_timeout: int = QUEUE_BLOCK_TIMEOUT):
+        self.queues = queues or [f"queue:{p.value}" for p in PRIORITY_ORDER]
         self.max_concurrent_tasks = max_concurrent_tasks
+        self.block_timeout = block_timeout
         self.running = False
-        self.worker_id = f"worker-{os.getpid()}"
-        
+        self.worker_id = task_manager.worker_id
+    
     async def start(self):
         """Inicia o worker"""
         logger.info(f"🚀 Starting Background Worker {self.worker_id}")
-        logger.info(f"📊 Monitoring queues: {self.queues}")
+        logger.info(f"📊 Monitoring queues: {self.queues} (block timeout {self.block_timeout}s)")
         logger.info(f"⚡ Max concurrent tasks: {self.max_concurrent_tasks}")
+        pool_limits = ", ".join(f"{t.value}={p.limit}" for t, p in task_manager.task_pools.items())
+        logger.info(f"🏊 Task pools: {pool_limits}")
+        logger.info(f"🔒 Queue mode: {task_manager.queue_mode}")
         
         # Inicializar task manager
         await task_manager.initialize()
+        task_manager.configure_pools(max_concurrent_tasks=self.max_concurrent_tasks)
+        task_manager.start_lease_maintenance()
+        task_manager.start_scheduler()
         
         self.running = True
         
@@ -74,50 +81,37 @@ class BackgroundWorker:
         
         while self.running:
             try:
-                # Verificar se há espaço para mais tasks
-                active_tasks = len([t for t in task_manager.running_tasks.values() if not t.done()])
-                
-                if active_tasks >= self.max_concurrent_tasks:
-                    logger.debug(f"⏳ Max concurrent tasks reached ({active_tasks}), waiting...")
-                    await asyncio.sleep(1)
-                    continue
+                # Aguardar vaga nos pools (global e por tipo) e obter filas consumíveis
+                available_queues = await task_manager.wait_for_capacity(self.queues)
                 
                 # Processar retry queue primeiro
                 await task_manager._process_retry_queue()
                 
-                # Processar filas normais por prioridade
-                task_found = False
-                
-                for queue in self.queues:
-                    try:
-                        task_id = await task_manager.redis_client.rpop(queue)
-                        if task_id:
-                            task_id = task_id.decode()
-                            logger.info(f"📝 Processing task {task_id} from {queue}")
-                            
-                            # Executar task em background
-                            task = asyncio.create_task(task_manager.execute_task(task_id))
-                            task_manager.running_tasks[task_id] = task
-                            
-                            tasks_processed += 1
-                            task_found = True
-                            
-                            # Log estatísticas a cada 10 tasks
-                            if tasks_processed % 10 == 0:
-                                uptime = datetime.now(timezone.utc) - start_time
-                                logger.info(f"📈 Stats: {tasks_processed} tasks processed, uptime: {uptime}")
-                            
-                            break
-                    except Exception as e:
-                        logger.error(f"❌ Error processing queue {queue}: {e}")
+                # Aguardar task nas filas em ordem estrita de prioridade (BRPOP)
+                try:
+                    task_id = await task_manager.dequeue_task(
+                        available_queues,
+                        timeout=task_manager.pool_block_timeout(self.block_timeout)
+                    )
+                    if task_id:
+                        logger.info(f"📝 Processing task {task_id}")
+                        
+                        # Executar task em background no pool do seu tipo
+                        await task_manager.dispatch_task(task_id)
+                        
+                        tasks_processed += 1
+                        
+                        # Log estatísticas a cada 10 tasks
+                        if tasks_processed % 10 == 0:
+                            uptime = datetime.now(timezone.utc) - start_time
+                            logger.info(f"📈 Stats: {tasks_processed} tasks processed, uptime: {uptime}")
+                except Exception as e:
+                    logger.error(f"❌ Error processing queues {self.queues}: {e}")
+                    await asyncio.sleep(1)
                 
                 # Limpar tasks concluídas
                 await task_manager._cleanup_completed_tasks()
-                
-                # Se não encontrou nenhuma task, aguardar um pouco
-                if not task_found:
-                    await asyncio.sleep(0.5)
-                
+            
             except Exception as e:
                 logger.error(f"❌ Error in worker loop: {e}")
                 await asyncio.sleep(5)  # Aguardar mais tempo em caso de erro
@@ -0,0 +1,3 @@
+-- Retry policy per webhook endpoint (max_retries, backoff_factor, base_delay, max_delay, timeout)
+-- Missing fields fall back to the backend defaults
+ALTER TABLE public.webhook_endpoints ADD COLUMN IF NOT EXISTS retry_policy JSONB;